@@ -0,0 +1,64 @@
+import numpy as np
+import shapely as shp
+from functools import lru_cache
+from pyproj import Transformer
+
+
+# Cálculo de área dos cacos. Antes o Splitter reprojetava o GeoDataFrame inteiro (to_crs) para a zona UTM da longitude média
+# do grid, só para ler o .area. Aqui a zona é escolhida por caco (centro do bbox do caco), então grids que cruzam a divisa
+# entre duas zonas têm a área de cada caco calculada na sua própria zona. Apenas as coordenadas são projetadas (shapely.transform),
+# sem copiar o GeoDataFrame, e os Transformers do pyproj são criados uma única vez por processo (cache).
+
+# Dicionário com zonas UTM e seus respectivos códigos EPSG (apenas para o Brasil)
+UTM_EPSG_BRAZIL = {
+    18: 32718,  # UTM Zona 18S
+    19: 32719,  # UTM Zona 19S
+    20: 32720,  # UTM Zona 20S
+    21: 32721,  # UTM Zona 21S
+    22: 32722,  # UTM Zona 22S
+    23: 32723,  # UTM Zona 23S
+    24: 32724,  # UTM Zona 24S
+    25: 32725   # UTM Zona 25S
+}
+
+
+@lru_cache(maxsize=None)
+def get_transformer(epsg_origem, epsg_destino):
+    """
+    Transformer do pyproj entre dois EPSG, criado uma vez por processo
+    """
+    return Transformer.from_crs(epsg_origem, epsg_destino, always_xy=True)
+
+
+def utm_zone(longitude):
+    """
+    Zona UTM de cada longitude. Longitudes fora do Brasil são limitadas à zona mais próxima do UTM_EPSG_BRAZIL
+    """
+    zona = np.floor((np.asarray(longitude, dtype=float) + 180) / 6).astype(np.int64) + 1
+    return np.clip(zona, min(UTM_EPSG_BRAZIL), max(UTM_EPSG_BRAZIL))
+
+
+def area_ha(geoms, epsg=4674):
+    """
+    Área em hectares de um array de geometrias, cada uma projetada na zona UTM do centro do seu bbox.
+
+    Args:
+        geoms - array de geometrias (shapely) no sistema epsg
+        epsg - EPSG das geometrias
+
+    Returns:
+        np.array com a área (ha) de cada geometria
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    area = np.zeros(len(geoms))
+    if not len(geoms):
+        return area
+
+    xmin, _, xmax, _ = shp.bounds(geoms).T
+    zonas = utm_zone((xmin + xmax) / 2)
+    for zona in np.unique(zonas):
+        mascara = zonas == zona
+        transformer = get_transformer(epsg, UTM_EPSG_BRAZIL[int(zona)])
+        projetadas = shp.transform(geoms[mascara], lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+        area[mascara] = shp.area(projetadas) / 10000
+    return area
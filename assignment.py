@@ -0,0 +1,137 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import geopandas as gpd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely as shp
+from shapely.strtree import STRtree
+from input_source import input_files, read_geo_metadata
+
+
+# Atribuição das feicoes às células do grid em uma única passada. Sem ela cada grid consulta o input pelo seu bbox, então uma
+# feicao que toca 40 grids é lida, desserializada e indexada 40 vezes. Aqui o input_file é lido uma vez, em blocos, e cada
+# feicao é atribuída a todas as células cujo bbox o bbox dela toca (a mesma semântica do && do PostGIS e do query_bbox).
+# O resultado é um dataset Parquet particionado por célula (assignment_dir/n_grid=<id>/...), com a geometria em WKB como
+# está no input_file, então cada grid lê apenas a sua partição (ver AssignmentInputSource).
+#
+# O fator de duplicação (em quantas células cada feicao cai) é gravado em assignment_dir/_duplicacao.json.
+#
+#   python assignment.py --grid inputs/grid.parquet --input inputs/input.parquet --output inputs/assignment
+
+ARQUIVO_DUPLICACAO = '_duplicacao.json'
+
+
+def _geo_sem_covering(geo):
+    # Metadado geo do input sem o covering: a coluna bbox do input não vai para o dataset
+    geo = json.loads(geo)
+    for coluna in geo.get('columns', {}).values():
+        coluna.pop('covering', None)
+    return json.dumps(geo).encode('utf-8')
+
+
+def _duplicacao(contagens, ids, celulas_por_grid, top=10):
+    # Resumo do fator de duplicação. Feicoes sem célula (fora do grid) ficam fora dos percentis
+    atribuidas = contagens[contagens > 0]
+    ordem = np.argsort(contagens)[::-1][:top]
+    resumo = {'n_features': int(len(contagens)),
+              'n_features_sem_celula': int((contagens == 0).sum()),
+              'n_pares': int(contagens.sum()),
+              'n_celulas_com_feicoes': int((celulas_por_grid > 0).sum()),
+              'features_por_celula_max': int(celulas_por_grid.max()) if len(celulas_por_grid) else 0}
+    if len(atribuidas):
+        resumo.update({'fator_medio': round(float(atribuidas.mean()), 3),
+                       'fator_p50': float(np.quantile(atribuidas, 0.5)),
+                       'fator_p90': float(np.quantile(atribuidas, 0.9)),
+                       'fator_p99': float(np.quantile(atribuidas, 0.99)),
+                       'fator_max': int(atribuidas.max()),
+                       'features_em_mais_de_uma_celula': int((atribuidas > 1).sum()),
+                       'mais_duplicadas': [{'id': ids[i], 'n_celulas': int(contagens[i])} for i in ordem]})
+    return resumo
+
+
+def build_assignment(grid_gdf, input_file, output_dir, batch_rows=200000):
+    """
+    Atribui as feicoes do input_file às células do grid_gdf e grava o dataset particionado por célula.
+
+    Args:
+        grid_gdf - grid (ou plano) com id e geometria
+        input_file - GeoParquet do input (arquivo ou dataset)
+        output_dir - diretório do dataset. É substituído apenas quando a atribuição termina
+        batch_rows - feicoes lidas por vez do input_file
+
+    Returns:
+        Dicionário com o resumo do fator de duplicação
+    """
+    start_time = time.time()
+    geom_col = read_geo_metadata(input_file)['primary_column']
+    colunas = ['id', 'id_layer', geom_col]
+
+    ids_grid = grid_gdf['id'].to_numpy(dtype=np.int64)
+    # Envelopes das células: o STRtree sem predicado compara apenas os envelopes
+    tree = STRtree(shp.box(*shp.bounds(grid_gdf.geometry.values).T))
+    celulas_por_grid = np.zeros(len(ids_grid), dtype=np.int64)
+    contagens, ids = [], []
+
+    arquivos = input_files(input_file)
+    schema = pq.read_schema(arquivos[0])
+    schema = pa.schema([schema.field(c) for c in colunas] + [pa.field('n_grid', pa.int64())],
+                       metadata={b'geo': _geo_sem_covering(schema.metadata[b'geo'])})
+
+    def blocos():
+        for arquivo in arquivos:
+            for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=batch_rows, columns=colunas):
+                geoms = shp.from_wkb(batch.column(geom_col).to_numpy(zero_copy_only=False))
+                feicao, celula = tree.query(geoms)
+                # Ordena por célula e, dentro da célula, pela ordem do input_file (a ordem do query_bbox)
+                ordem = np.lexsort((feicao, celula))
+                feicao, celula = feicao[ordem], celula[ordem]
+                contagens.append(np.bincount(feicao, minlength=batch.num_rows))
+                ids.append(batch.column('id').to_numpy(zero_copy_only=False))
+                celulas_por_grid[:] += np.bincount(celula, minlength=len(ids_grid))
+                if len(feicao):
+                    pares = batch.take(pa.array(feicao)).append_column('n_grid', pa.array(ids_grid[celula]))
+                    yield pares.cast(schema)
+
+    temporario = output_dir.rstrip('/') + '.tmp'
+    if os.path.isdir(temporario):
+        shutil.rmtree(temporario)
+    ds.write_dataset(blocos(), temporario, schema=schema, format='parquet',
+                     partitioning=ds.partitioning(pa.schema([('n_grid', pa.int64())]), flavor='hive'),
+                     basename_template='part-{i}.parquet', preserve_order=True,
+                     max_partitions=max(len(ids_grid), 1), existing_data_behavior='overwrite_or_ignore')
+    os.makedirs(temporario, exist_ok=True)
+
+    contagens = np.concatenate(contagens) if contagens else np.zeros(0, dtype=np.int64)
+    ids = np.concatenate(ids).tolist() if ids else []
+    resumo = _duplicacao(contagens, ids, celulas_por_grid)
+    resumo['segundos'] = round(time.time() - start_time, 2)
+    with open(os.path.join(temporario, ARQUIVO_DUPLICACAO), 'w', encoding='utf-8') as f:
+        json.dump(resumo, f, indent=2, default=str)
+
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(temporario, output_dir)
+
+    logging.info(f"Atribuição de {resumo['n_features']} feicoes a {resumo['n_celulas_com_feicoes']} células gravada em "
+                 f"{output_dir}: {resumo['n_pares']} pares, fator de duplicação médio {resumo.get('fator_medio')}, "
+                 f"p99 {resumo.get('fator_p99')}, máximo {resumo.get('fator_max')} ({resumo['segundos']:.2f} segundos)")
+    return resumo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Atribui as feicoes do input às células do grid em uma única passada')
+    parser.add_argument('--grid', required=True, help='Grid (ou plano) GeoParquet')
+    parser.add_argument('--input', required=True, help='input_file (arquivo ou dataset)')
+    parser.add_argument('--output', required=True, help='Diretório do dataset particionado por célula')
+    parser.add_argument('--batch-rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    resumo = build_assignment(gpd.read_parquet(args.grid), args.input, args.output, batch_rows=args.batch_rows)
+    print(json.dumps(resumo, indent=2, default=str))
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely as shp
+from multiprocessing import Pool
+from input_source import MemoryInputSource
+from metrics import rss_mb, peak_rss_mb
+from split import Splitter
+from synthetic import generate_mosaic
+
+
+# Benchmark offline do split, sem banco. Cada cenário gera um input sintético (ver synthetic.py) para um grid e executa as
+# etapas do Splitter diretamente em memória (_intersection, prepare_split_line, perform_split, process_overlapping e
+# format_gdf_broken_glass), medindo o tempo e o RSS de cada etapa. Cada cenário roda em um processo novo, para que o pico
+# de memória de um cenário não contamine o próximo.
+#
+# Os resultados são acrescentados em benchmarks/results.jsonl com o commit atual, então regressões entre commits aparecem
+# no --compare:
+#   python benchmark.py                      # todos os cenários
+#   python benchmark.py --scenario enormes --repeats 5
+#   python benchmark.py --compare            # último resultado de cada cenário contra o commit anterior
+
+CELL = (-50.0, -10.0, -49.0, -9.0)
+
+CENARIOS = {
+    'denso': dict(n_parcels=3000, overlap_rate=0.1, n_vertices=40),
+    'sobreposicao': dict(n_parcels=1000, overlap_rate=0.5, n_vertices=40),
+    'muitos_vertices': dict(n_parcels=500, overlap_rate=0.1, n_vertices=400),
+    'quase_coincidente': dict(n_parcels=1000, overlap_rate=0.1, n_vertices=40, near_coincident_rate=0.3),
+    'enormes': dict(n_parcels=500, overlap_rate=0.1, n_vertices=40, n_huge=3, huge_parts=80, huge_vertices=4000),
+}
+
+ETAPAS = ['intersection', 'prepare_split_line', 'perform_split', 'process_overlapping', 'format_gdf_broken_glass']
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return 'desconhecido'
+
+
+def _run_scenario(args):
+    """
+    Executa um cenário (em um processo do Pool). Retorna o registro de resultado.
+    """
+    nome, parametros, repeats, seed, config_path = args
+    gdf = generate_mosaic(cell=CELL, seed=seed, **parametros)
+    source = MemoryInputSource(gdf)
+    grid_gdf = gpd.GeoDataFrame(data={'id': [1]}, geometry=[shp.box(*CELL)], crs='EPSG:4674')
+
+    layers = source.layers()
+
+    tempos = {etapa: [] for etapa in ETAPAS}
+    rss = {etapa: 0.0 for etapa in ETAPAS}
+    for _ in range(repeats):
+        # Um Splitter novo por repetição: os atributos do grid (gdf_broken_glass, pontos_cacos...) de uma repetição não
+        # podem mascarar a falha de uma etapa na seguinte
+        splitter = Splitter(config_path=config_path)
+        splitter.boleanas = layers
+        funcoes = {'intersection': lambda: splitter._intersection(n_grid=1, grid_gdf=grid_gdf, source=source),
+                   'prepare_split_line': splitter.prepare_split_line,
+                   'perform_split': splitter.perform_split,
+                   'process_overlapping': splitter.process_overlapping,
+                   'format_gdf_broken_glass': lambda: splitter.format_gdf_broken_glass(n_grid=1)}
+        for etapa in ETAPAS:
+            inicio = time.perf_counter()
+            funcoes[etapa]()
+            tempos[etapa].append(time.perf_counter() - inicio)
+            rss[etapa] = max(rss[etapa], rss_mb())
+            if etapa == 'perform_split':
+                # As etapas do Splitter registram o erro no log e seguem. Sem cacos o cenário não é válido
+                if not hasattr(splitter, 'gdf_broken_glass'):
+                    raise RuntimeError(f'Cenário {nome}: perform_split não gerou cacos (ver logs/splitter.log)')
+                n_shards = len(splitter.gdf_broken_glass)
+
+    return {'scenario': nome,
+            'commit': _commit(),
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'versoes': {'python': platform.python_version(), 'shapely': shp.__version__, 'geos': shp.geos_version_string},
+            'parametros': parametros,
+            'seed': seed,
+            'repeats': repeats,
+            'n_features': len(gdf),
+            'n_vertices': int(shp.get_num_coordinates(gdf.geometry.values).sum()),
+            'n_shards': n_shards,
+            'n_rows': len(splitter.gdf_broken_glass),
+            'tempos': {etapa: round(float(np.median(v)), 4) for etapa, v in tempos.items()},
+            'total': round(float(sum(np.median(v) for v in tempos.values())), 4),
+            'rss_mb': {etapa: round(v, 1) for etapa, v in rss.items()},
+            'rss_peak_mb': round(peak_rss_mb(), 1)}
+
+
+def run(cenarios, repeats=3, seed=0, output='benchmarks/results.jsonl', config_path='config.json'):
+    """
+    Executa os cenários e acrescenta os resultados em output
+    """
+    os.makedirs('logs', exist_ok=True)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    tarefas = [(nome, CENARIOS[nome], repeats, seed, config_path) for nome in cenarios]
+
+    # maxtasksperchild=1: um processo novo por cenário
+    with Pool(processes=1, maxtasksperchild=1) as pool:
+        resultados = pool.map(_run_scenario, tarefas, chunksize=1)
+
+    with open(output, 'a', encoding='utf-8') as f:
+        for r in resultados:
+            f.write(json.dumps(r) + '\n')
+    return resultados
+
+
+def compare(output='benchmarks/results.jsonl', limite=1.2):
+    """
+    Compara o último resultado de cada cenário com o último resultado de um commit diferente. Etapas mais lentas que
+    limite vezes o resultado anterior são marcadas como regressão.
+    """
+    df = pd.read_json(output, lines=True, dtype=False, convert_dates=False)
+    linhas = []
+    for cenario, grupo in df.groupby('scenario', sort=False):
+        atual = grupo.iloc[-1]
+        anteriores = grupo[grupo['commit'] != atual['commit']]
+        if not len(anteriores):
+            continue
+        anterior = anteriores.iloc[-1]
+        for etapa in ETAPAS + ['total']:
+            t_atual = atual['total'] if etapa == 'total' else atual['tempos'][etapa]
+            t_anterior = anterior['total'] if etapa == 'total' else anterior['tempos'][etapa]
+            razao = t_atual / t_anterior if t_anterior else np.nan
+            linhas.append({'scenario': cenario, 'etapa': etapa,
+                           'commit_anterior': anterior['commit'], 'anterior': t_anterior,
+                           'commit_atual': atual['commit'], 'atual': t_atual,
+                           'razao': round(razao, 2), 'regressao': bool(razao > limite)})
+    if not linhas:
+        return 'Sem resultados de commits diferentes para comparar'
+    return pd.DataFrame(linhas).to_string(index=False)
+
+
+def _tabela(resultados):
+    tabela = pd.DataFrame([{'scenario': r['scenario'], **r['tempos'], 'total': r['total'],
+                            'n_shards': r['n_shards'], 'rss_peak_mb': r['rss_peak_mb']} for r in resultados])
+    return tabela.to_string(index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark offline do split com inputs sintéticos')
+    parser.add_argument('--scenario', action='append', choices=list(CENARIOS), help='Cenário a executar (repetível). Padrão: todos')
+    parser.add_argument('--repeats', type=int, default=3, help='Repetições por cenário (o resultado é a mediana)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results.jsonl')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--compare', action='store_true', help='Apenas compara os resultados já gravados')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Razão de tempo a partir da qual é regressão')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare(args.output, args.threshold))
+    else:
+        print(_tabela(run(args.scenario or list(CENARIOS), repeats=args.repeats, seed=args.seed,
+                          output=args.output, config_path=args.config)))
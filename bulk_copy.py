@@ -0,0 +1,124 @@
+import io
+import numpy as np
+import pandas as pd
+import shapely as shp
+
+
+# Carga em massa no PostGIS via COPY ... FROM STDIN (formato texto), substituindo o to_postgis.
+# O to_postgis faz INSERTs linha a linha pelo SQLAlchemy. Aqui cada lote vira um único stream de texto:
+#   - geometria em EWKB hex (com SRID), que o PostGIS converte direto na coluna geometry
+#   - listas/arrays no formato de array do PostgreSQL ({a,b,c}), montados na hora de gerar o stream
+#   - booleanos como t/f e nulos como \N
+
+
+def _escape_copy(col):
+    # Escapa os caracteres especiais do formato texto do COPY
+    return (col.str.replace('\\', '\\\\', regex=False)
+               .str.replace('\t', '\\t', regex=False)
+               .str.replace('\n', '\\n', regex=False)
+               .str.replace('\r', '\\r', regex=False))
+
+
+def _array_element(x):
+    # Elementos vazios, com caracteres especiais ou iguais a NULL precisam de aspas dentro do array
+    s = str(x)
+    if s == '' or s.upper() == 'NULL' or any(c in s for c in '{},"\\ \t\n'):
+        return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return s
+
+
+def format_copy_array(values):
+    """
+    Converte uma lista (ou np.ndarray) no literal de array do PostgreSQL. Exemplo: ['GRID', 'CAR'] -> '{GRID,CAR}'
+    """
+    return '{' + ','.join(_array_element(x) for x in values) + '}'
+
+
+def _format_column(col):
+    """
+    Converte uma coluna do GeoDataFrame na representação texto do COPY. Retorna uma Series de strings.
+    """
+    if isinstance(col.dtype, pd.BooleanDtype) or col.dtype == bool:
+        out = col.map({True: 't', False: 'f'})
+    elif pd.api.types.is_numeric_dtype(col.dtype):
+        out = col.astype(str).where(col.notna())
+    else:
+        out = col.map(lambda x: format_copy_array(x) if isinstance(x, (list, tuple, np.ndarray)) else str(x),
+                      na_action='ignore')
+        out = _escape_copy(out.astype(object))
+    return out.astype(object).fillna('\\N')
+
+
+def format_copy_rows(gdf, srid=4674):
+    """
+    Gera o conteúdo do COPY (formato texto) para o GeoDataFrame.
+
+    Args:
+        gdf - GeoDataFrame a ser enviado
+        srid - SRID gravado no EWKB da geometria
+
+    Returns:
+        Tupla (lista de colunas, buffer StringIO com uma linha por feicao)
+    """
+    geom_col = gdf.geometry.name
+    colunas = list(gdf.columns)
+    campos = []
+    for c in colunas:
+        if c == geom_col:
+            geoms = shp.set_srid(gdf[c].values, srid)
+            hexa = shp.to_wkb(geoms, hex=True, include_srid=True)
+            campos.append(pd.Series(hexa, index=gdf.index, dtype=object).fillna('\\N'))
+        else:
+            campos.append(_format_column(gdf[c]))
+
+    buffer = io.StringIO()
+    if len(gdf):
+        linhas = campos[0]
+        for campo in campos[1:]:
+            linhas = linhas + '\t' + campo
+        buffer.write('\n'.join(linhas.tolist()))
+        buffer.write('\n')
+    buffer.seek(0)
+    return colunas, buffer
+
+
+def copy_buffer(engine, buffer, colunas, table_name, schema, before=None, after=None):
+    """
+    Executa um COPY ... FROM STDIN com o conteúdo já formatado (ver format_copy_rows), em uma única transação.
+    before e after são listas opcionais de (sql, parametros) executadas na mesma transação, antes e depois do COPY
+    (usado pelo manifesto para apagar linhas antigas do grid e marcar o grid como done).
+    """
+    lista_colunas = ', '.join(f'"{c}"' for c in colunas)
+    sql = f'COPY {schema}.{table_name} ({lista_colunas}) FROM STDIN'
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for q, params in before or []:
+            cursor.execute(q, params)
+        cursor.copy_expert(sql, buffer)
+        for q, params in after or []:
+            cursor.execute(q, params)
+        cursor.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def copy_to_postgis(gdf, engine, table_name, schema, srid=4674, before=None, after=None):
+    """
+    Envia o GeoDataFrame para a tabela schema.table_name com um único COPY ... FROM STDIN em uma transação.
+    A tabela precisa existir (ver Splitter.create_table_postgresql).
+
+    Returns:
+        Número de linhas enviadas
+    """
+    colunas, buffer = format_copy_rows(gdf, srid=srid)
+    if not len(gdf) and not (before or after):
+        return 0
+
+    copy_buffer(engine, buffer, colunas, table_name=table_name, schema=schema, before=before, after=after)
+    return len(gdf)
@@ -44,7 +44,8 @@ with engine.connect() as conn:
 
 
 start_time=time.time()
-upload_full_folder(engine=engine, folder=config['output_path'], table_name=config['arquivos_final'])
+upload_full_folder(engine=engine, folder=config['output_path'], table_name=config['arquivos_final'],
+                   concurrency=config.get('upload_concurrency', 4), retries=config.get('upload_retries', 3))
 print(f'Elapsed time para upload {(time.time() - start_time):.2s}')
 
 queries=['create index if not exists on split.split (id);',
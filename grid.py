@@ -0,0 +1,239 @@
+import argparse
+import logging
+import os
+import time
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely as shp
+from shapely.strtree import STRtree
+from input_source import input_files, read_geo_metadata
+
+
+# Grid regular local, sem banco. As células são quadrados de lado spacing (graus, EPSG:4674) alinhados na origem (0, 0),
+# como no ST_SquareGrid: a célula (coluna i, linha j) vai de (i * spacing, j * spacing) a ((i + 1) * spacing, (j + 1) * spacing),
+# com i e j negativos a oeste e ao sul da origem. As células são geradas em lote pelo shapely e filtradas por uma máscara
+# (as células que não intersectam nenhuma geometria da máscara são descartadas).
+#
+# Id da célula: (j - J0) * N_COLUNAS + (i - I0) + 1, com I0 e J0 a coluna e a linha que contêm (-180, -90) e N_COLUNAS o
+# número de colunas de -180 a 180. O id depende apenas do spacing e da posição da célula, então é o mesmo para qualquer
+# máscara ou extensão (e não depende da ordem das linhas de uma query, como o row_number() do grid_from_clause).
+#
+# Com o próprio input como máscara, occupied_cells lê o input em blocos e guarda apenas os ids das células com alguma
+# feicao, sem carregar todas as geometrias (square_grid com ids).
+#
+#   python grid.py --spacing 0.25 --mask inputs/ufs.gpkg --output inputs/grid_025.parquet
+
+MAX_CELULAS_BLOCO = 1000000  # Células geradas por vez, limita a memória em grids finos
+
+
+def _indice(valor, spacing, funcao):
+    # Índice da célula na origem (0, 0), de um valor ou de um array. O arredondamento evita uma linha/coluna a mais quando
+    # o valor cai exatamente na borda de uma célula (ex.: -48.8 / 0.05)
+    return funcao(np.round(np.asarray(valor, dtype=np.float64) / spacing, 9)).astype(np.int64)
+
+
+def _origem_ids(spacing):
+    # (I0, J0, N_COLUNAS), ver o topo do arquivo
+    i0 = _indice(-180, spacing, np.floor)
+    return i0, _indice(-90, spacing, np.floor), _indice(180, spacing, np.ceil) - i0
+
+
+def cell_ids(linhas, colunas, spacing):
+    """
+    Ids das células (ver topo do arquivo) a partir da linha j e da coluna i, contadas a partir da origem (0, 0)
+    """
+    i0, j0, n_colunas = _origem_ids(spacing)
+    return (np.asarray(linhas, dtype=np.int64) - j0) * n_colunas + (np.asarray(colunas, dtype=np.int64) - i0) + 1
+
+
+def cell_rowcol(ids, spacing):
+    """
+    Linha j e coluna i (a partir da origem (0, 0)) das células a partir dos ids
+    """
+    i0, j0, n_colunas = _origem_ids(spacing)
+    linhas, colunas = np.divmod(np.asarray(ids, dtype=np.int64) - 1, n_colunas)
+    return linhas + j0, colunas + i0
+
+
+def _celulas(linhas, colunas, spacing):
+    # Geometrias das células. Arredonda os cantos para que -111 * 0.1 seja -11.1 e não -11.100000000000001
+    x0, y0 = np.round(colunas * spacing, 10), np.round(linhas * spacing, 10)
+    x1, y1 = np.round((colunas + 1) * spacing, 10), np.round((linhas + 1) * spacing, 10)
+    return shp.box(x0, y0, x1, y1)
+
+
+def _faixa(inicio, fim, spacing):
+    # Linhas (ou colunas) que cobrem [inicio, fim] como no square_grid: floor do início até ceil do fim, exclusivo,
+    # com pelo menos uma
+    a = _indice(inicio, spacing, np.floor)
+    return a, np.maximum(_indice(fim, spacing, np.ceil), a + 1)
+
+
+def _celulas_intersectadas(geoms, spacing):
+    # Ids das células que intersectam alguma das geometrias. As candidatas de cada feicao são as células do seu bbox
+    # (incluindo as que apenas tocam a borda), testadas com o STRtree das geometrias do bloco, em fatias de até
+    # MAX_CELULAS_BLOCO candidatas
+    b = shp.bounds(geoms)
+    c0, c1 = _indice(b[:, 0], spacing, np.ceil) - 1, _indice(b[:, 2], spacing, np.floor)
+    l0, l1 = _indice(b[:, 1], spacing, np.ceil) - 1, _indice(b[:, 3], spacing, np.floor)
+    n_colunas = c1 - c0 + 1
+    n_candidatas = n_colunas * (l1 - l0 + 1)
+    acumulado = np.cumsum(n_candidatas)
+    tree = STRtree(geoms)
+
+    ids = []
+    inicio = 0
+    while inicio < len(geoms):
+        base = acumulado[inicio - 1] if inicio else 0
+        fim = max(inicio + 1, int(np.searchsorted(acumulado, base + MAX_CELULAS_BLOCO, side='right')))
+        feicao = np.repeat(np.arange(inicio, fim), n_candidatas[inicio:fim])
+        # Posição da candidata dentro do bbox da sua feicao
+        k = np.arange(len(feicao)) - np.repeat(acumulado[inicio:fim] - n_candidatas[inicio:fim] - base, n_candidatas[inicio:fim])
+        candidatas = np.unique(cell_ids(l0[feicao] + k // n_colunas[feicao], c0[feicao] + k % n_colunas[feicao], spacing))
+        linhas, colunas = cell_rowcol(candidatas, spacing)
+        celula, _ = tree.query(_celulas(linhas, colunas, spacing), predicate='intersects')
+        ids.append(candidatas[np.unique(celula)])
+        inicio = fim
+    return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+
+
+def occupied_cells(input_file, spacing, batch_rows=200000):
+    """
+    Ids das células que intersectam alguma geometria do input_file (arquivo ou dataset), lido em blocos de batch_rows
+    feicoes. É o mesmo conjunto de square_grid(spacing, mask=read_mask(input_file)), sem carregar o input inteiro.
+    """
+    start_time = time.time()
+    geom_col = read_geo_metadata(input_file)['primary_column']
+    ocupadas = []
+    minx = miny = np.inf
+    maxx = maxy = -np.inf
+    for arquivo in input_files(input_file):
+        for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=batch_rows, columns=[geom_col]):
+            geoms = shp.from_wkb(batch.column(0).to_numpy(zero_copy_only=False))
+            geoms = geoms[~(shp.is_missing(geoms) | shp.is_empty(geoms))]
+            if not len(geoms):
+                continue
+            bx0, by0, bx1, by1 = shp.total_bounds(geoms)
+            minx, miny, maxx, maxy = min(minx, bx0), min(miny, by0), max(maxx, bx1), max(maxy, by1)
+            ocupadas.append(np.unique(_celulas_intersectadas(geoms, spacing)))
+    if not ocupadas:
+        return np.zeros(0, dtype=np.int64)
+
+    # Como no square_grid, apenas as linhas e colunas que cobrem os bounds do input (uma célula que só toca a borda
+    # externa do input fica de fora)
+    ids = np.unique(np.concatenate(ocupadas))
+    linhas, colunas = cell_rowcol(ids, spacing)
+    col0, col1 = _faixa(minx, maxx, spacing)
+    lin0, lin1 = _faixa(miny, maxy, spacing)
+    ids = ids[(colunas >= col0) & (colunas < col1) & (linhas >= lin0) & (linhas < lin1)]
+    logging.info(f"{len(ids)} células de {spacing} graus ocupadas pelo {input_file} em {time.time() - start_time:.2f} segundos")
+    return ids
+
+
+def read_mask(path):
+    """
+    Geometrias da máscara em EPSG:4674. Aceita GeoParquet (arquivo ou dataset, como o input_file) ou qualquer formato lido
+    pelo geopandas (gpkg, shp, geojson)
+    """
+    if path.endswith('.parquet') or os.path.isdir(path):
+        geom_col = read_geo_metadata(path)['primary_column']
+        gdf = gpd.read_parquet(path, columns=[geom_col])
+    else:
+        gdf = gpd.read_file(path)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4674:
+        gdf = gdf.to_crs(4674)
+    return gdf.geometry.to_numpy()
+
+
+def square_grid(spacing, extent=None, mask=None, ids=None):
+    """
+    Gera o grid regular.
+
+    Args:
+        spacing - lado da célula em graus
+        extent - bounds (minx, miny, maxx, maxy) a cobrir. Se None, usa os bounds da máscara
+        mask - array de geometrias. Se informado, mantém apenas as células que intersectam alguma geometria
+        ids - ids das células (ex.: occupied_cells), no lugar da máscara. Com extent mantém apenas as que estão nela
+
+    Returns:
+        GeoDataFrame com id e geom em EPSG:4674, ordenado pelo id
+    """
+    if spacing <= 0:
+        raise ValueError(f"grid_spacing deve ser positivo, recebido {spacing}")
+    if extent is None and mask is None and ids is None:
+        raise ValueError("Informe a extensão, a máscara ou os ids do grid")
+    start_time = time.time()
+
+    if ids is not None:
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        linhas, colunas = cell_rowcol(ids, spacing)
+        if extent is not None:
+            col0, col1 = _faixa(extent[0], extent[2], spacing)
+            lin0, lin1 = _faixa(extent[1], extent[3], spacing)
+            dentro = (colunas >= col0) & (colunas < col1) & (linhas >= lin0) & (linhas < lin1)
+            ids, linhas, colunas = ids[dentro], linhas[dentro], colunas[dentro]
+        grid_gdf = gpd.GeoDataFrame(data={'id': ids}, geometry=_celulas(linhas, colunas, spacing), crs='EPSG:4674')
+        grid_gdf = grid_gdf.rename_geometry('geom')
+        logging.info(f"Grid de {spacing} graus gerado com {len(grid_gdf)} células em {time.time() - start_time:.2f} segundos")
+        return grid_gdf
+
+    tree = None
+    if mask is not None:
+        mask = np.asarray(mask)
+        mask = mask[~(shp.is_missing(mask) | shp.is_empty(mask))]
+        tree = STRtree(mask)
+        if extent is None:
+            extent = shp.total_bounds(mask)
+    minx, miny, maxx, maxy = extent
+
+    # Linhas e colunas (a partir da origem) que cobrem a extensão
+    col0, col1 = _faixa(minx, maxx, spacing)
+    lin0, lin1 = _faixa(miny, maxy, spacing)
+    colunas = np.arange(col0, col1)
+    linhas_por_bloco = max(1, MAX_CELULAS_BLOCO // len(colunas))
+
+    ids, geoms = [], []
+    for inicio in range(lin0, lin1, linhas_por_bloco):
+        linhas = np.arange(inicio, min(inicio + linhas_por_bloco, lin1))
+        l, c = np.repeat(linhas, len(colunas)), np.tile(colunas, len(linhas))
+        celulas = _celulas(l, c, spacing)
+        if tree is not None:
+            manter = np.unique(tree.query(celulas, predicate='intersects')[0])
+            l, c, celulas = l[manter], c[manter], celulas[manter]
+        ids.append(cell_ids(l, c, spacing))
+        geoms.append(celulas)
+
+    grid_gdf = gpd.GeoDataFrame(data={'id': np.concatenate(ids)}, geometry=np.concatenate(geoms), crs='EPSG:4674')
+    grid_gdf = grid_gdf.rename_geometry('geom')
+    logging.info(f"Grid de {spacing} graus gerado com {len(grid_gdf)} células em {time.time() - start_time:.2f} segundos")
+    return grid_gdf
+
+
+def mask_grid(spacing, path, extent=None):
+    """
+    Grid com a máscara do arquivo path. Um GeoParquet (arquivo ou dataset, como o input_file) é lido em blocos
+    (occupied_cells); os demais formatos são carregados inteiros (read_mask)
+    """
+    if path.endswith('.parquet') or os.path.isdir(path):
+        return square_grid(spacing, extent=extent, ids=occupied_cells(path, spacing))
+    return square_grid(spacing, extent=extent, mask=read_mask(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera um grid regular local (sem banco)')
+    parser.add_argument('--spacing', type=float, required=True, help='Lado da célula em graus')
+    parser.add_argument('--mask', help='Arquivo com as geometrias da máscara (ex.: input_file ou limites das UFs)')
+    parser.add_argument('--extent', type=float, nargs=4, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'))
+    parser.add_argument('--output', required=True, help='GeoParquet de saída')
+    args = parser.parse_args()
+    if args.mask is None and args.extent is None:
+        parser.error('informe --mask e/ou --extent')
+
+    logging.basicConfig(level=logging.INFO)
+    if args.mask:
+        grid = mask_grid(args.spacing, args.mask, extent=args.extent)
+    else:
+        grid = square_grid(args.spacing, extent=args.extent)
+    grid.to_parquet(args.output)
+    print(f"{len(grid)} células gravadas em {args.output}")
@@ -0,0 +1,236 @@
+import geopandas as gpd
+import pyarrow.parquet as pq
+import numpy as np
+import shapely as shp
+from shapely.strtree import STRtree
+import pandas as pd
+import json
+import logging
+import os
+
+
+# Fontes de input do Splitter. Cada fonte responde a mesma pergunta: quais feicoes do input tocam o bbox de um grid ?
+# O retorno é sempre um GeoDataFrame com as colunas id, id_layer e geom em EPSG:4674, que é o formato esperado pelo Splitter.
+
+
+def input_files(input_file):
+    """
+    Arquivos do input_file: o próprio arquivo ou as partes de um diretório (dataset) gerado pela exportação paralela do
+    prepare_inputs.py, em ordem.
+    """
+    if os.path.isdir(input_file):
+        partes = [os.path.join(input_file, f) for f in sorted(os.listdir(input_file)) if f.endswith('.parquet')]
+        if not partes:
+            raise FileNotFoundError(f'Nenhum arquivo .parquet em {input_file}')
+        return partes
+    return [input_file]
+
+
+def read_geo_metadata(input_file):
+    """
+    Metadados GeoParquet (chave geo) do input_file (arquivo ou dataset, cujas partes têm todas os mesmos metadados).
+    """
+    return json.loads(pq.read_schema(input_files(input_file)[0]).metadata[b'geo'])
+
+
+class PostgisInputSource:
+    """
+    Fonte de input no banco. Faz uma consulta por grid usando o operador && (bbox) na tabela split_table_name.
+    """
+
+    def __init__(self, engine, split_table_name):
+        self.engine = engine
+        self.split_table_name = split_table_name
+
+    def query(self, n_grid, bounds):
+        """
+        Ponto de entrada comum das fontes: seleciona as feicoes do grid pelo bbox dele. O n_grid é ignorado.
+
+        Args:
+            n_grid - id do grid
+            bounds - (minx, miny, maxx, maxy) do grid
+        """
+        return self.query_bbox(*bounds)
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """
+        Seleciona as feicoes cujo bbox intersecta o bbox dado.
+
+        Args:
+            minx, miny, maxx, maxy - bounds do grid
+
+        Returns:
+            GeoDataFrame com id, id_layer e geom
+        """
+        # Criar a query SQL para filtrar na tabela inputs apenas os registros que estao no bounding box do grid
+        query = f"""
+        SELECT id, id_layer, geom
+        FROM {self.split_table_name}
+        WHERE geom && ST_MakeEnvelope({minx}, {miny}, {maxx}, {maxy}, 4674
+        );
+        """
+        return gpd.read_postgis(query, con=self.engine, geom_col='geom')
+
+    def layers(self):
+        """
+        Retorna a lista de id_layer distintos do input.
+        """
+        query=f'select distinct id_layer from {self.split_table_name};'
+        df=pd.read_sql_query(query,con=self.engine)
+        return [i for i in df.id_layer]
+
+
+class ParquetInputSource:
+    """
+    Fonte de input local, lida direto do input_file (GeoParquet, arquivo único ou dataset) gerado pelo prepare_inputs.py.
+    Nao precisa de banco.
+
+    Se o arquivo tiver a coluna de bbox (covering do GeoParquet), o filtro por grid é empurrado para o pyarrow, que usa as
+    estatísticas dos row groups para pular o que está fora do grid. Se não tiver, o arquivo é lido uma única vez por processo
+    (memory map) e os grids são respondidos por um STRtree em memória.
+    """
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+
+        # Descobre a coluna de geometria e se existe a coluna de bbox lendo apenas os metadados do arquivo
+        geo = read_geo_metadata(input_file)
+        self.geom_col = geo['primary_column']
+        covering = geo['columns'][self.geom_col].get('covering')
+        self.bbox_col = covering['bbox']['xmin'][0] if covering else None
+
+        # Cache do arquivo inteiro, usado apenas quando não há coluna de bbox
+        self._gdf = None
+        self._tree = None
+
+    def _load(self):
+        # Leitura unica do arquivo, fica em cache na instancia (um por processo)
+        if self._gdf is None:
+            self._gdf = gpd.read_parquet(self.input_file, columns=['id', 'id_layer', self.geom_col], memory_map=True)
+            self._tree = STRtree(self._gdf[self.geom_col].values)
+            logging.info(f'Input {self.input_file} carregado em memoria ({len(self._gdf)} feicoes), arquivo sem coluna bbox')
+        return self._gdf
+
+    def query(self, n_grid, bounds):
+        """
+        Ponto de entrada comum das fontes: seleciona as feicoes do grid pelo bbox dele. O n_grid é ignorado.
+
+        Args:
+            n_grid - id do grid
+            bounds - (minx, miny, maxx, maxy) do grid
+        """
+        return self.query_bbox(*bounds)
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """
+        Seleciona as feicoes cujo bbox intersecta o bbox dado (mesma semântica do && do PostGIS).
+
+        Args:
+            minx, miny, maxx, maxy - bounds do grid
+
+        Returns:
+            GeoDataFrame com id, id_layer e geom
+        """
+        if self.bbox_col is not None:
+            gdf = gpd.read_parquet(self.input_file, columns=['id', 'id_layer', self.geom_col],
+                                   bbox=(minx, miny, maxx, maxy), memory_map=True)
+        else:
+            gdf = self._load()
+            # Sem predicado o STRtree compara apenas os envelopes. Ordena para manter a ordem do arquivo
+            idx = np.sort(self._tree.query(shp.box(minx, miny, maxx, maxy)))
+            gdf = gdf.iloc[idx]
+
+        return gdf.rename_geometry('geom') if self.geom_col != 'geom' else gdf
+
+    def layers(self):
+        """
+        Retorna a lista de id_layer distintos do input.
+        """
+        return pd.unique(pq.read_table(self.input_file, columns=['id_layer'])['id_layer'].to_pandas()).tolist()
+
+
+class MemoryInputSource:
+    """
+    Fonte de input em memória, a partir de um GeoDataFrame com id, id_layer e geometria. Usada pelo benchmark.py e pela
+    reexecução de fixtures, sem banco e sem arquivo.
+    """
+
+    def __init__(self, gdf):
+        self.gdf = gdf.rename_geometry('geom') if gdf.geometry.name != 'geom' else gdf
+        self._tree = STRtree(self.gdf.geom.values)
+
+    def query(self, n_grid, bounds):
+        """
+        Ponto de entrada comum das fontes: seleciona as feicoes do grid pelo bbox dele. O n_grid é ignorado.
+
+        Args:
+            n_grid - id do grid
+            bounds - (minx, miny, maxx, maxy) do grid
+        """
+        return self.query_bbox(*bounds)
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """
+        Seleciona as feicoes cujo bbox intersecta o bbox dado (mesma semântica do && do PostGIS).
+        """
+        idx = np.sort(self._tree.query(shp.box(minx, miny, maxx, maxy)))
+        return self.gdf.iloc[idx]
+
+    def layers(self):
+        """
+        Retorna a lista de id_layer distintos do input.
+        """
+        return pd.unique(self.gdf['id_layer']).tolist()
+
+
+class AssignmentInputSource:
+    """
+    Fonte de input por célula, a partir do dataset gerado pelo assignment.py (assignment_dir/n_grid=<id>/). Cada grid lê
+    apenas a sua partição, que já tem as feicoes cujo bbox toca o bbox do grid. Nao precisa de banco.
+    """
+
+    def __init__(self, assignment_dir, input_file):
+        self.assignment_dir = assignment_dir
+        self.input_file = input_file
+
+    def query(self, n_grid, bounds):
+        """
+        Seleciona as feicoes atribuídas ao grid. Um grid sem feicoes não tem partição e retorna um GeoDataFrame vazio.
+        Os bounds são ignorados: a partição já tem as feicoes que tocam o bbox do grid.
+
+        Returns:
+            GeoDataFrame com id, id_layer e geom
+        """
+        particao = os.path.join(self.assignment_dir, f'n_grid={n_grid}')
+        if not os.path.isdir(particao):
+            return gpd.GeoDataFrame(data={'id': [], 'id_layer': []}, geometry=gpd.GeoSeries([], crs='EPSG:4674'),
+                                    crs='EPSG:4674').rename_geometry('geom')
+        gdf = gpd.read_parquet(particao, columns=['id', 'id_layer', read_geo_metadata(particao)['primary_column']])
+        return gdf.rename_geometry('geom') if gdf.geometry.name != 'geom' else gdf
+
+    def layers(self):
+        """
+        Retorna a lista de id_layer distintos do input.
+        """
+        return pd.unique(pq.read_table(self.input_file, columns=['id_layer'])['id_layer'].to_pandas()).tolist()
+
+
+# Cache das fontes parquet por processo. Cada worker do Pool abre o arquivo apenas uma vez, mesmo recebendo varios grids
+_parquet_sources = {}
+
+
+def create_input_source(kind, engine=None, split_table_name=None, input_file=None, assignment_dir=None):
+    """
+    Cria a fonte de input de acordo com a chave input_source do config.json ('postgis', 'parquet', 'shared' ou 'assignment').
+    Com 'shared' os workers do run_parallel recebem o input em memória compartilhada (ver shared_input.py). Fora do Pool
+    (colunas booleanas, profile_cell.py) a fonte é o próprio input_file, como em 'parquet'.
+    """
+    if kind == 'postgis':
+        return PostgisInputSource(engine=engine, split_table_name=split_table_name)
+    elif kind in ('parquet', 'shared'):
+        if input_file not in _parquet_sources:
+            _parquet_sources[input_file] = ParquetInputSource(input_file=input_file)
+        return _parquet_sources[input_file]
+    elif kind == 'assignment':
+        return AssignmentInputSource(assignment_dir=assignment_dir, input_file=input_file)
+    raise ValueError(f"input_source '{kind}' desconhecido, use 'postgis', 'parquet', 'shared' ou 'assignment'")
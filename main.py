@@ -14,6 +14,8 @@ import subprocess
 from rtree import index
 
 from utils import merge_parquet_files
+from planner import GridPlanner
+from assignment import build_assignment
 from sqlalchemy import text, create_engine
 from uploader import upload_parquet, upload_full_folder
 
@@ -64,21 +66,36 @@ if __name__ == "__main__":
     #Carregamento do grid na memória
     ##### Aqui pode ser um ponto de melhoria. Nao carregar na memoria ##### 
 
-    #Lista de grids para iteração baseado no grid file gerado
-
-    grids = gpd.read_parquet(config["grid_file"])["id"].tolist()      
-
-
-
     #Carregar o grid vetorial
     grid_gdf = gpd.read_parquet(config["grid_file"])
 
+    #Planejamento: divide as células pesadas do grid em quadrantes (ver planner.py). O plano é salvo ao lado do grid_file
+    if config.get("plan_grid", False):
+        planner = GridPlanner(max_features=config.get("plan_max_features", 5000),
+                              max_vertices=config.get("plan_max_vertices", 500000),
+                              max_depth=config.get("plan_max_depth", 4))
+        planner.load_input(config["input_file"])
+        grid_gdf = planner.plan(grid_gdf)
+        grid_gdf.to_parquet(config["grid_file"].replace(".parquet", "_plan.parquet"))
+        logger.info(f"Grid planejado com {len(grid_gdf)} células")
+
+    #Atribuição das feicoes às células em uma única passada (ver assignment.py). Feita sobre o grid final (ou o plano)
+    if config.get("input_source") == "assignment":
+        resumo = build_assignment(grid_gdf, config["input_file"], config.get("assignment_dir", "./inputs/assignment"),
+                                  batch_rows=config.get("assignment_batch_rows", 200000))
+        logger.info(f"Fator de duplicação das feicoes: médio {resumo.get('fator_medio')}, p99 {resumo.get('fator_p99')}, "
+                    f"máximo {resumo.get('fator_max')}")
+
+    #Lista de grids para iteração baseado no grid file gerado (ou no plano)
+    grids = grid_gdf["id"].tolist()
+
     
 
     #Roda o código aqui !!!!!!!!!!
     logger.info("Iniciando multiprocessing para grids")
     splitter = Splitter(config_path='config.json')
-    splitter.create_table_postgresql(engine=engine)
+    # Cria a tabela de saída e o manifesto. Com resume = true, retoma apenas os grids pendentes ou que falharam
+    grids = splitter.prepare_run(engine=engine, grids=grids)
     splitter.run_parallel(grids=grids, grid_gdf=grid_gdf)
     splitter.create_indices(engine=engine)
 
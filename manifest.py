@@ -0,0 +1,110 @@
+import json
+import logging
+from sqlalchemy import text
+
+
+# Manifesto do split: uma linha por grid com o status (pending, done, failed), o número de linhas gravadas e os tempos.
+# Fica no banco, ao lado da tabela de saída ({schema}.{arquivo_final}_manifest). O status 'done' é gravado na mesma
+# transação do COPY do grid, e o COPY apaga antes as linhas que o grid já tinha na tabela de saída. Assim um grid pode
+# ser reprocessado quantas vezes for preciso sem duplicar linhas, e o main.py consegue retomar uma execução interrompida.
+
+
+class Manifest:
+
+    def __init__(self, schema, arquivo_final):
+        self.schema = schema
+        self.arquivo_final = arquivo_final
+        self.table = f"{schema}.{arquivo_final}_manifest"
+
+    def create(self, engine, grids, reset=True):
+        """
+        Cria o manifesto (se não existir) e registra os grids como pending.
+        Com reset=True o manifesto anterior é apagado (execução nova). Com reset=False os status existentes são mantidos
+        e apenas grids novos são adicionados.
+        """
+        queries = [f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                        n_grid BIGINT PRIMARY KEY,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        n_rows INTEGER,
+                        elapsed NUMERIC,
+                        tempos JSONB,
+                        erro TEXT,
+                        tentativas INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ DEFAULT now());""",
+                   # Manifestos criados antes da coluna tentativas
+                   f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS tentativas INTEGER NOT NULL DEFAULT 0;"]
+        if reset:
+            queries.append(f"TRUNCATE {self.table};")
+
+        with engine.connect() as conn:
+            with conn.begin():
+                for q in queries:
+                    conn.execute(text(q))
+                conn.execute(text(f"INSERT INTO {self.table} (n_grid) SELECT unnest(CAST(:grids AS BIGINT[])) ON CONFLICT DO NOTHING;"),
+                             {"grids": [int(g) for g in grids]})
+
+        logging.info(f"Manifesto {self.table} com {len(grids)} grids (reset={reset})")
+
+    def pending(self, engine, retry_failed=True):
+        """
+        Retorna os grids que ainda precisam ser processados: pending e, se retry_failed, também os failed.
+        """
+        status = ['pending', 'failed'] if retry_failed else ['pending']
+        with engine.connect() as conn:
+            result = conn.execute(text(f"SELECT n_grid FROM {self.table} WHERE status = ANY(:status) ORDER BY n_grid;"),
+                                  {"status": status})
+            return [r[0] for r in result]
+
+    def summary(self, engine):
+        """
+        Contagem de grids por status
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(f"SELECT status, count(*) FROM {self.table} GROUP BY status;"))
+            return {r[0]: r[1] for r in result}
+
+    def elapsed(self, engine):
+        """
+        Tempo de processamento (segundos) dos grids concluídos, de uma execução anterior. Usado no escalonamento.
+        Retorna um dict vazio se o manifesto ainda não existir.
+        """
+        try:
+            with engine.connect() as conn:
+                result = conn.execute(text(f"SELECT n_grid, elapsed FROM {self.table} WHERE status = 'done' AND elapsed IS NOT NULL;"))
+                return {r[0]: float(r[1]) for r in result}
+        except Exception as e:
+            logging.info(f"Sem tempos anteriores no manifesto {self.table} ({e.__class__.__name__})")
+            return {}
+
+    def attempts(self, engine):
+        """
+        Número de tentativas já feitas (done ou failed) de cada grid que ainda não terminou. Usado nas métricas (retries).
+        """
+        with engine.connect() as conn:
+            result = conn.execute(text(f"SELECT n_grid, tentativas FROM {self.table} WHERE status <> 'done' AND tentativas > 0;"))
+            return {r[0]: r[1] for r in result}
+
+    def mark_failed(self, engine, n_grid, erro):
+        with engine.connect() as conn:
+            with conn.begin():
+                conn.execute(text(f"UPDATE {self.table} SET status = 'failed', erro = :erro, tentativas = tentativas + 1, updated_at = now() WHERE n_grid = :n_grid;"),
+                             {"erro": str(erro), "n_grid": int(n_grid)})
+
+    def mark_failed_many(self, engine, grids, erro):
+        with engine.connect() as conn:
+            with conn.begin():
+                conn.execute(text(f"UPDATE {self.table} SET status = 'failed', erro = :erro, tentativas = tentativas + 1, updated_at = now() WHERE n_grid = ANY(:grids);"),
+                             {"erro": str(erro), "grids": [int(g) for g in grids]})
+
+    def delete_statement(self, grids):
+        """
+        SQL (psycopg2) que apaga da tabela de saída as linhas dos grids. O primeiro elemento de id_feature é sempre o n_grid.
+        """
+        return (f"DELETE FROM {self.schema}.{self.arquivo_final} WHERE id_feature[1] = ANY(%s);", [[int(g) for g in grids]])
+
+    def done_statements(self, infos):
+        """
+        SQLs (psycopg2) que marcam os grids como done. infos é uma lista de dicts com n_grid, n_rows, elapsed e tempos.
+        """
+        sql = f"UPDATE {self.table} SET status = 'done', n_rows = %s, elapsed = %s, tempos = %s, erro = NULL, tentativas = tentativas + 1, updated_at = now() WHERE n_grid = %s;"
+        return [(sql, [int(i["n_rows"]), i["elapsed"], json.dumps(i["tempos"]), int(i["n_grid"])]) for i in infos]
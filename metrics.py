@@ -0,0 +1,180 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import numpy as np
+import pandas as pd
+import psutil
+
+
+# Métricas estruturadas do split. Cada grid processado gera um registro (JSON, uma linha) com os tempos de cada etapa em
+# segundos, o tamanho do input (feicoes e vértices), o número de cacos, os anéis descartados, o efeito do snap, o PID do
+# worker, a memória (RSS ao final do grid, maior RSS amostrado nas etapas do grid e pico do worker desde o início) e o número
+# de tentativas anteriores do grid. Cada processo grava no seu próprio arquivo (metrics_<pid>.jsonl), então não
+# há disputa entre os workers. No final do run_parallel os arquivos podem ser consolidados em Parquet e/ou em um textfile do
+# Prometheus (node_exporter textfile collector).
+#
+# Resumo (percentis por etapa e grids mais lentos):
+#   python metrics.py logs/metrics --top 20
+
+
+def rss_mb():
+    """
+    RSS atual do processo, em MB
+    """
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def peak_rss_mb():
+    """
+    Pico de RSS do processo desde o início, em MB (ru_maxrss é em KB no Linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MetricsSink:
+
+    def __init__(self, metrics_dir="logs/metrics", formato="jsonl", prometheus_file=None):
+        if formato not in ("jsonl", "parquet"):
+            raise ValueError(f"metrics_format deve ser jsonl ou parquet, recebido {formato}")
+        self.metrics_dir = metrics_dir
+        self.formato = formato
+        self.prometheus_file = prometheus_file
+
+    def reset(self):
+        """
+        Apaga os registros de uma execução anterior (execução nova, sem resume)
+        """
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for arquivo in glob.glob(os.path.join(self.metrics_dir, "metrics_*.jsonl")):
+            os.remove(arquivo)
+
+    def write(self, registro):
+        """
+        Grava um registro no arquivo do processo atual
+        """
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        caminho = os.path.join(self.metrics_dir, f"metrics_{os.getpid()}.jsonl")
+        with open(caminho, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, default=float) + "\n")
+
+    def consolidate(self):
+        """
+        Junta os registros de todos os processos. Grava metrics.parquet (se metrics_format = parquet) e o textfile do
+        Prometheus (se metrics_prometheus_file estiver definido).
+
+        Returns:
+            DataFrame com um registro por grid
+        """
+        df = read_metrics(self.metrics_dir)
+        if self.formato == "parquet" and len(df):
+            df.to_parquet(os.path.join(self.metrics_dir, "metrics.parquet"), index=False)
+        if self.prometheus_file:
+            write_prometheus(df, self.prometheus_file)
+        return df
+
+
+def read_metrics(path):
+    """
+    Lê as métricas de um diretório (metrics_*.jsonl ou metrics.parquet) ou de um arquivo. Os tempos das etapas viram
+    colunas tempos.<etapa>. Um grid processado mais de uma vez (retomada, que não apaga os arquivos) fica apenas com o
+    registro mais recente.
+    """
+    if os.path.isdir(path):
+        arquivos = sorted(glob.glob(os.path.join(path, "metrics_*.jsonl")))
+        if not arquivos and os.path.exists(os.path.join(path, "metrics.parquet")):
+            return pd.read_parquet(os.path.join(path, "metrics.parquet"))
+    elif path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    else:
+        arquivos = [path]
+
+    registros = []
+    for arquivo in arquivos:
+        with open(arquivo, encoding="utf-8") as f:
+            registros.extend(json.loads(linha) for linha in f if linha.strip())
+    df = pd.json_normalize(registros)
+    if "n_grid" in df.columns and "inicio" in df.columns:
+        df = df.sort_values("inicio", kind="stable").drop_duplicates("n_grid", keep="last").reset_index(drop=True)
+    return df
+
+
+def _colunas_tempo(df):
+    return [c for c in df.columns if c.startswith("tempos.")]
+
+
+def write_prometheus(df, path):
+    """
+    Grava as métricas agregadas no formato texto do Prometheus. O arquivo é escrito em um temporário e renomeado, para
+    o coletor nunca ler um arquivo pela metade.
+    """
+    linhas = ["# HELP split_cells_total Grids processados por status",
+              "# TYPE split_cells_total counter"]
+    for status, n in (df["status"].value_counts().items() if len(df) else []):
+        linhas.append(f'split_cells_total{{status="{status}"}} {n}')
+
+    linhas += ["# HELP split_stage_seconds Tempo por etapa do split (segundos)",
+               "# TYPE split_stage_seconds summary"]
+    for coluna in _colunas_tempo(df):
+        etapa = coluna.split(".", 1)[1]
+        valores = df[coluna].dropna().to_numpy(dtype=float)
+        if not len(valores):
+            continue
+        for q in (0.5, 0.9, 0.99):
+            linhas.append(f'split_stage_seconds{{stage="{etapa}",quantile="{q}"}} {np.quantile(valores, q):.6f}')
+        linhas.append(f'split_stage_seconds_sum{{stage="{etapa}"}} {valores.sum():.6f}')
+        linhas.append(f'split_stage_seconds_count{{stage="{etapa}"}} {len(valores)}')
+
+    for coluna, nome, ajuda in [("worker_rss_peak_mb", "split_worker_rss_peak_mb", "Maior pico de RSS dos workers (MB)"),
+                                ("rss_peak_mb", "split_cell_rss_peak_mb_max", "Maior RSS amostrado em um grid (MB)"),
+                                ("elapsed", "split_cell_seconds_max", "Tempo do grid mais lento (segundos)"),
+                                ("n_vertices", "split_cell_vertices_max", "Maior número de vértices de input em um grid")]:
+        if coluna in df.columns and df[coluna].notna().any():
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge", f"{nome} {df[coluna].max()}"]
+
+    temporario = f"{path}.{os.getpid()}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write("\n".join(linhas) + "\n")
+    os.replace(temporario, path)
+
+
+def summary(df, top=10):
+    """
+    Texto com os percentis de tempo por etapa e os grids mais lentos
+    """
+    if not len(df):
+        return "Nenhuma métrica encontrada"
+
+    colunas = _colunas_tempo(df)
+    percentis = df[colunas + ["elapsed"]].quantile([0.5, 0.9, 0.99, 1.0]).T
+    percentis.columns = ["p50", "p90", "p99", "max"]
+    percentis.index = [c.replace("tempos.", "") for c in percentis.index]
+    percentis["total"] = df[colunas + ["elapsed"]].sum().to_numpy()
+
+    exibir = [c for c in ["n_grid", "elapsed", "n_features", "n_vertices", "n_shards", "rss_peak_mb", "pid", "status"]
+              if c in df.columns]
+    lentos = df.sort_values("elapsed", ascending=False).head(top)[exibir]
+    # Registros antigos não têm worker_rss_peak_mb (o rss_peak_mb era o pico do worker)
+    pico = df["rss_peak_mb"]
+    if "worker_rss_peak_mb" in df.columns:
+        pico = df["worker_rss_peak_mb"].fillna(pico)
+
+    partes = [f"{len(df)} grids - status: {df['status'].value_counts().to_dict()}",
+              "",
+              "Tempo por etapa (segundos):",
+              percentis.round(3).to_string(),
+              "",
+              f"Pico de RSS por worker (MB): {pico.groupby(df['pid']).max().round(1).to_dict()}",
+              "",
+              f"{top} grids mais lentos:",
+              lentos.to_string(index=False)]
+    return "\n".join(partes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumo das métricas do split")
+    parser.add_argument("path", nargs="?", default="logs/metrics", help="Diretório metrics_dir ou arquivo .jsonl/.parquet")
+    parser.add_argument("--top", type=int, default=10, help="Número de grids mais lentos a listar")
+    args = parser.parse_args()
+    print(summary(read_metrics(args.path), top=args.top))
@@ -0,0 +1,165 @@
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely as shp
+from shapely.strtree import STRtree
+import pyarrow.parquet as pq
+from input_source import read_geo_metadata, input_files
+import logging
+import time
+
+
+# Planejamento do grid. As células do grid_from_clause têm cargas muito diferentes: algumas têm poucas feicoes e terminam em
+# milissegundos, outras têm milhares de feicoes e milhões de vértices e levam minutos. O planner mede a carga de cada célula
+# (número de feicoes e vértices dentro do bbox da célula) e divide as células pesadas em 4 quadrantes, recursivamente, até
+# ficarem abaixo do orçamento ou atingirem a profundidade máxima.
+#
+# Ids das sub-células: (BASE + id_raiz) * 1000000 + caminho no quadtree, com um dígito (1 a 4) por nível. BASE é 0 quando
+# os ids do grid são menores que 1000000; senão é a potência de 10 acima do maior id (grids locais finos, ver grid.py), para
+# que nenhuma sub-célula receba o id de uma célula do grid.
+# Exemplo: a célula 4312 dividida duas vezes (quadrante 2 e depois 3) vira 4312000023. Células que não precisam ser divididas
+# mantêm o id original. Os ids são estáveis entre execuções (dependem apenas do grid e do input), então o manifesto e o
+# id do GRID no id_feature continuam valendo.
+
+FATOR_ID = 1000000
+MAX_DEPTH = 6  # Com um dígito por nível o caminho precisa caber em FATOR_ID
+MAX_COORDS_BLOCO = 1000000  # Coordenadas lidas por vez na contagem de vértices por célula
+
+
+
+def _base_ids(id_max):
+    # BASE dos ids das sub-células (ver o topo do arquivo)
+    if id_max < FATOR_ID:
+        return 0
+    base = 10 ** len(str(id_max))
+    if (2 * base) * FATOR_ID >= np.iinfo(np.int64).max:
+        raise ValueError(f"Ids do grid grandes demais para gerar ids de sub-células (máximo {id_max})")
+    return base
+
+
+class GridPlanner:
+
+    def __init__(self, max_features=5000, max_vertices=500000, max_depth=4):
+        if max_depth > MAX_DEPTH:
+            raise ValueError(f"plan_max_depth deve ser no máximo {MAX_DEPTH}")
+        self.max_features = max_features
+        self.max_vertices = max_vertices
+        self.max_depth = max_depth
+        self.input_file = None
+        self.arquivos = []
+
+    def load_input(self, input_file, batch_rows=200000):
+        """
+        Registra o input_file (arquivo ou dataset). As geometrias não ficam em memória: cada medição de carga lê o input em
+        blocos de batch_rows feicoes, então o processo principal não guarda uma cópia do input antes do Pool
+        """
+        self.input_file = input_file
+        self.geom_col = read_geo_metadata(input_file)['primary_column']
+        self.batch_rows = batch_rows
+        self.arquivos = input_files(input_file)
+        logging.info(f"Planner vai medir a carga a partir de {input_file} ({len(self.arquivos)} arquivos)")
+
+    def _blocos(self):
+        # Geometrias do input, um bloco de batch_rows feicoes por vez
+        for arquivo in self.arquivos:
+            for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=self.batch_rows, columns=[self.geom_col]):
+                yield shp.from_wkb(batch.column(0).to_numpy(zero_copy_only=False))
+
+    @staticmethod
+    def _vertices_dentro(tree, geoms, n_cells):
+        # Conta os vértices de cada célula: cada vértice das feicoes é consultado uma única vez no STRtree dos envelopes das
+        # células (um vértice na borda conta nas duas células). Um vértice dentro do bbox da célula implica que a feicao toca
+        # o bbox da célula, então o resultado é o mesmo de contar, para cada par (feicao, célula), os vértices da feicao
+        # dentro da célula, sem copiar uma feicao enorme para cada célula que ela toca. As coordenadas são lidas em fatias
+        # de até MAX_COORDS_BLOCO
+        n_vertices = np.zeros(n_cells, dtype=np.int64)
+        acumulado = np.cumsum(shp.get_num_coordinates(geoms))
+        inicio = 0
+        while inicio < len(geoms):
+            base = acumulado[inicio - 1] if inicio else 0
+            fim = max(inicio + 1, int(np.searchsorted(acumulado, base + MAX_COORDS_BLOCO, side='right')))
+            coords = shp.get_coordinates(geoms[inicio:fim])
+            for k in range(0, len(coords), MAX_COORDS_BLOCO):
+                _, celula = tree.query(shp.points(coords[k:k + MAX_COORDS_BLOCO]))
+                n_vertices += np.bincount(celula, minlength=n_cells)
+            inicio = fim
+        return n_vertices
+
+    def carga(self, cells):
+        """
+        Mede a carga de um array de células: número de feicoes cujo bbox toca o bbox da célula e número de vértices
+        dessas feicoes que estão dentro do bbox da célula. O input é lido em blocos (ver load_input), então a memória
+        depende de batch_rows e de MAX_COORDS_BLOCO, e não do tamanho do input ou do grid.
+
+        Returns:
+            Tupla (n_features, n_vertices), arrays do tamanho de cells
+        """
+        tree = STRtree(shp.envelope(cells))
+        n_features = np.zeros(len(cells), dtype=np.int64)
+        n_vertices = np.zeros(len(cells), dtype=np.int64)
+        for geoms in self._blocos():
+            _, idx_cell = tree.query(geoms)
+            n_features += np.bincount(idx_cell, minlength=len(cells))
+            n_vertices += self._vertices_dentro(tree, geoms, len(cells))
+        return n_features, n_vertices
+
+    def _quadrantes(self, cells):
+        # Divide o bbox de cada célula em 4 (1=SW, 2=SE, 3=NW, 4=NE) e intersecta com a célula original
+        xmin, ymin, xmax, ymax = shp.bounds(cells).T
+        xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+        caixas = [shp.box(xmin, ymin, xmid, ymid), shp.box(xmid, ymin, xmax, ymid),
+                  shp.box(xmin, ymid, xmid, ymax), shp.box(xmid, ymid, xmax, ymax)]
+        return [shp.intersection(cells, c) for c in caixas]
+
+    def plan(self, grid_gdf):
+        """
+        Gera a lista de trabalho a partir do grid original.
+
+        Args:
+            grid_gdf - grid com as colunas id e geometria
+
+        Returns:
+            GeoDataFrame com id, id_raiz, depth, n_features, n_vertices e a geometria de cada célula a ser processada
+        """
+        start_time = time.time()
+        base = _base_ids(int(grid_gdf["id"].max()))
+
+        id_raiz = grid_gdf["id"].to_numpy().astype(np.int64)
+        codigo = np.zeros(len(grid_gdf), dtype=np.int64)
+        cells = grid_gdf.geometry.to_numpy()
+
+        saida = []
+        for depth in range(self.max_depth + 1):
+            n_features, n_vertices = self.carga(cells)
+            pesada = (n_features > self.max_features) | (n_vertices > self.max_vertices)
+            if depth == self.max_depth:
+                pesada[:] = False
+
+            # Células leves (ou no limite de profundidade) entram na lista de trabalho
+            leve = ~pesada
+            ids = np.where(codigo[leve] == 0, id_raiz[leve], (base + id_raiz[leve]) * FATOR_ID + codigo[leve])
+            saida.append(gpd.GeoDataFrame(data={"id": ids,
+                                                "id_raiz": id_raiz[leve],
+                                                "depth": depth,
+                                                "n_features": n_features[leve],
+                                                "n_vertices": n_vertices[leve]},
+                                          geometry=cells[leve], crs=grid_gdf.crs))
+            if not pesada.any():
+                break
+
+            # Células pesadas são divididas em 4 e medidas de novo no próximo nível
+            logging.info(f"Planner: {pesada.sum()} células acima do orçamento no nível {depth}")
+            quadrantes = self._quadrantes(cells[pesada])
+            cells = np.concatenate(quadrantes)
+            id_raiz = np.tile(id_raiz[pesada], 4)
+            codigo = np.concatenate([codigo[pesada] * 10 + q for q in range(1, 5)])
+            nao_vazio = ~shp.is_empty(cells)
+            cells, id_raiz, codigo = cells[nao_vazio], id_raiz[nao_vazio], codigo[nao_vazio]
+
+        plano = pd.concat(saida, ignore_index=True)
+        plano = plano.rename_geometry(grid_gdf.geometry.name).sort_values("id").reset_index(drop=True)
+
+        elapsed_time = time.time() - start_time
+        logging.info(f"Planner: {len(grid_gdf)} células viraram {len(plano)} em {elapsed_time:.2f} segundos "
+                     f"(máximo de {plano['n_vertices'].max()} vértices e {plano['n_features'].max()} feicoes por célula)")
+        return plano
@@ -1,10 +1,138 @@
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely as shp
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
 import json
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from multiprocessing import Pool
+import shutil
 from dotenv import load_dotenv
 import time
 import logging
+from grid import square_grid, mask_grid
+
+def _geo_metadata(spatial_export):
+    # Metadados GeoParquet do arquivo gravado em streaming. geometry_types vazio significa tipos não informados
+    coluna = {"encoding": "WKB", "geometry_types": [], "crs": CRS.from_epsg(4674).to_json_dict()}
+    if spatial_export:
+        coluna["covering"] = {"bbox": {k: ["bbox", k] for k in ["xmin", "ymin", "xmax", "ymax"]}}
+    return {"version": "1.1.0", "primary_column": "geom", "columns": {"geom": coluna}}
+
+
+# Tipos do PostgreSQL (oid do cursor.description) para as colunas que chegam todas nulas no primeiro bloco. Sem isso a
+# coluna ficaria com o tipo null do arrow e o schema do arquivo (fixado pelo primeiro bloco) não aceitaria os blocos seguintes
+TIPOS_OID = {16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 700: pa.float32(), 701: pa.float64(),
+             1700: pa.float64(), 25: pa.string(), 1043: pa.string(), 1042: pa.string(), 1082: pa.date32(),
+             1114: pa.timestamp("us"), 1184: pa.timestamp("us", tz="UTC"),
+             1000: pa.list_(pa.bool_()), 1005: pa.list_(pa.int16()), 1007: pa.list_(pa.int32()), 1016: pa.list_(pa.int64()),
+             1021: pa.list_(pa.float32()), 1022: pa.list_(pa.float64()), 1009: pa.list_(pa.string()),
+             1015: pa.list_(pa.string())}
+
+
+def _ordenar_espacialmente(query):
+    # Ordem global da exportação espacial, feita no banco: geohash (curva Z) do centro do bbox de cada feicao. O arquivo
+    # gravado em streaming fica agrupado no espaço como um todo, não apenas dentro de cada bloco do cursor, e os row
+    # groups têm bbox pequenos. Feicoes vazias (sem bbox) ficam no final
+    centro = "ST_MakePoint((ST_XMin(s.geom) + ST_XMax(s.geom)) / 2, (ST_YMin(s.geom) + ST_YMax(s.geom)) / 2)"
+    return f"SELECT * FROM ({query.strip().rstrip(';')}) s ORDER BY ST_GeoHash({centro}, 12)"
+
+
+def _schema_arquivo(tabela, description, spatial_export):
+    # Schema do ParquetWriter a partir do primeiro bloco, com as colunas de tipo null trocadas pelo tipo do banco
+    tipos = {c[0]: TIPOS_OID.get(c[1], pa.string()) for c in description}
+    campos = [campo.with_type(tipos.get(campo.name, pa.string())) if pa.types.is_null(campo.type) else campo
+              for campo in tabela.schema]
+    return pa.schema(campos, metadata={b"geo": json.dumps(_geo_metadata(spatial_export)).encode()})
+
+
+def _chunk_to_arrow(df, spatial_export):
+    # Converte um bloco do cursor (geom em EWKB hex, como o psycopg2 devolve a geometria) em uma tabela arrow. Na exportação
+    # espacial o bloco já vem na ordem espacial da query (ver _ordenar_espacialmente)
+    geoms = shp.from_wkb(df["geom"].to_numpy())
+    tabela = pa.Table.from_pandas(df.drop(columns="geom"), preserve_index=False)
+    tabela = tabela.append_column("geom", pa.array(shp.to_wkb(geoms), type=pa.binary()))
+    if spatial_export:
+        xmin, ymin, xmax, ymax = shp.bounds(geoms).T
+        bbox = pa.StructArray.from_arrays([pa.array(v, type=pa.float64()) for v in (xmin, ymin, xmax, ymax)],
+                                          names=["xmin", "ymin", "xmax", "ymax"])
+        tabela = tabela.append_column("bbox", bbox)
+    return tabela, geoms
+
+
+def export_query(engine, query, path, spatial_export=False, row_group_size=2000, chunk_rows=20000, gpkg=None):
+    """
+    Exporta o resultado de uma query (colunas quaisquer + geom) para um GeoParquet em streaming, por um cursor nomeado
+    (server-side), em blocos de chunk_rows linhas gravados por um único ParquetWriter. O arquivo só aparece em path
+    quando a exportação termina. Se a query não retornar linhas nada é gravado. Com spatial_export a query é ordenada
+    no banco pela posição das feicoes (ver _ordenar_espacialmente).
+
+    Args:
+        gpkg - caminho opcional de uma cópia .gpkg, gravada bloco a bloco
+
+    Returns:
+        Número de linhas exportadas
+    """
+    logger = logging.getLogger("DataProcessor")
+    start_time = time.time()
+    temporario = path + ".tmp"
+    writer = None
+    n_linhas = 0
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor(name=f"split_export_{os.getpid()}")
+        cursor.itersize = chunk_rows
+        cursor.execute(_ordenar_espacialmente(query) if spatial_export else query)
+        while True:
+            linhas = cursor.fetchmany(chunk_rows)
+            if not linhas:
+                break
+            df = pd.DataFrame(linhas, columns=[c[0] for c in cursor.description])
+            tabela, geoms = _chunk_to_arrow(df, spatial_export)
+            if writer is None:
+                writer = pq.ParquetWriter(temporario, _schema_arquivo(tabela, cursor.description, spatial_export))
+            writer.write_table(tabela.cast(writer.schema), row_group_size=row_group_size)
+            if gpkg is not None:
+                gdf = gpd.GeoDataFrame(df.drop(columns="geom"), geometry=geoms, crs="EPSG:4674")
+                gdf.to_file(gpkg, layer='input', driver="GPKG", mode='w' if n_linhas == 0 else 'a')
+            n_linhas += len(df)
+            elapsed_time = time.time() - start_time
+            logger.info(f"Exportação de {os.path.basename(path)}: {n_linhas} linhas em {elapsed_time:.1f} segundos "
+                        f"({n_linhas / max(elapsed_time, 1e-9):.0f} linhas/s)")
+        cursor.close()
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.close()
+
+    if n_linhas == 0:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        return 0
+
+    # Um dataset anterior (exportação paralela) no mesmo caminho é substituído pelo arquivo
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(temporario, path)
+    logger.info(f"Arquivo Parquet exportado em streaming para {path}: {n_linhas} linhas em {time.time() - start_time:.2f} segundos")
+    return n_linhas
+
+
+def _export_partition(tarefa):
+    # Tarefa do Pool da exportação paralela: uma partição, com a sua própria conexão
+    url, query, path, spatial_export, row_group_size, chunk_rows = tarefa
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        return export_query(engine, query, path, spatial_export=spatial_export, row_group_size=row_group_size,
+                            chunk_rows=chunk_rows)
+    finally:
+        engine.dispose()
+
 
 class DataProcessor:
     def __init__(self, config_path="config.json", grid_spacing=0.5):
@@ -38,7 +166,12 @@ class DataProcessor:
         self.skip_input_gen = config["skip_input_gen"]
         self.skip_grid_gen = config.get("skip_grid_gen", False)  # Garantir existência
         self.input_from_clause = config["input_from_clause"]
-        self.grid_from_clause = config["grid_from_clause"]
+        self.grid_from_clause = config.get("grid_from_clause")
+        # Origem do grid: 'postgis' (grid_from_clause) ou 'local' (grid.py, células de grid_spacing graus filtradas pela
+        # máscara grid_mask_file, ou pelo próprio input_file, e/ou pela extensão grid_extent)
+        self.grid_source = config.get("grid_source", "postgis")
+        self.grid_mask_file = config.get("grid_mask_file")
+        self.grid_extent = config.get("grid_extent")
 
         # Parâmetro opcional
         if grid_spacing==0.5:
@@ -51,6 +184,23 @@ class DataProcessor:
         self.output_parquet = config["input_file"]
         self.grid_output_parquet = config["grid_file"]
 
+        # Exportação espacial: ordena as feicoes pela posição (curva de Hilbert no write_parquet, geohash no banco na
+        # exportação em streaming) e grava a coluna bbox (covering do GeoParquet) em row groups pequenos. Assim quem lê
+        # apenas um grid pula quase todos os row groups do arquivo
+        self.spatial_export = config.get("spatial_export", False)
+        self.row_group_size = config.get("row_group_size", 2000)
+        # Cópia .gpkg dos arquivos exportados (apenas para visualização, o pipeline usa somente o parquet)
+        self.export_gpkg = config.get("export_gpkg", True)
+        # Exportação do input em streaming (cursor no servidor, um bloco de export_chunk_rows linhas por vez). Com
+        # stream_export = false o input é carregado inteiro na memória, como antes
+        self.stream_export = config.get("stream_export", True)
+        self.export_chunk_rows = config.get("export_chunk_rows", 20000)
+        # Exportação paralela: com export_workers > 1 o input é dividido em export_partitions partições (por 'id' ou por
+        # faixas de longitude 'x') e o input_file vira um diretório com uma parte por partição
+        self.export_workers = config.get("export_workers", 1)
+        self.export_partitions = config.get("export_partitions", 4 * self.export_workers)
+        self.export_partition_by = config.get("export_partition_by", "id")
+
         # Criar o engine de conexão
         self.engine = create_engine(
             f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
@@ -77,19 +227,142 @@ class DataProcessor:
             raise ValueError("É necessária a geometria para prosseguir")
 
 
+    def stream_municipio_data(self):
+        """
+        Exporta o input_from_clause para o input_file sem carregar o resultado inteiro na memória. A query é lida por um
+        cursor nomeado (server-side) em blocos de export_chunk_rows linhas e cada bloco vira row groups do GeoParquet,
+        gravados por um único ParquetWriter. A memória fica limitada a um bloco, independente do tamanho do input.
+
+        Returns:
+            Número de feicoes exportadas
+        """
+        gpkg = self.output_parquet.replace(".parquet", ".gpkg") if self.export_gpkg else None
+        n_linhas = export_query(self.engine, self.input_from_clause, self.output_parquet, spatial_export=self.spatial_export,
+                                row_group_size=self.row_group_size, chunk_rows=self.export_chunk_rows, gpkg=gpkg)
+        if n_linhas == 0:
+            self.logger.warning("Nenhuma geometria encontrada para os municípios especificados.")
+        return n_linhas
+
+    def _partitions(self):
+        """
+        Divide o input_from_clause em export_partitions partições disjuntas. Retorna a lista de condições SQL sobre o
+        resultado da query (alias q).
+            - 'id': faixas de id de mesmo tamanho entre o menor e o maior id
+            - 'x': faixas de longitude pelo xmin de cada feicao (uma feicao cai em uma única faixa)
+        """
+        clause = self.input_from_clause.strip().rstrip(";")
+        with self.engine.connect() as conn:
+            if self.export_partition_by == "id":
+                inicio, fim = conn.execute(text(f"SELECT min(q.id), max(q.id) FROM ({clause}) q;")).fetchone()
+                coluna = "q.id"
+                fim = fim + 1
+            elif self.export_partition_by == "x":
+                inicio, fim = conn.execute(text(f"SELECT ST_XMin(e), ST_XMax(e) FROM (SELECT ST_Extent(q.geom) e FROM ({clause}) q) s;")).fetchone()
+                coluna = "ST_XMin(q.geom)"
+            else:
+                raise ValueError(f"export_partition_by '{self.export_partition_by}' desconhecido, use 'id' ou 'x'")
+        if inicio is None:
+            return []
+
+        limites = np.linspace(float(inicio), float(fim), self.export_partitions + 1)
+        if self.export_partition_by == "id":
+            limites = np.unique(np.round(limites).astype(np.int64))
+        condicoes = [f"{coluna} >= {a!r} AND {coluna} < {b!r}" for a, b in zip(limites[:-1].tolist(), limites[1:].tolist())]
+        # A última faixa inclui o limite superior (no id o fim já é max + 1)
+        condicoes[-1] = condicoes[-1].replace(" < ", " <= ")
+        return condicoes
+
+    def parallel_export_municipio_data(self):
+        """
+        Exporta o input_from_clause em paralelo: a query é dividida em partições disjuntas (ver _partitions), cada uma
+        exportada em streaming por um processo com a sua própria conexão, em um arquivo part-NNNNN.parquet. O input_file
+        vira um diretório (dataset) com as partes, lido como um único input pelo ParquetInputSource e pelo planner.
+
+        Returns:
+            Número de feicoes exportadas
+        """
+        start_time = time.time()
+        clause = self.input_from_clause.strip().rstrip(";")
+        condicoes = self._partitions()
+        if not condicoes:
+            self.logger.warning("Nenhuma geometria encontrada para os municípios especificados.")
+            return 0
+        if self.export_gpkg:
+            self.logger.info("export_gpkg é ignorado na exportação paralela")
+
+        temporario = self.output_parquet + ".tmp"
+        if os.path.isdir(temporario):
+            shutil.rmtree(temporario)
+        os.makedirs(temporario)
+
+        url = self.engine.url.render_as_string(hide_password=False)
+        tarefas = [(url, f"SELECT * FROM ({clause}) q WHERE {condicao}", os.path.join(temporario, f"part-{k:05d}.parquet"),
+                    self.spatial_export, self.row_group_size, self.export_chunk_rows)
+                   for k, condicao in enumerate(condicoes)]
+        self.logger.info(f"Exportação paralela do input em {len(tarefas)} partições por {self.export_partition_by} "
+                         f"com {self.export_workers} conexões")
+        with Pool(processes=self.export_workers) as pool:
+            contagens = pool.map(_export_partition, tarefas, chunksize=1)
+
+        # O input_file (arquivo ou dataset anterior) só é substituído quando todas as partições terminam
+        if os.path.isdir(self.output_parquet):
+            shutil.rmtree(self.output_parquet)
+        elif os.path.exists(self.output_parquet):
+            os.remove(self.output_parquet)
+        os.replace(temporario, self.output_parquet)
+
+        n_linhas = sum(contagens)
+        elapsed_time = time.time() - start_time
+        self.logger.info(f"Dataset {self.output_parquet} exportado: {n_linhas} feicoes em {sum(c > 0 for c in contagens)} partes, "
+                         f"{elapsed_time:.2f} segundos ({n_linhas / max(elapsed_time, 1e-9):.0f} linhas/s)")
+        return n_linhas
+
+    def write_parquet(self, gdf, path):
+        """
+        Grava o GeoDataFrame em parquet. Se spatial_export = True, as feicoes sao ordenadas pela distancia de Hilbert
+        (feicoes proximas ficam no mesmo row group) e a coluna bbox é gravada para permitir leitura filtrada por bbox.
+        """
+        if self.spatial_export:
+            ordem = np.argsort(gdf.geometry.hilbert_distance().values, kind="stable")
+            gdf = gdf.iloc[ordem].reset_index(drop=True)
+            gdf.to_parquet(path, write_covering_bbox=True, row_group_size=self.row_group_size)
+        else:
+            gdf.to_parquet(path)
+
     def export_municipio_data(self, gdf):
         try:
             
-            gdf.to_parquet(self.output_parquet)
+            self.write_parquet(gdf, self.output_parquet)
             self.logger.info(f"Arquivo Parquet exportado com sucesso para {self.output_parquet}")
-            gdf.to_file(self.output_parquet.replace(".parquet", ".gpkg"), layer='input', driver="GPKG")
+            if self.export_gpkg:
+                gdf.to_file(self.output_parquet.replace(".parquet", ".gpkg"), layer='input', driver="GPKG")
             logging.info('Novo arquivo input.parquet criado')
 
         except Exception as e:
             self.logger.error(f"Erro ao exportar dados dos municípios: {e}")
 
+    def create_local_grid(self):
+        """
+        Gera o grid localmente (ver grid.py), sem banco. Sem grid_mask_file e sem grid_extent a máscara é o input_file, então
+        só ficam as células com alguma feicao. Máscaras GeoParquet (como o input_file) são lidas em blocos, sem carregar
+        todas as geometrias (ver grid.mask_grid).
+        """
+        start_time = time.time()
+        if self.grid_mask_file is not None or self.grid_extent is None:
+            grid_gdf = mask_grid(self.grid_spacing, self.grid_mask_file or self.output_parquet, extent=self.grid_extent)
+        else:
+            grid_gdf = square_grid(self.grid_spacing, extent=self.grid_extent)
+        if grid_gdf.empty:
+            self.logger.warning("Nenhuma célula de grid foi gerada.")
+            return None
+        self.logger.info(f"Grid local de {self.grid_spacing} graus criado com {len(grid_gdf)} células em "
+                         f"{time.time() - start_time:.2f} segundos")
+        return grid_gdf
+
     def create_grid(self):
-        
+        if self.grid_source == "local":
+            return self.create_local_grid()
+
         # Construir a query de grid usando as cláusulas do config.json
         grid_query = f"""
         {self.grid_from_clause}
@@ -111,9 +384,10 @@ class DataProcessor:
     def export_grid_data(self, grid_gdf):
         try:
             
-            grid_gdf.to_parquet(self.grid_output_parquet)
+            self.write_parquet(grid_gdf, self.grid_output_parquet)
             self.logger.info(f"Grid Parquet exportado com sucesso para {self.grid_output_parquet}")
-            grid_gdf.to_file(self.grid_output_parquet.replace(".parquet", ".gpkg"), layer='grid', driver="GPKG")
+            if self.export_gpkg:
+                grid_gdf.to_file(self.grid_output_parquet.replace(".parquet", ".gpkg"), layer='grid', driver="GPKG")
             logging.info('Novo arquivo input.parquet criado')
         except Exception as e:
             self.logger.error(f"Erro ao exportar dados do grid: {e}")
@@ -121,7 +395,11 @@ class DataProcessor:
     def run(self):
         
         self.logger.info("Iniciando processamento de dados...")
-        if not self.skip_input_gen:
+        if not self.skip_input_gen and self.export_workers > 1:
+            self.parallel_export_municipio_data()
+        elif not self.skip_input_gen and self.stream_export:
+            self.stream_municipio_data()
+        elif not self.skip_input_gen:
             municipio_gdf = self.load_municipio_data()
             if municipio_gdf is not None:
                 self.export_municipio_data(municipio_gdf)
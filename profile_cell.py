@@ -0,0 +1,170 @@
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import tracemalloc
+import geopandas as gpd
+import pyarrow.parquet as pq
+import shapely as shp
+from input_source import MemoryInputSource
+from metrics import MetricsSink, rss_mb
+from split import Splitter
+
+
+# Perfil de um único grid, fora do Pool. Executa o Splitter.run no próprio processo, com:
+#   --cprofile   grava o perfil do cProfile (abrir com snakeviz ou pstats) e mostra as funções mais caras
+#   --tracemalloc snapshot de memória ao final de cada etapa, com as linhas que mais alocaram na etapa. O tracemalloc vê
+#                apenas as alocações do Python (numpy, pandas); a memória do GEOS aparece só no RSS
+#   --dump       grava as feicoes do grid e a geometria do grid em um GeoParquet autocontido (fixture)
+#   --replay     executa o grid a partir de uma fixture, sem banco
+#
+# Exemplos:
+#   python profile_cell.py 4312 --cprofile logs/grid_4312.prof --tracemalloc --dump fixtures/grid_4312.parquet
+#   python profile_cell.py --replay fixtures/grid_4312.parquet --cprofile logs/grid_4312_replay.prof
+#
+# Sem --upload o resultado não é gravado no banco (nem no manifesto, nem no logs/error_grids.txt) e o perfil usa o seu próprio
+# log (logs/profile_cell.log) e diretório de métricas (--metrics-dir), então pode ser feito durante uma execução.
+
+CHAVE_FIXTURE = b'split_fixture'
+
+
+def dump_fixture(splitter, path):
+    """
+    Grava as feicoes do grid atual (gdf_input_intersection) em GeoParquet, com o n_grid, a geometria do grid e as
+    colunas booleanas nos metadados do arquivo.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    splitter.gdf_input_intersection.to_parquet(path)
+    meta = {'n_grid': int(splitter.n_grid),
+            'unidade_split': shp.to_wkt(splitter.unidade_split),
+            'boleanas': list(splitter.boleanas)}
+    tabela = pq.read_table(path)
+    tabela = tabela.replace_schema_metadata({**tabela.schema.metadata, CHAVE_FIXTURE: json.dumps(meta).encode()})
+    pq.write_table(tabela, path)
+    logging.info(f"Fixture do grid {splitter.n_grid} gravada em {path} ({len(splitter.gdf_input_intersection)} feicoes)")
+
+
+def load_fixture(path):
+    """
+    Lê uma fixture gravada pelo dump_fixture.
+
+    Returns:
+        Tupla (n_grid, grid_gdf com a geometria do grid, fonte de input em memória, colunas booleanas)
+    """
+    meta = json.loads(pq.read_schema(path).metadata[CHAVE_FIXTURE])
+    grid_gdf = gpd.GeoDataFrame(data={'id': [meta['n_grid']]}, geometry=[shp.from_wkt(meta['unidade_split'])], crs='EPSG:4674')
+    return meta['n_grid'], grid_gdf, MemoryInputSource(gpd.read_parquet(path)), meta['boleanas']
+
+
+class StageMemory:
+    """
+    Gancho do Splitter.run (stage_hook) que tira um snapshot do tracemalloc ao final de cada etapa
+    """
+
+    def __init__(self, top=5):
+        self.top = top
+        self.registros = []
+        self.anterior = self._snapshot()
+
+    @staticmethod
+    def _snapshot():
+        # Ignora as alocações do próprio tracemalloc e dos imports
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                          tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')])
+
+    def __call__(self, etapa, splitter):
+        atual, pico = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        linhas = snapshot.compare_to(self.anterior, 'lineno')[:self.top]
+        self.registros.append({'etapa': etapa, 'atual_mb': atual / 1024 ** 2, 'pico_mb': pico / 1024 ** 2,
+                               'rss_mb': rss_mb(), 'linhas': [str(l) for l in linhas]})
+        self.anterior = snapshot
+        tracemalloc.reset_peak()
+
+    def report(self):
+        partes = []
+        for r in self.registros:
+            partes.append(f"{r['etapa']}: tracemalloc atual {r['atual_mb']:.1f} MB, pico {r['pico_mb']:.1f} MB, RSS {r['rss_mb']:.1f} MB")
+            partes.extend(f"    {l}" for l in r['linhas'])
+        return '\n'.join(partes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Perfil de um único grid do split')
+    parser.add_argument('n_grid', nargs='?', type=int, help='Grid a processar (id do grid_file)')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--grid-file', help='Grid (ou plano) a usar no lugar do grid_file do config')
+    parser.add_argument('--replay', help='Fixture gerada com --dump. Executa sem banco')
+    parser.add_argument('--dump', help='Grava as feicoes do grid nessa fixture GeoParquet')
+    parser.add_argument('--cprofile', help='Arquivo de saída do cProfile')
+    parser.add_argument('--tracemalloc', action='store_true', help='Snapshot de memória por etapa')
+    parser.add_argument('--upload', action='store_true', help='Grava o resultado no banco e no manifesto')
+    parser.add_argument('--top', type=int, default=25, help='Número de funções/linhas mostradas')
+    parser.add_argument('--metrics-dir', default='logs/profile_metrics',
+                        help='Diretório das métricas do grid (separado do metrics_dir da execução)')
+    args = parser.parse_args()
+    if args.n_grid is None and args.replay is None:
+        parser.error('informe o n_grid ou --replay')
+
+    os.makedirs('logs', exist_ok=True)
+    splitter = Splitter(config_path=args.config, log_file='logs/profile_cell.log')
+    splitter.metrics = MetricsSink(metrics_dir=args.metrics_dir)
+    source = None
+    engine = None
+
+    if args.replay:
+        n_grid, grid_gdf, source, splitter.boleanas = load_fixture(args.replay)
+        upload = False
+    else:
+        n_grid = args.n_grid
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+        grid_gdf = gpd.read_parquet(args.grid_file or config['grid_file'])
+        engine = splitter.create_db_engine()
+        splitter.boleanas = splitter.colunas_boleanas(engine=engine)
+        upload = args.upload
+
+    profiler = cProfile.Profile() if args.cprofile else None
+
+    # Ganchos por etapa: fixture logo após a consulta do input e snapshots do tracemalloc. O cProfile é pausado durante
+    # o gancho para não medir o próprio tracemalloc
+    memoria = None
+    if args.tracemalloc:
+        tracemalloc.start()
+        memoria = StageMemory(top=max(args.top // 5, 1))
+
+    def gancho(etapa, s):
+        if profiler is not None:
+            profiler.disable()
+        if etapa == 'intersection_time' and args.dump:
+            dump_fixture(s, args.dump)
+        if memoria is not None:
+            memoria(etapa, s)
+        if profiler is not None:
+            profiler.enable()
+    splitter.stage_hook = gancho
+
+    try:
+        if profiler is not None:
+            profiler.enable()
+        splitter.run(n_grid, grid_gdf=grid_gdf, engine=engine, source=source, upload=upload)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if engine is not None:
+            engine.dispose()
+
+    if profiler is not None:
+        os.makedirs(os.path.dirname(args.cprofile) or '.', exist_ok=True)
+        profiler.dump_stats(args.cprofile)
+        print(f"Perfil gravado em {args.cprofile}")
+        pstats.Stats(args.cprofile).sort_stats('cumulative').print_stats(args.top)
+    if memoria is not None:
+        print(memoria.report())
+        tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import numpy as np
+import logging
+import time
+import pyarrow.parquet as pq
+import shapely as shp
+from shapely.strtree import STRtree
+from input_source import input_files, read_geo_metadata
+
+
+# Escalonamento dos grids no Pool. Os grids são enviados do mais pesado para o mais leve (longest job first), para que as
+# células pesadas não fiquem para o final da execução com um único core trabalhando. Células pesadas vão sozinhas em cada
+# tarefa; as leves são agrupadas em lotes de custo parecido, para não pagar o overhead do Pool a cada grid de milissegundos.
+#
+# Sem execução anterior e sem plano (plan_grid) o custo vem do número de feicoes candidatas de cada grid (feicoes cujo bbox
+# toca o bbox do grid, as mesmas que o query_bbox retorna), contado em uma passada pelos bbox do input_file.
+
+
+def candidate_counts(grid_gdf, input_file, batch_rows=200000):
+    """
+    Conta as feicoes do input_file (arquivo ou dataset) cujo bbox toca o bbox de cada grid. Se o GeoParquet tiver a coluna
+    de bbox (covering) lê apenas ela; senão lê as geometrias em blocos de batch_rows feicoes.
+
+    Returns:
+        np.array com o número de candidatas na ordem de grid_gdf
+    """
+    start_time = time.time()
+    geo = read_geo_metadata(input_file)
+    geom_col = geo['primary_column']
+    covering = geo['columns'][geom_col].get('covering', {}).get('bbox')
+    colunas = [covering['xmin'][0]] if covering else [geom_col]
+
+    tree = STRtree(shp.envelope(grid_gdf.geometry.values))
+    contagem = np.zeros(len(grid_gdf), dtype=np.int64)
+    for arquivo in input_files(input_file):
+        for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=batch_rows, columns=colunas):
+            if covering:
+                bbox = batch.column(0)
+                caixas = shp.box(*(bbox.field(covering[c][1]).to_numpy(zero_copy_only=False)
+                                   for c in ('xmin', 'ymin', 'xmax', 'ymax')))
+            else:
+                caixas = shp.from_wkb(batch.column(0).to_numpy(zero_copy_only=False))
+            # Sem predicado o STRtree compara apenas os envelopes
+            _, idx = tree.query(caixas)
+            contagem += np.bincount(idx, minlength=len(grid_gdf))
+    logging.info(f"Feicoes candidatas por grid contadas em {time.time() - start_time:.2f} segundos")
+    return contagem
+
+
+def estimate_costs(grids, grid_gdf, tempos_anteriores=None):
+    """
+    Estima o custo de cada grid.
+
+    Prioridade:
+        1. Tempo do grid em uma execução anterior (manifesto). Se nenhum grid com tempo tiver carga, os tempos são ignorados
+           e todos os grids usam a carga (as unidades não podem ser convertidas)
+        2. Número de vértices (ou feicoes) do plano do grid (ver planner.py) ou de feicoes candidatas (n_candidatas, ver
+           candidate_counts), convertido para segundos pela mediana segundos/unidade dos grids que têm as duas informações
+        3. Custo uniforme, se não houver nenhuma informação
+
+    Args:
+        grids - lista de n_grid a processar
+        grid_gdf - grid (ou plano) com a coluna id e, opcionalmente, n_vertices/n_features/n_candidatas
+        tempos_anteriores - dict n_grid -> segundos de uma execução anterior
+
+    Returns:
+        np.array de custos na ordem de grids
+    """
+    tempos_anteriores = tempos_anteriores or {}
+    grids = np.asarray(grids)
+    tempo = np.array([tempos_anteriores.get(int(g), np.nan) for g in grids], dtype=float)
+
+    carga = np.full(len(grids), np.nan)
+    for coluna in ["n_vertices", "n_features", "n_candidatas"]:
+        if coluna in grid_gdf.columns:
+            por_id = dict(zip(grid_gdf["id"].to_numpy().tolist(), grid_gdf[coluna].to_numpy(dtype=float).tolist()))
+            carga = np.array([por_id.get(int(g), np.nan) for g in grids], dtype=float)
+            break
+
+    # Converte carga em segundos usando os grids que têm tempo e carga
+    ambos = ~np.isnan(tempo) & ~np.isnan(carga) & (carga > 0)
+    if ambos.any():
+        segundos_por_unidade = np.median(tempo[ambos] / carga[ambos])
+        carga = carga * segundos_por_unidade
+    elif not np.isnan(carga).all():
+        # Sem nenhum grid com as duas informações (ex.: retomada com um plano novo) não há como converter a carga em
+        # segundos. Usa apenas a carga, para não ordenar segundos e vértices juntos
+        tempo = np.full(len(grids), np.nan)
+
+    custo = np.where(np.isnan(tempo), carga, tempo)
+    if np.isnan(custo).all():
+        logging.warning("Sem tempos anteriores nem carga dos grids: custo uniforme, os grids seguem a ordem recebida")
+        return np.ones(len(grids))
+    # Grids sem nenhuma informação recebem o custo mediano
+    return np.where(np.isnan(custo), np.nanmedian(custo), custo)
+
+
+def build_tasks(grids, custos, num_processes, lotes_por_processo=20):
+    """
+    Monta as tarefas do Pool em ordem decrescente de custo.
+    O orçamento de cada tarefa é custo_total / (num_processes * lotes_por_processo). Grids acima do orçamento vão sozinhos,
+    os demais são agrupados até atingirem o orçamento.
+
+    Returns:
+        Lista de tarefas (cada uma uma lista de n_grid) e lista com o custo de cada tarefa
+    """
+    ordem = np.argsort(-np.asarray(custos), kind="stable")
+    orcamento = float(np.sum(custos)) / max(1, num_processes * lotes_por_processo)
+
+    tarefas, custos_tarefas = [], []
+    lote, custo_lote = [], 0.0
+    for i in ordem:
+        g, c = grids[i], float(custos[i])
+        if c >= orcamento:
+            tarefas.append([g])
+            custos_tarefas.append(c)
+            continue
+        lote.append(g)
+        custo_lote += c
+        if custo_lote >= orcamento:
+            tarefas.append(lote)
+            custos_tarefas.append(custo_lote)
+            lote, custo_lote = [], 0.0
+    if lote:
+        tarefas.append(lote)
+        custos_tarefas.append(custo_lote)
+
+    return tarefas, custos_tarefas
+
+
+class Progress:
+    """
+    Linha de progresso com ETA, ponderada pelo custo estimado das tarefas já concluídas.
+    """
+
+    def __init__(self, n_grids, custo_total, intervalo=10):
+        self.n_grids = n_grids
+        self.custo_total = custo_total
+        self.intervalo = intervalo
+        self.start_time = time.time()
+        self.ultimo_log = 0
+        self.grids_feitos = 0
+        self.custo_feito = 0.0
+
+    def update(self, n_grids, custo):
+        self.grids_feitos += n_grids
+        self.custo_feito += custo
+        agora = time.time()
+        if agora - self.ultimo_log >= self.intervalo or self.grids_feitos == self.n_grids:
+            self.ultimo_log = agora
+            logging.info(self.linha())
+
+    def linha(self):
+        elapsed = time.time() - self.start_time
+        fracao = self.custo_feito / self.custo_total if self.custo_total else 1.0
+        eta = elapsed * (1 - fracao) / fracao if fracao > 0 else float("nan")
+        return (f"Progresso: {self.grids_feitos}/{self.n_grids} grids ({100 * fracao:.1f}% do custo estimado) - "
+                f"{elapsed:.0f}s decorridos - ETA {eta:.0f}s")
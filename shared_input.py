@@ -0,0 +1,208 @@
+import logging
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+import geopandas as gpd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely as shp
+from shapely.strtree import STRtree
+from input_source import input_files, read_geo_metadata
+
+
+# Input em memória compartilhada para os workers do Pool (input_source = 'shared'). O processo principal lê o input_file uma
+# única vez e grava em blocos de shared_memory:
+#   wkb      - as geometrias em WKB, concatenadas (uint8)
+#   offsets  - início de cada geometria no wkb (int64, n + 1)
+#   bounds   - bbox de cada feicao (float64, n x 4)
+#   ids      - id (int64)
+#   layers   - código do id_layer (int32), com a lista de id_layer no spec
+# Os workers se conectam aos blocos sem cópia (arrays numpy sobre o buffer) e decodificam apenas as feicoes candidatas do
+# grid. Assim a memória do input não se multiplica por num_processes, como acontece quando cada worker lê o input_file.
+#
+# A seleção das candidatas usa um STRtree dos bbox das feicoes, criado uma vez por worker no attach (mesma semântica do &&
+# do PostGIS e do query_bbox). O índice guarda apenas retângulos, bem menor que as geometrias do input. As candidatas voltam
+# na ordem do input_file, então o resultado de cada grid é o mesmo da fonte parquet. O WKB das candidatas é lido por um
+# BinaryArray do pyarrow sobre os blocos (sem cópia), sem laço em Python.
+
+ARRAYS = {'wkb': np.uint8, 'offsets': np.int64, 'bounds': np.float64, 'ids': np.int64, 'layers': np.int32}
+
+
+def _abrir_bloco(nome, tracker_pid):
+    # Bloco aberto por um worker. Até o Python 3.13 o SharedMemory(name=...) registra o bloco no resource_tracker, que o
+    # apagaria quando o processo encerrasse. Os workers do Pool herdam o resource_tracker do processo principal (com fork o
+    # mesmo pid, com spawn apenas o descritor, sem pid): o registro é o mesmo do dono e desfazê-lo aqui apagaria o do dono.
+    # Com um resource_tracker próprio o registro do worker é removido e o bloco fica a cargo do dono
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=nome, track=False)
+    bloco = shared_memory.SharedMemory(name=nome)
+    pid = resource_tracker._resource_tracker._pid
+    if pid is not None and pid != tracker_pid:
+        resource_tracker.unregister(bloco._name, 'shared_memory')
+    return bloco
+
+
+class SharedInputStore:
+    """
+    Fonte de input em memória compartilhada. Criada no processo principal com create e aberta nos workers com attach(spec).
+    """
+
+    def __init__(self, spec, blocos, dono=False):
+        self.spec = spec
+        self._blocos = blocos
+        self._dono = dono
+        self.categorias = spec['categorias']
+        self.arrays = {nome: np.ndarray(spec['shapes'][nome], dtype=ARRAYS[nome], buffer=blocos[nome].buf)
+                       for nome in ARRAYS}
+        self._tree = None
+        self._wkb = None
+
+    @classmethod
+    def create(cls, input_file, batch_rows=200000):
+        """
+        Lê o input_file (arquivo ou dataset) em blocos de batch_rows feicoes e grava os arrays em shared_memory.
+        """
+        start_time = time.time()
+        geom_col = read_geo_metadata(input_file)['primary_column']
+        arquivos = input_files(input_file)
+
+        # Primeira passada: número de feicoes e tamanho total do WKB, para alocar os blocos
+        n = n_bytes = 0
+        for arquivo in arquivos:
+            for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=batch_rows, columns=[geom_col]):
+                n += batch.num_rows
+                n_bytes += pc.sum(pc.binary_length(batch.column(0))).as_py() or 0
+
+        shapes = {'wkb': (n_bytes,), 'offsets': (n + 1,), 'bounds': (n, 4), 'ids': (n,), 'layers': (n,)}
+        blocos = {}
+        store = None
+        try:
+            for nome, dtype in ARRAYS.items():
+                tamanho = int(np.prod(shapes[nome])) * np.dtype(dtype).itemsize
+                # shared_memory não aceita tamanho 0
+                blocos[nome] = shared_memory.SharedMemory(create=True, size=max(tamanho, 1))
+            spec = {'nomes': {nome: b.name for nome, b in blocos.items()}, 'shapes': shapes, 'categorias': [],
+                    'tracker_pid': getattr(resource_tracker._resource_tracker, '_pid', None)}
+            store = cls(spec, blocos, dono=True)
+            store._preencher(arquivos, geom_col, batch_rows)
+        except BaseException:
+            if store is not None:
+                store.close()
+            else:
+                for b in blocos.values():
+                    b.close()
+                    b.unlink()
+            raise
+
+        logging.info(f"Input {input_file} em memória compartilhada: {n} feicoes, {n_bytes / 1024 ** 2:.1f} MB de WKB, "
+                     f"{time.time() - start_time:.2f} segundos")
+        return store
+
+    def _preencher(self, arquivos, geom_col, batch_rows):
+        # Segunda passada: copia o WKB e preenche offsets, bounds, ids e códigos do id_layer
+        wkb, offsets, bounds = self.arrays['wkb'], self.arrays['offsets'], self.arrays['bounds']
+        ids, layers = self.arrays['ids'], self.arrays['layers']
+        codigos = {}
+        i = pos = 0
+        offsets[0] = 0
+        for arquivo in arquivos:
+            for batch in pq.ParquetFile(arquivo).iter_batches(batch_size=batch_rows, columns=['id', 'id_layer', geom_col]):
+                k = batch.num_rows
+                geom = batch.column(geom_col)
+                # Buffers do BinaryArray: offsets relativos ao bloco e os bytes concatenados, copiados de uma vez
+                tipo = np.int64 if pa.types.is_large_binary(geom.type) else np.int32
+                inicio = np.frombuffer(geom.buffers()[1], dtype=tipo)[geom.offset:geom.offset + k + 1].astype(np.int64)
+                dados = np.frombuffer(geom.buffers()[2], dtype=np.uint8)[inicio[0]:inicio[-1]] if inicio[-1] > inicio[0] else np.zeros(0, np.uint8)
+                wkb[pos:pos + len(dados)] = dados
+                offsets[i + 1:i + k + 1] = pos + inicio[1:] - inicio[0]
+                bounds[i:i + k] = shp.bounds(shp.from_wkb(geom.to_numpy(zero_copy_only=False)))
+                id_col = batch.column('id')
+                if not pa.types.is_integer(id_col.type):
+                    raise ValueError(f"input_source 'shared' exige id inteiro, recebido {id_col.type}")
+                ids[i:i + k] = id_col.to_numpy(zero_copy_only=False)
+                # Códigos do id_layer: o dicionário do bloco é traduzido para os códigos globais
+                dicionario = pc.dictionary_encode(batch.column('id_layer'))
+                globais = np.array([codigos.setdefault(v, len(codigos)) for v in dicionario.dictionary.to_pylist()], dtype=np.int32)
+                layers[i:i + k] = globais[dicionario.indices.to_numpy(zero_copy_only=False)] if len(globais) else 0
+                i += k
+                pos += len(dados)
+        self.categorias = self.spec['categorias'] = list(codigos)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Conecta aos blocos criados pelo processo principal (nos workers), sem copiar os dados.
+        """
+        blocos = {}
+        try:
+            for nome in ARRAYS:
+                blocos[nome] = _abrir_bloco(spec['nomes'][nome], spec.get('tracker_pid'))
+            store = cls(spec, blocos)
+            store._indexar()
+        except BaseException:
+            for b in blocos.values():
+                b.close()
+            raise
+        return store
+
+    def _indexar(self):
+        # STRtree dos bbox (as feicoes sem bbox, vazias, ficam de fora) e BinaryArray do WKB sobre os blocos
+        b = self.arrays['bounds']
+        caixas = shp.box(b[:, 0], b[:, 1], b[:, 2], b[:, 3])
+        caixas[np.isnan(b).any(axis=1)] = None
+        self._tree = STRtree(caixas)
+        n = len(self.arrays['ids'])
+        self._wkb = pa.Array.from_buffers(pa.large_binary(), n, [None, pa.py_buffer(self.arrays['offsets']),
+                                                                 pa.py_buffer(self.arrays['wkb'])])
+
+    def query(self, n_grid, bounds):
+        """
+        Ponto de entrada comum das fontes: seleciona as feicoes do grid pelo bbox dele. O n_grid é ignorado.
+
+        Args:
+            n_grid - id do grid
+            bounds - (minx, miny, maxx, maxy) do grid
+        """
+        return self.query_bbox(*bounds)
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """
+        Seleciona as feicoes cujo bbox intersecta o bbox dado (mesma semântica do && do PostGIS). Decodifica apenas elas.
+
+        Returns:
+            GeoDataFrame com id, id_layer e geom
+        """
+        if self._tree is None:
+            self._indexar()
+        # Sem predicado o STRtree compara apenas os envelopes, que aqui são os próprios bbox
+        idx = np.sort(self._tree.query(shp.box(minx, miny, maxx, maxy)))
+        geoms = shp.from_wkb(self._wkb.take(pa.array(idx, type=pa.int64())).to_numpy(zero_copy_only=False))
+        id_layer = np.asarray(self.categorias, dtype=object)[self.arrays['layers'][idx]] if len(idx) else np.array([], dtype=object)
+        return gpd.GeoDataFrame(data={'id': self.arrays['ids'][idx].copy(), 'id_layer': id_layer},
+                                geometry=gpd.GeoSeries(geoms, crs='EPSG:4674'), crs='EPSG:4674').rename_geometry('geom')
+
+    def layers(self):
+        """
+        Retorna a lista de id_layer distintos do input.
+        """
+        return list(self.categorias)
+
+    def close(self):
+        """
+        Desconecta dos blocos. No processo principal (dono) também libera a memória compartilhada.
+        """
+        # As referências aos buffers (arrays, BinaryArray) precisam sair antes do close dos blocos
+        self._tree = None
+        self._wkb = None
+        self.arrays = {}
+        for b in self._blocos.values():
+            b.close()
+            if self._dono:
+                b.unlink()
+        self._blocos = {}
+
+    def __getstate__(self):
+        # O store não vai para os workers por pickle (cada worker usa attach com o spec)
+        raise TypeError('SharedInputStore não é serializável, use SharedInputStore.attach(store.spec)')
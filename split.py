@@ -7,15 +7,23 @@ import json
 import time
 import os
 import shapely as shp
-from multiprocessing import Pool
+from multiprocessing import Pool, Process, Queue
+from multiprocessing.util import Finalize
 from functools import partial
 import numpy as np
 from rtree import index
-import psutil
 from shapely.strtree import STRtree
 from sqlalchemy import text, create_engine
 from dotenv import load_dotenv
 from sqlalchemy import Table, MetaData, Index
+from input_source import create_input_source
+from shared_input import SharedInputStore
+from bulk_copy import copy_to_postgis, format_copy_rows
+from writer import run_writer, send_to_writers, stop_writers, WriterError
+from manifest import Manifest
+from scheduler import estimate_costs, build_tasks, candidate_counts, Progress
+from area import area_ha
+from metrics import MetricsSink, rss_mb, peak_rss_mb
 
 
 
@@ -28,7 +36,9 @@ def load_input(input_file):
 
 class Splitter:
 
-    def __init__(self, config_path="config.json"):
+    def __init__(self, config_path="config.json", log_file="logs/splitter.log"):
+        # log_file: log do Splitter, recriado a cada instância. O profile_cell.py usa outro arquivo para não apagar o log de
+        # uma execução em andamento
         
         # Carregar variáveis do .env para conexão com o banco
         load_dotenv()
@@ -50,7 +60,40 @@ class Splitter:
         self.num_processes = config["num_processes"]
         self.arquivo_final = config["arquivos_final"]
         self.split_table_name = config["split_table_name"]
-        self.memory = psutil.virtual_memory()
+        # De onde vem as feicoes de cada grid: 'postgis' (tabela split_table_name) ou 'parquet' (input_file local)
+        self.input_source = config.get("input_source", "postgis")
+        # Dataset com as feicoes de cada grid, gerado em uma única passada pelo assignment.py (input_source = 'assignment')
+        self.assignment_dir = config.get("assignment_dir", "./inputs/assignment")
+        # Recorte das linhas de corte pelo envelope do grid antes do node (margem em graus)
+        self.clip_to_cell = config.get("clip_to_cell", True)
+        self.clip_margin = config.get("clip_margin", 0.0001)
+        # Cacos menores que essa área (m², aproximada) são descartados no perform_split. 0 desliga o filtro
+        self.min_shard_area_m2 = config.get("min_shard_area_m2", 0)
+        self.n_slivers = 0
+        # Grade de precisão (graus) aplicada às linhas antes do node. 0 desliga. precision_compare conta os cacos removidos
+        self.precision_grid_size = config.get("precision_grid_size", 0)
+        self.precision_compare = config.get("precision_compare", False)
+        self.n_vertices_snap = 0
+        self.n_shards_sem_snap = None
+        self.n_shards_snap = None
+        # Processos escritores (ver writer.py). Com 0 cada worker faz o upload do seu grid, como antes
+        self.writer_processes = config.get("writer_processes", 0)
+        self.writer_batch_rows = config.get("writer_batch_rows", 50000)
+        self.writer_batch_bytes = config.get("writer_batch_bytes", 64 * 1024 * 1024)
+        self.writer_queue_size = config.get("writer_queue_size", 4 * self.num_processes)
+        self.writer_pids = []  # Preenchido pelo run_parallel, usado pelos workers para conferir se os escritores estão vivos
+        # Retomar uma execução interrompida: não apaga a tabela de saída e processa apenas os grids pendentes/falhos do manifesto
+        self.resume = config.get("resume", False)
+        self.manifest = Manifest(self.schema, self.arquivo_final)
+        # Escalonamento (ver scheduler.py): tempos de execuções anteriores, lidos do manifesto no prepare_run
+        self.tempos_anteriores = {}
+        self.lotes_por_processo = config.get("schedule_batches_per_process", 20)
+        # Métricas por grid (ver metrics.py). tentativas_anteriores vem do manifesto, na retomada
+        self.metrics = MetricsSink(metrics_dir=config.get("metrics_dir", "logs/metrics"),
+                                   formato=config.get("metrics_format", "jsonl"),
+                                   prometheus_file=config.get("metrics_prometheus_file"))
+        self.tentativas_anteriores = {}
+        self.stage_hook = None
 
         # Cria objetos estáticos vazios
         self.grid_gdf = None
@@ -60,25 +103,13 @@ class Splitter:
         #Logger dentro do init
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.DEBUG)                
-        # Configuração básica de saída para o console
-        file_handler = logging.FileHandler('logs/splitter.log', mode='w', encoding='utf-8')
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        # Adiciona o handler ao logger
-        if not self.logger.hasHandlers():  # Evita duplicação de handlers
+        # Adiciona o handler ao logger. O arquivo só é aberto (e truncado) se o handler for usado
+        if log_file is not None and not self.logger.hasHandlers():  # Evita duplicação de handlers
+            file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            file_handler.setFormatter(formatter)
             self.logger.addHandler(file_handler)
 
-        # Dicionário com zonas UTM e seus respectivos códigos EPSG (apenas para o Brasil)
-        self.utm_epsg_brazil = {
-            18: 32718,  # UTM Zona 18S
-            19: 32719,  # UTM Zona 19S
-            20: 32720,  # UTM Zona 20S
-            21: 32721,  # UTM Zona 21S
-            22: 32722,  # UTM Zona 22S
-            23: 32723,  # UTM Zona 23S
-            24: 32724,  # UTM Zona 24S
-            25: 32725   # UTM Zona 25S
-        }
 
 
 
@@ -87,20 +118,17 @@ class Splitter:
 
 
     
-    def _intersection_sql(self, n_grid, grid_gdf, engine):
+    def _intersection(self, n_grid, grid_gdf, source):
         """
-        Realiza uma consulta SQL para selecionar geometrias que intersectam a unidade_split.
+        Consulta a fonte de input para selecionar geometrias que intersectam a unidade_split.
         
         Args:
-            engine de conexão com o banco;
+            source - fonte de input (ver input_source.py), banco ou arquivo parquet local;
             n_grid - número do grid para o qual será feito o processamento
             grid_gdf - tabela com todos os grids para selecionar pelo número dado. Essa tabela é inputada para não ficar instanciada na memoria
 
-        Returns:
-            Retorno é o elapsed_time, mas um objeto é criado dentro da instância
+        O resultado fica na instância (gdf_input_intersection)
         """
-        start_time=time.time()
-
         #Unidade split é o grid em questão. O split é performado apenas entre as feicoes que tocam o grid.
         self.n_grid = n_grid
         self.unidade_split = grid_gdf[grid_gdf["id"] == self.n_grid].geometry.values[0]
@@ -108,87 +136,95 @@ class Splitter:
         # Garantir que unidade_split esteja definida
         if not hasattr(self, "unidade_split"):
             self.logger.error("unidade_split não está definida.")
-            raise ValueError("unidade_split precisa estar definida antes de chamar intersection_sql.")
+            raise ValueError("unidade_split precisa estar definida antes de chamar _intersection.")
         
         # Extrair os bounds da unidade_split
         bounds = self.unidade_split.bounds  # (minx, miny, maxx, maxy)
-        minx, miny, maxx, maxy = bounds
-        
-        # Criar a query SQL para filtrar na tabela inputs apenas os registros que estao no bounding box do grid
-        query = f"""
-        SELECT id, id_layer, geom
-        FROM {self.split_table_name}
-        WHERE geom && ST_MakeEnvelope({minx}, {miny}, {maxx}, {maxy}, 4674
-        );
-        """
         
-        # Conectar ao banco de dados e ler
+        # Consultar a fonte de input apenas pelos registros que estao no bounding box do grid
         try:      
                
-            # Executar a consulta e carregar os dados como GeoDataFrame
-            result_gdf = gpd.read_postgis(query, con=engine, geom_col='geom')
+            # Executar a consulta e carregar os dados como GeoDataFrame. A fonte por célula usa o n_grid, as demais o bbox
+            result_gdf = source.query(self.n_grid, bounds)
 
             # Criar o GeoDataFrame final no formato desejado
             self.gdf_input_intersection = gpd.GeoDataFrame(data={
-                    'id': result_gdf['id'],
-                    'id_layer': result_gdf['id_layer'],
-                    'geom': result_gdf.geom},
+                    'id': result_gdf['id'].values,
+                    'id_layer': result_gdf['id_layer'].values,
+                    'geom': result_gdf.geom.values},
                 geometry='geom',
                 crs='EPSG:4674'
             )
-
-            #Indexa o GeoDF
-            self.spatial_index = STRtree(self.gdf_input_intersection.geom)            
-            elapsed_time=time.time()-start_time            
-            return f'{elapsed_time:.2f}'
         
         #Erro genérico (ponto de melhoria)
         except Exception as e: 
-            self.logger.error(f"Erro ao executar consulta SQL: {e}")
+            self.logger.error(f"Erro ao consultar a fonte de input ({self.input_source}): {e}")
             raise
+
+    def create_input_source(self, engine=None):
+        """
+        Cria a fonte de input configurada. A fonte parquet nao usa o engine e é reaproveitada entre grids do mesmo processo.
+        """
+        return create_input_source(self.input_source, engine=engine,
+                                   split_table_name=self.split_table_name, input_file=self.input_file,
+                                   assignment_dir=self.assignment_dir)
   
     def prepare_split_line(self):
         
         self.counter=0
-        start_time=time.time()
-
         """Essa funcao é a mais complicada do código
         O que ela se propõe a fazer é simples: Gerar uma MultiLinestring que será inputada no shp.node()
-        Essa multilinestring deve ser construída da maneira mais manual possível"""
+        Todos os aneis (exterior e buracos) de todas as partes dos poligonos viram linhas de corte. 
+        Tudo é feito com as funcoes vetorizadas do shapely 2, sem iterar linha a linha"""
 
         try:
-            linerings=[]
-            #Temos que forçar que todos os poligonos de entrada devem formar lines rings. Caso isso não seja possível a geometria deve ser descartada pois vai dar BO
-            for index, row in self.gdf_input_intersection.iterrows():
-                #Seleciona geometria do dado
-                geom=row.geom           
-                #Se for multipolygon, seleciona o primeiro polygon da feição e pega o boundary. 
-                # Aqui todas as geometria sao validas
-                if isinstance(geom, MultiPolygon):   
-                    geom= geom.geoms[0] 
-                    line=geom.exterior
-                elif isinstance(geom, Polygon):
-                    geom = geom
-                    line=geom.exterior # A funcao exterior é um sacada, ao invés de usar a boundary. Ler documentacao para compreender.
-
-                #Se a linha capturada for válida, appenda na lista de linearRings, se não for válida, joga no lixo pelo bem da humanidade
-                if line.is_valid:
-                    line=LinearRing(line)
-                    linerings.append(line)
-                else:
-                    self.counter+=1
-                    #print(f"Feição descartada - ID: {row['id']}, ID Layer: {row['name']}, Geometria: {geom}")
-                    #passa pro promixo loop e nao appenda
-                    continue   
+            geoms = self.gdf_input_intersection.geom.values
+            #Explode os MultiPolygons em partes. Antes apenas a primeira parte era usada e o resto era perdido
+            partes = shp.get_parts(geoms[~(shp.is_missing(geoms) | shp.is_empty(geoms))])
+            #Apenas poligonos formam aneis (get_rings retorna o exterior seguido dos buracos de cada parte).
+            # O exterior é um sacada, ao invés de usar a boundary. Ler documentacao para compreender.
+            partes = partes[shp.get_type_id(partes) == shp.GeometryType.POLYGON]
+            aneis = shp.get_rings(partes)
+
+            #Temos que forçar que todos os aneis formem lines rings validos. Os que nao forem válidos sao descartados
+            # pelo bem da humanidade, pois vao dar BO no node. O contador registra quantos aneis foram para o lixo
+            validos = shp.is_valid(aneis)
+            self.counter = int((~validos).sum())
+            linerings = aneis[validos]
+
+            #Recorta os aneis pelo envelope do grid (com uma pequena margem). Feicoes enormes (TIs, municipios) passam a custar
+            # no node apenas pela parte que está dentro do grid. Os cacos dentro do grid são formados apenas pelos segmentos de
+            # dentro do grid e pelo anel do grid, então o resultado depois do filtro do perform_split não muda
+            if self.clip_to_cell:
+                xmin, ymin, xmax, ymax = self.unidade_split.bounds
+                m = self.clip_margin
+                linerings = shp.clip_by_rect(linerings, xmin - m, ymin - m, xmax + m, ymax + m)
+                linerings = shp.get_parts(linerings[~shp.is_empty(linerings)])
+
+            #Snap opcional das linhas e do grid em uma grade de precisao (precision_grid_size, em graus). Bordas de CAR quase
+            # coincidentes viram a mesma linha, o que reduz os micro segmentos e as lascas que deixam o node e o polygonize lentos
+            self.n_vertices_snap = 0
+            self.n_shards_sem_snap = None
+            self.n_shards_snap = None
+            if self.precision_grid_size > 0:
+                if self.precision_compare:
+                    #Modo de ajuste: conta quantos cacos o grid teria sem o snap (roda node e polygonize duas vezes)
+                    self.n_shards_sem_snap = self._count_shards(linerings, self.unidade_split)
+                n_antes = int(shp.get_num_coordinates(linerings).sum())
+                linerings = shp.set_precision(linerings, self.precision_grid_size)
+                linerings = linerings[~shp.is_empty(linerings)]
+                self.n_vertices_snap = n_antes - int(shp.get_num_coordinates(linerings).sum())
+                #O grid também vai para a grade, para que o filtro do perform_split use o mesmo contorno das linhas
+                self.unidade_split = shp.set_precision(self.unidade_split, self.precision_grid_size)
 
             #Esse try é crítico. As tres próximas linhas são onde mais ocorre erro, principalmente a função node que ainda é um certo mistério
             # como funciona. 
             try:            
                 #Appenda o grid, para que seja feita a reconstrucao total do grid
-                linerings.append(LinearRing(self.unidade_split.exterior))
+                linerings = np.append(linerings, self.unidade_split.exterior)
                 #Cria um MultiLineString a partir de todas as linhas
-                multi_line=MultiLineString(linerings)
-                #Cria o MultiLineString com nós onde as linhas se cruzam
+                multi_line=shp.multilinestrings(linerings)
+                #Cria o MultiLineString com nós onde as linhas se cruzam (uma unica chamada)
                 self.multi_line_with_nodes=shp.node(multi_line)        
             except Exception as e:
                 #Caso ocorra algum exception, o grid é pulado
@@ -197,39 +233,46 @@ class Splitter:
         except Exception as e:
             logging.error(f'Função prepare_split_line na iteração {self.n_grid} deu o problema {e}')
 
-        elapsed_time=time.time()-start_time
-        return f'{elapsed_time:.2f}'
+    def _count_shards(self, linhas, unidade_split):
+        """
+        Número de cacos que as linhas formariam dentro do grid. Usado apenas no modo precision_compare.
+        """
+        linhas = np.append(linhas, unidade_split.exterior)
+        noded = shp.node(shp.multilinestrings(linhas))
+        poligonos = shp.get_parts(shp.polygonize(shp.get_parts(noded)))
+        return int(shp.intersects(unidade_split, shp.point_on_surface(poligonos)).sum())
 
     def perform_split(self):
-        
-        # Inicia o cronômetro para a operaçãor  
-        start_time = time.time()
 
         try:
-            # Dividir o polígono usando a MultiLine com nodes. Forma-se o broken ou shaterred glass
-            broken_glass_polygon = list(polygonize(self.multi_line_with_nodes))
-            
-            
-            # Filtra apenas os polígonos cujo representative_point intersecta unidade_split.
-            filtered_polygons = [
-                poly for poly in broken_glass_polygon 
-                if poly.representative_point().intersects(self.unidade_split)
-            ]
-            
-            
-            self.gdf_broken_glass = gpd.GeoDataFrame(data={"id": range(1, len(filtered_polygons) + 1)}, 
-                                                    geometry=filtered_polygons, crs="EPSG:4674")
-            #elapsed_time = time.time() - operation_start
-            #self.logger.info(f"Glass shattering complete, levou {elapsed_time:.2f} segundos para o clip do grid {self.n_grid}!")
+            # Dividir o polígono usando a MultiLine com nodes. Forma-se o broken ou shaterred glass. Tudo em arrays do shapely 2
+            broken_glass_polygon = shp.get_parts(shp.polygonize(shp.get_parts(self.multi_line_with_nodes)))
             del self.multi_line_with_nodes
 
+            # Representative point de todos os cacos de uma vez. Fica guardado para o process_overlapping
+            pontos = shp.point_on_surface(broken_glass_polygon)
+
+            # Filtra apenas os polígonos cujo representative_point intersecta unidade_split (preparada, o teste é feito em lote)
+            shp.prepare(self.unidade_split)
+            manter = shp.intersects(self.unidade_split, pontos)
+            if self.n_shards_sem_snap is not None:
+                self.n_shards_snap = self.n_shards_sem_snap - int(manter.sum())
+
+            # Remove as lascas (slivers) numéricas menores que min_shard_area_m2. A área em graus² é convertida para m² de forma
+            # aproximada pela latitude do grid, o que é suficiente para separar lascas de cacos reais
+            if self.min_shard_area_m2 > 0:
+                lat = np.radians(self.unidade_split.centroid.y)
+                area_m2 = shp.area(broken_glass_polygon) * (111320.0 ** 2) * np.cos(lat)
+                self.n_slivers = int((manter & (area_m2 < self.min_shard_area_m2)).sum())
+                manter &= area_m2 >= self.min_shard_area_m2
+
+            self.pontos_cacos = pontos[manter]
+            self.gdf_broken_glass = gpd.GeoDataFrame(geometry=broken_glass_polygon[manter], crs="EPSG:4674")
+
         except Exception as e:
             logging.error(f'Função perform_split na iteração {self.n_grid} deu o problema {e}')
 
         #Até aqui tudo muito rápido
-        
-        elapsed_time=time.time()-start_time
-        return f'{elapsed_time:.2f}'
 
 
     #O processamento de overlapping é o que mais foi trabalho ate'agora, para tentar minimzar o custo computacional desse procedimento
@@ -238,76 +281,42 @@ class Splitter:
 
     def process_overlapping(self):
         """
-        Processa todos os fragmentos de vidro sequencialmente.
+        Processa todos os fragmentos de vidro de uma vez (em lote).
         Atualiza as colunas 'id_layer' e 'id_feature' no GeoDataFrame self.gdf_broken_glass.
         """
-        start_time=time.time()
-
-        # Adiciona a coluna representative_point se ainda não existir. Representative point é um ponto seguro dentro da geometria do caco
-        # Importante pois algumas geometria sao muito micro e a funcao centroid da problema.
-        if "representative_point" not in self.gdf_broken_glass.columns:
-            self.gdf_broken_glass["representative_point"] = self.gdf_broken_glass.geometry.apply(lambda x: x.representative_point())
-  
-        # Processa cada linha sequencialmente com a funcao self._process_overlap_row (ver a seguir)
-        # Essa funcao retorna listas com os ids que devem ser atribuidos a feição
-        # Exemplo: Caco de vidro X tem sobreposicao com o CAR 1, 2 e 3. A funcao retorna essa lista [1,2,3].
-        
-        results = self.gdf_broken_glass.apply(self._process_overlap_row, axis=1)
-        
-        # Atualiza o GeoDataFrame com os resultados
-        self.gdf_broken_glass["id_layer"] = results.apply(lambda x: x[1])
-        self.gdf_broken_glass["id_feature"] = results.apply(lambda x: x[2])
-
-        # Remove a coluna de ponto representativo, se não for mais necessária
-        self.gdf_broken_glass.drop(columns="representative_point", inplace=True, errors='ignore')
-        
-        elapsed_time=time.time()-start_time
-        return f'{elapsed_time:.2f}'
-   
-    def _process_overlap_row(self, row):
-        """
-        Processa uma única linha do GeoDataFrame para encontrar os polígonos mais próximos.
-        :param row: Linha do GeoDataFrame.
-        :return: Tupla com índice, id_layers e id_features.
-        """
-        # A funcao lamba aplica essa funcao para cada linha do GDF. Seguimos com isso em mente.
-        idx, shard_data = row.name, row
-
-        #Seleciona o ponto
-        glass_shard_point = shard_data["representative_point"]
-
-        # Utiliza o indice para buscar o NEAREST. Existem pontos que nao se sobrepõe mas que são selecionados aqui
-        # Fazer em duas etapas é mais otimizado, pois 'query nearest é leve e torna o geom.intersects leve pela baixa quantidade de poligonos
-        nearest_index = self.spatial_index.query_nearest(glass_shard_point)
-
-        #Seleciona os nearest dentre os poligonos originais de inputs (exemplo CARs originais para CAR split)
-        nearest_polygon = self.gdf_input_intersection.iloc[nearest_index]
-
-        #Resetar indice é importante
-        nearest_polygon.reset_index(drop=False, inplace = True)
-
-        idx_true_intersection = []
-        #Etapa de maior consumo de processador e memoria. Deve ser feito em iteração sequencial. Cada polígono do CAR deve ser
-        # testado para sobreposicao com o representative point (glass_shard_point)
-        for idx, row in nearest_polygon.iterrows():
-            
-            if row.geom.intersects(glass_shard_point):
-                
-                idx_true_intersection.append(idx)
-        #Por isso precisa resetar indice
-        true_intersection = nearest_polygon.iloc[idx_true_intersection]        
-
-        # Se estiver vazio, retorna apenas id_do grid e id_layer="GRID". Podem ocorrer grids vazios a depender do INPUT.
-        # Se não, retorna a lista com os id envolvidos
-        if not true_intersection.empty:
-            id_layers = ['GRID'] + true_intersection["id_layer"].tolist()
-            id_features = [self.n_grid] + true_intersection["id"].tolist()
-        else:
-            id_layers = ['GRID']
-            id_features = [self.n_grid]
-
-        return idx, id_layers, id_features
-    
+        # Representative point é um ponto seguro dentro da geometria do caco. Importante pois algumas geometria sao muito micro
+        # e a funcao centroid da problema. É calculado para todos os cacos de uma vez no perform_split e reaproveitado aqui
+        pontos = getattr(self, "pontos_cacos", None)
+        if pontos is None or len(pontos) != len(self.gdf_broken_glass):
+            pontos = shp.point_on_surface(self.gdf_broken_glass.geometry.values)
+        self.pontos_cacos = None
+
+        # Uma unica consulta em lote. O retorno sao pares (indice do poligono de input, indice do caco) para cada ponto que
+        # intersecta um poligono original. Equivale ao query_nearest + intersects da versao linha a linha, pois um poligono que
+        # intersecta o ponto está sempre a distancia zero dele.
+        # O indice é montado sobre os pontos e consultado com os poligonos: assim cada poligono é preparado uma unica vez,
+        # o que faz muita diferenca para feicoes enormes (TIs, municipios) com dezenas de milhares de cacos dentro
+        idx_input, idx_caco = STRtree(pontos).query(self.gdf_input_intersection.geom.values, predicate="intersects")
+
+        # Ordena os pares por caco e, dentro de cada caco, pela ordem das feicoes no input
+        ordem = np.lexsort((idx_input, idx_caco))
+        idx_caco, idx_input = idx_caco[ordem], idx_input[ordem]
+
+        # Agrupa os pares por caco. Cacos sem nenhuma sobreposicao ficam com grupo vazio
+        contagem = np.bincount(idx_caco, minlength=len(pontos))
+        cortes = np.cumsum(contagem)[:-1]
+        # Forma colunar explodida da atribuição (um registro por par caco x feicao), usada no format_gdf_broken_glass
+        self.attr_caco = idx_caco
+        self.attr_layer = self.gdf_input_intersection["id_layer"].to_numpy(dtype=object)[idx_input]
+        self.attr_feature = self.gdf_input_intersection["id"].to_numpy()[idx_input]
+        layers = np.split(self.attr_layer, cortes)
+        features = np.split(self.attr_feature, cortes)
+
+        # Todo caco recebe o id do grid na frente e a lista com os ids envolvidos.
+        # Exemplo: Caco de vidro X tem sobreposicao com o CAR 1, 2 e 3. O resultado é ['GRID', 'CAR', 'CAR', 'CAR'] e [n_grid, 1, 2, 3].
+        # Podem ocorrer grids vazios a depender do INPUT, nesse caso fica apenas ['GRID'] e [n_grid].
+        self.gdf_broken_glass["id_layer"] = [['GRID'] + x.tolist() for x in layers] if len(pontos) else []
+        self.gdf_broken_glass["id_feature"] = [[self.n_grid] + x.tolist() for x in features] if len(pontos) else []
 
 
     def colunas_boleanas(self, engine):
@@ -318,9 +327,7 @@ class Splitter:
         is_ti = TRUE significa que aquele caco de vidro tem sobrep. com uma TI
         """
         try:
-            query=f'select distinct id_layer from {self.split_table_name};'
-            df=pd.read_sql_query(query,con=engine)
-            boleanas=[i for i in df.id_layer]
+            boleanas=self.create_input_source(engine=engine).layers()
             logging.info(f"Colunas booleanas capturadas com sucesso ({boleanas})")
         except Exception as e:
             logging.error(f'Erro na captura das colunas boleanas, não é possivel continuar. ({e})')
@@ -328,19 +335,23 @@ class Splitter:
 
         return boleanas
 
-    def create_table_postgresql(self, engine):
+    def create_table_postgresql(self, engine, drop=True):
         """
         Cria a tabela no banco de dados. Se não conseguir criar, raise !
+        Com drop=False a tabela existente é mantida (retomada de execução)
         """
         try:
             self.boleanas = self.colunas_boleanas(engine=engine)
-            create_query=[f"CREATE SCHEMA IF NOT EXISTS {self.schema};",
-                      f"DROP TABLE IF EXISTS {self.schema}.{self.arquivo_final};"]
+            create_query=[f"CREATE SCHEMA IF NOT EXISTS {self.schema};"]
+            if drop:
+                create_query.append(f"DROP TABLE IF EXISTS {self.schema}.{self.arquivo_final};")
 
             #Algumas gambiarras aqui
             
-            tabela = f"CREATE TABLE IF NOT EXISTS {self.schema}.{self.arquivo_final} (gid serial, id_layer text[], id_feature integer[], cd_mun integer, cd_uf integer, n_car INTEGER, " + ", ".join([f"is_{x} BOOLEAN" for x in self.boleanas]) + ", area_ha NUMERIC, geometry geometry(polygon, 4674));"
+            tabela = f"CREATE TABLE IF NOT EXISTS {self.schema}.{self.arquivo_final} (gid serial, id_layer text[], id_feature bigint[], cd_mun integer, cd_uf integer, n_car INTEGER, " + ", ".join([f"is_{x} BOOLEAN" for x in self.boleanas]) + ", area_ha NUMERIC, geometry geometry(polygon, 4674));"
             create_query.append(tabela)
+            #Indice pelo grid (primeiro elemento do id_feature), usado para apagar as linhas de um grid reprocessado
+            create_query.append(f"CREATE INDEX IF NOT EXISTS idx_{self.arquivo_final}_n_grid ON {self.schema}.{self.arquivo_final} ((id_feature[1]));")
 
             #Executa as queries na lsita create_query
             with engine.connect() as conn:
@@ -360,6 +371,27 @@ class Splitter:
 
         return None
 
+    def prepare_run(self, engine, grids):
+        """
+        Prepara a tabela de saída e o manifesto antes do run_parallel. Retorna a lista de grids a processar.
+        Execução nova: recria a tabela e marca todos os grids como pending.
+        Retomada (resume = true no config.json): mantém a tabela e retorna apenas os grids pending ou failed.
+        """
+        # Os tempos da execução anterior são lidos antes do reset do manifesto, para estimar o custo de cada grid
+        self.tempos_anteriores = self.manifest.elapsed(engine)
+
+        if self.resume:
+            self.create_table_postgresql(engine=engine, drop=False)
+            self.manifest.create(engine, grids, reset=False)
+            grids = self.manifest.pending(engine)
+            self.tentativas_anteriores = self.manifest.attempts(engine)
+            self.logger.info(f"Retomando execução: {self.manifest.summary(engine)}, {len(grids)} grids a processar")
+        else:
+            self.create_table_postgresql(engine=engine)
+            self.manifest.create(engine, grids, reset=True)
+            self.metrics.reset()
+        return grids
+
     def create_indices(self, engine):
         """
         Cria índices em todas as colunas da tabela self.arquivo_final.
@@ -371,14 +403,14 @@ class Splitter:
 
         with engine.connect() as conn:
             for coluna in colunas:
-                idx = f"CREATE INDEX idx_{self.arquivo_final}_{coluna} ON {tabela} ({coluna});"                
+                idx = f"CREATE INDEX IF NOT EXISTS idx_{self.arquivo_final}_{coluna} ON {tabela} ({coluna});"                
                 with conn.begin():
                     logging.info(idx)
                     conn.execute(text(idx))
   
         
         # Índice GIST para geometria
-        idx_geometry = f"CREATE INDEX idx_{self.arquivo_final}_geometry_gist ON {tabela} USING GIST (geometry);"
+        idx_geometry = f"CREATE INDEX IF NOT EXISTS idx_{self.arquivo_final}_geometry_gist ON {tabela} USING GIST (geometry);"
         with engine.connect() as conn:
             with conn.begin():
                 logging.info(idx_geometry)
@@ -393,150 +425,323 @@ class Splitter:
 
         Formata o gdf broken glass, operações:
         1. Dropa coluna ID
-        2. Formata os campos id_layer e id_feature para adequação ao db
-        3. Cria colunas booleanas e testa o campo id_layer para presenca da camada, retornando true ou false.
+        2. Os campos id_layer e id_feature ficam como listas, o COPY (bulk_copy.py) converte para array do db
+        3. Cria colunas booleanas, is_<camada> é TRUE se o caco tem sobreposição com alguma feicao exatamente dessa camada
         4. Calcula área das feicoes, apenas se drop_only_grid = True (default). Se for falso, mantem as feicoes id_layer=['GRID']
         5. (TESTE) Incluir coluna com cd_uf e cd_mun  
+
+        Todas as colunas derivadas saem da forma explodida da atribuição gerada no process_overlapping
+        (attr_caco, attr_layer, attr_feature: um registro por par caco x feicao), com operações do numpy, sem apply linha a linha.
         """
 
         
 
-        start_time=time.time()
         try:
 
             #Só processa se id_layer!=['GRID']
 
-            #1. No banco existirá a coluna gid serial para cada feicao inserida. Portanto, dropa a coluna id 
-            self.gdf_broken_glass.drop(columns='id', inplace=True)
+            #1. No banco existirá a coluna gid serial para cada feicao inserida. Portanto, dropa a coluna id (se existir)
+            self.gdf_broken_glass.drop(columns='id', inplace=True, errors='ignore')
 
-            #5. Dropar registros em que há apenas a classe 'GRID' no id_layer. Considerando que, sempre deve haver um municipio,
-            # um registro apenas com a feicao GRID está fora do Brasil. Se for rodar um split sem municipio, colocar drop_only_grid = False
-            if drop_only_grid:
-                self.gdf_broken_glass = self.gdf_broken_glass[self.gdf_broken_glass['id_layer'].apply(lambda x: 'MUN' in x)]
-            
-            # Inserir coluna cd_mun
-            self.gdf_broken_glass['cd_mun'] = self.gdf_broken_glass.apply(lambda row: row['id_feature'][row['id_layer'].index('MUN')], axis=1)
-            
-                      
-            #Inserir coluna cd_uf
-            self.gdf_broken_glass['cd_uf'] = self.gdf_broken_glass['cd_mun'].astype(str).str[:2].astype(int)
+            n = len(self.gdf_broken_glass)
+            caco, layer, feature = self.attr_caco, self.attr_layer, self.attr_feature
 
+            def por_caco(camada):
+                # Número de feicoes da camada em cada caco (comparação exata do id_layer)
+                return np.bincount(caco[layer == camada], minlength=n)
 
-            
-            #Contagem de CARs
-            self.gdf_broken_glass['n_car'] = np.array([x.count('CAR') for x in self.gdf_broken_glass['id_layer']])
+            # cd_mun é o primeiro MUN de cada caco (mesma ordem do id_layer)
+            e_mun = layer == 'MUN'
+            cacos_mun, primeiro = np.unique(caco[e_mun], return_index=True)
+            tem_mun = np.zeros(n, dtype=bool)
+            tem_mun[cacos_mun] = True
+            cd_mun = np.zeros(n, dtype=np.int64)
+            cd_mun[cacos_mun] = feature[e_mun][primeiro]
 
-            #2. Aplicando a função para transformar lista em string exemplo [CAR, CAR, GRID] em '{CAR, CAR, GRID}' que é interpretada como array no banco
-            self.gdf_broken_glass['id_layer'] = self.gdf_broken_glass['id_layer'].apply(lambda x: '{' + ','.join(map(str, x)) + '}')
-            self.gdf_broken_glass['id_feature'] = self.gdf_broken_glass['id_feature'].apply(lambda x: '{' + ','.join(map(str, x)) + '}')
+            # cd_uf são os dois primeiros digitos do cd_mun
+            digitos = np.floor(np.log10(np.maximum(cd_mun, 1))).astype(np.int64) + 1
+            cd_uf = cd_mun // (10 ** np.maximum(digitos - 2, 0))
 
+            colunas = {'cd_mun': cd_mun, 'cd_uf': cd_uf, 'n_car': por_caco('CAR')}
             #3. Cria colunas boleanas
             for coluna in self.boleanas:
-                self.gdf_broken_glass[f'is_{coluna.lower()}']=self.gdf_broken_glass['id_layer'].apply(lambda x: f'{coluna}' in x)
-
-
-            #4. Calcula área das feicoes. Para isso é necessario descobrir a zona do grid e reprojar e dado de acordo com a feicao
-            #Descobre em qual zona está o grid
-            xmin, ymin, xmax, ymax = self.unidade_split.bounds
-            longitude_media_grid=(xmin + xmax) / 2
-            zona = int((longitude_media_grid + 180) / 6) + 1
-            #Seleciona o epsg correspodente a zona
-            projecao = self.utm_epsg_brazil[zona]
-            #Reprojeta apenas para calcular area. No entanto a feicao no banco estará em 4674.
-            gdf_proj = self.gdf_broken_glass.to_crs(epsg=projecao)
-            gdf_proj['area_ha'] = gdf_proj.geometry.area/10000
-            #Inputa area na tabela
-            self.gdf_broken_glass['area_ha']=gdf_proj['area_ha']
-            
-            
+                colunas[f'is_{coluna.lower()}'] = por_caco(coluna) > 0
+
+            for nome, valores in colunas.items():
+                self.gdf_broken_glass[nome] = valores
+
+            #5. Dropar registros em que há apenas a classe 'GRID' no id_layer. Considerando que, sempre deve haver um municipio,
+            # um registro apenas com a feicao GRID está fora do Brasil. Se for rodar um split sem municipio, colocar drop_only_grid = False
+            if drop_only_grid:
+                self.gdf_broken_glass = self.gdf_broken_glass[tem_mun]
+            else:
+                # Cacos sem municipio ficam com cd_mun/cd_uf nulos
+                self.gdf_broken_glass['cd_mun'] = pd.Series(cd_mun, index=self.gdf_broken_glass.index, dtype='Int64').where(tem_mun)
+                self.gdf_broken_glass['cd_uf'] = pd.Series(cd_uf, index=self.gdf_broken_glass.index, dtype='Int64').where(tem_mun)
+            del self.attr_caco, self.attr_layer, self.attr_feature
+
+
+            #4. Calcula área das feicoes, com cada caco projetado na zona UTM em que está (ver area.py).
+            #A feicao no banco continua em 4674.
+            self.gdf_broken_glass['area_ha'] = area_ha(self.gdf_broken_glass.geometry.values, epsg=4674)
+
             #Libera memoria
-            del gdf_proj
             del self.unidade_split
 
         except Exception as e:
             logging.error(f"Erro na formatação do output para a iteração {n_grid} não é possivel continuar ({e})")
-            
 
-        elapsed_time=time.time()-start_time
-        return f'{elapsed_time:.2f}'
+    def upload_db(self, engine, info):
+        #Upload direto no db, em um único COPY (ver bulk_copy.py). Na mesma transação as linhas antigas do grid são apagadas
+        # e o grid é marcado como done no manifesto
+        copy_to_postgis(self.gdf_broken_glass, engine=engine, table_name=self.arquivo_final, schema=self.schema,
+                        before=[self.manifest.delete_statement([self.n_grid])],
+                        after=self.manifest.done_statements([info]))
 
-    def upload_db(self, engine):
-        memory = psutil.virtual_memory()
-        cpu_percent = psutil.cpu_percent(interval=0.1)  
-        start_time = time.time()         
-        
-        #Upload direto no db
-        self.gdf_broken_glass.to_postgis(
-            name=self.arquivo_final,
-            con=engine,
-            schema=self.schema,
-            if_exists="append",
-            index=False
-        )
+        self.logger.info(f"Iteração do grid {self.n_grid} armazenada - RSS do worker {os.getpid()} : {rss_mb():.0f} MB")
+        del self.gdf_broken_glass
+
+    def send_to_writer(self, queue, info):
+        """
+        Formata o gdf_broken_glass para o COPY e coloca na fila dos processos escritores (ver writer.py).
+        O tempo da etapa inclui a espera caso a fila esteja cheia. Se um escritor morrer levanta WriterError.
+        """
+        # Grids sem linhas também vão para a fila, para serem marcados como done no manifesto pelo escritor
+        colunas, buffer = format_copy_rows(self.gdf_broken_glass)
+        send_to_writers(queue, (self.n_grid, colunas, buffer.getvalue(), len(self.gdf_broken_glass), info), self.writer_pids)
 
-        self.logger.info(f"Iteração do grid {self.n_grid} armazenada - Uso de memória : {memory.percent}% - CPU : {cpu_percent}%")
         del self.gdf_broken_glass
-        elapsed_time=time.time()-start_time
-        return f'{elapsed_time:.2f}'
 
-    def run(self, n_grid, grid_gdf):
+    def create_db_engine(self, **kwargs):
+        """
+        Cria o engine de conexão com o banco a partir das variáveis do .env
+        """
+        return create_engine(
+            f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}", **kwargs
+        )
+
+    def run(self, n_grid, grid_gdf, engine=None, queue=None, source=None, upload=True):
         # Função que processa cada grid específico
+        # Se o engine nao for passado (execução fora do Pool), cria um apenas para esse grid e encerra no final
+        # Se a fila for passada, o resultado vai para os processos escritores em vez de ser enviado ao banco aqui
+        # source substitui a fonte de input do config e upload=False pula o upload e o manifesto (usados pelo profile_cell.py)
+        # Ao final grava um registro de métricas do grid (ver metrics.py), inclusive quando dá erro
         
         start_time=time.time()
+        engine_proprio = engine is None
+        tempos = {}
+        registro = {'n_grid': int(n_grid),
+                    'pid': os.getpid(),
+                    'inicio': start_time,
+                    'status': 'ok',
+                    'retries': self.tentativas_anteriores.get(int(n_grid), 0)}
+        rss = [rss_mb()]
+
+        def etapa(nome, funcao, **kwargs):
+            # Executa uma etapa e guarda o tempo (segundos) e o RSS ao final dela
+            inicio = time.perf_counter()
+            funcao(**kwargs)
+            tempos[nome] = round(time.perf_counter() - inicio, 4)
+            rss.append(rss_mb())
+            # Gancho opcional chamado ao final de cada etapa (profile_cell.py)
+            if self.stage_hook is not None:
+                self.stage_hook(nome, self)
+
         try:
 
-            # Criar o engine dentro de cada processo
-            engine = create_engine(
-                f"postgresql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
-            )
+            if engine_proprio and (upload or source is None):
+                engine = self.create_db_engine()
 
             
-            intersection_time=self._intersection_sql(n_grid=n_grid, grid_gdf=grid_gdf, engine=engine)
+            if source is None:
+                source=self.create_input_source(engine=engine)
+            etapa('intersection_time', self._intersection, n_grid=n_grid, grid_gdf=grid_gdf, source=source)
+            registro['n_features'] = len(self.gdf_input_intersection)
+            registro['n_vertices'] = int(shp.get_num_coordinates(self.gdf_input_intersection.geometry.values).sum())
             
-            prepare_lines_time=self.prepare_split_line()
-            perform_split_time=self.perform_split()
+            etapa('prepare_lines_time', self.prepare_split_line)
+            registro['n_rings_invalidos'] = int(self.counter)
+            registro['n_vertices_snap'] = int(self.n_vertices_snap)
+            etapa('perform_split_time', self.perform_split)
+            registro['n_shards'] = len(self.gdf_broken_glass)
+            registro['n_slivers'] = int(self.n_slivers)
+            # Com precision_compare, os cacos que o snap removeu (None sem o modo de ajuste)
+            registro['n_shards_snap'] = self.n_shards_snap
             
-            overlapping_time=self.process_overlapping()
+            etapa('overlapping_time', self.process_overlapping)
             
-            format_gdf=self.format_gdf_broken_glass(n_grid=n_grid)
+            etapa('format_gdf', self.format_gdf_broken_glass, n_grid=n_grid)
+            registro['n_rows'] = len(self.gdf_broken_glass)
+
+            #Registro do grid no manifesto, gravado junto com o upload
+            info={'n_grid': n_grid,
+                  'n_rows': len(self.gdf_broken_glass),
+                  'elapsed': round(time.time()-start_time, 2),
+                  'tempos': dict(tempos)}
            
-            upload_time=self.upload_db(engine=engine) #Inserir isso como método na classe
+            if upload and queue is None:
+                etapa('upload_sql_time', self.upload_db, engine=engine, info=info)
+            elif upload:
+                etapa('upload_sql_time', self.send_to_writer, queue=queue, info=info)
             elapsed_time=time.time()-start_time
-            
-            tempos={'intersection_time':intersection_time,
-                    'prepare_lines_time':prepare_lines_time,
-                    'perform_split_time':perform_split_time,
-                    'overlapping_time':overlapping_time,
-                    'format_gdf':format_gdf,
-                    'upload_sql_time':upload_time}
-            
-            
-            # Tratar valores None e converter para float
-            tempos_cleaned = {k: float(v) if v is not None else 0.0 for k, v in tempos.items()}
 
             # Encontrar o maior tempo e a chave correspondente
-            max_time_func, max_time_value = max(tempos_cleaned.items(), key=lambda item: item[1])
-            #Encerra conexão, muito importante !!
-            engine.dispose()
+            max_time_func, max_time_value = max(tempos.items(), key=lambda item: item[1])
             
-            logging.info(f'Iteração completa para o {n_grid} levou {elapsed_time:.2f} e a operação que levou mais tempo foi a funcao {max_time_func} com {max_time_value} e descartou {self.counter} feicoes')
+            logging.info(f'Iteração completa para o {n_grid} levou {elapsed_time:.2f} e a operação que levou mais tempo foi a funcao {max_time_func} com {max_time_value} e descartou {self.counter} feicoes e {self.n_slivers} lascas')
+            if self.precision_grid_size > 0:
+                logging.info(f'Snap do grid {n_grid}: {self.n_vertices_snap} vértices removidos, {self.n_shards_snap} cacos removidos')
             logging.info(f'Tempos: {tempos}')
             
 
         #Se der erro prossegue 
         except Exception as e:
-            # Registra o n_grid no arquivo de erro e no log o erro que ocorreu
-            with open("logs/error_grids.txt", "a") as error_file:
-                error_file.write(f"{n_grid}\n")
-            self.logger.error(f"Iteração do grid {self.n_grid} ERRO {e}")
+            registro['status'] = 'erro'
+            registro['erro'] = str(e)
+            # Registra o n_grid no arquivo de erro e no log o erro que ocorreu. Sem upload (profile_cell.py) o grid não faz
+            # parte de uma execução: nem o arquivo de erro nem o manifesto são alterados
+            if upload:
+                with open("logs/error_grids.txt", "a") as error_file:
+                    error_file.write(f"{n_grid}\n")
+            self.logger.error(f"Iteração do grid {n_grid} ERRO {e}")
+            try:
+                if upload:
+                    self.manifest.mark_failed(engine, n_grid, e)
+            except Exception as e_manifest:
+                self.logger.error(f"Não foi possível marcar o grid {n_grid} como failed no manifesto ({e_manifest})")
+            # Sem escritores os próximos grids também falhariam: interrompe a execução
+            if isinstance(e, WriterError):
+                raise
+
+        finally:
+            #Encerra conexão, muito importante !! (apenas se o engine foi criado aqui, o do worker é reaproveitado)
+            if engine_proprio and engine is not None:
+                engine.dispose()
+
+            registro['elapsed'] = round(time.time() - start_time, 4)
+            registro['tempos'] = tempos
+            # RSS ao final do grid, maior RSS amostrado nas etapas do grid e pico do worker desde o início (ru_maxrss, que
+            # não volta a cair: serve para o worker, não para o grid)
+            registro['rss_mb'] = round(rss[-1], 1)
+            registro['rss_peak_mb'] = round(max(rss), 1)
+            registro['worker_rss_peak_mb'] = round(peak_rss_mb(), 1)
+            try:
+                self.metrics.write(registro)
+            except Exception as e_metrics:
+                self.logger.error(f"Não foi possível gravar as métricas do grid {n_grid} ({e_metrics})")
             
         
     def run_parallel(self, grids, grid_gdf):
-        #Essa funcao cria diversas instancias da Classe
-        run_splitter_partial = partial(self.run, grid_gdf=grid_gdf)
-        # Função para execução paralela
-        with Pool(processes=self.num_processes) as pool:
-            pool.map(run_splitter_partial, grids)
+        # O grid vai para cada processo uma única vez, no initializer do Pool, como WKB. As tarefas levam apenas o número do grid.
+        grid_ids = grid_gdf["id"].to_numpy()
+        grid_wkb = shp.to_wkb(grid_gdf.geometry.values)
+
+        # Tarefas do mais pesado para o mais leve. Pesados vão sozinhos, leves em lotes (ver scheduler.py). Sem plano e sem
+        # tempo anterior para algum grid, a carga é o número de feicoes candidatas do input_file
+        grid_custo = grid_gdf
+        sem_carga = not {"n_vertices", "n_features"} & set(grid_gdf.columns)
+        if sem_carga and any(int(g) not in self.tempos_anteriores for g in grids) and os.path.exists(self.input_file):
+            grid_custo = grid_gdf.assign(n_candidatas=candidate_counts(grid_gdf, self.input_file))
+        custos = estimate_costs(grids, grid_custo, self.tempos_anteriores)
+        tarefas, custos_tarefas = build_tasks(grids, custos, self.num_processes, self.lotes_por_processo)
+        self.logger.info(f"{len(grids)} grids em {len(tarefas)} tarefas, {sum(len(t) == 1 for t in tarefas)} grids pesados isolados")
+        progresso = Progress(n_grids=len(grids), custo_total=float(np.sum(custos)))
+
+        # Confere a conexão com o banco antes de criar o Pool. Um erro de configuração (.env) falha aqui, uma única vez,
+        # em vez de derrubar cada worker no initializer
+        engine = self.create_db_engine()
+        try:
+            with engine.connect():
+                pass
+        finally:
+            engine.dispose()
+
+        queue = None
+        writers = []
+        store = None
+        try:
+            # Com input_source = 'shared' o input_file é lido uma única vez aqui e os workers usam a memória compartilhada
+            if self.input_source == "shared":
+                store = SharedInputStore.create(self.input_file)
+
+            # Processos escritores, iniciados logo antes do Pool. A fila limitada faz os workers esperarem se o banco não
+            # acompanhar. Os pids vão para os workers junto com o Splitter
+            if self.writer_processes > 0:
+                queue = Queue(maxsize=self.writer_queue_size)
+                for _ in range(self.writer_processes):
+                    w = Process(target=run_writer, args=(queue, self.create_db_engine, self.arquivo_final, self.schema,
+                                                         self.writer_batch_rows, self.writer_batch_bytes, self.manifest))
+                    w.start()
+                    writers.append(w)
+                self.writer_pids = [w.pid for w in writers]
+
+            # Função para execução paralela
+            pool = Pool(processes=self.num_processes, initializer=_init_worker,
+                        initargs=(self, grid_ids, grid_wkb, queue, store.spec if store is not None else None))
+            try:
+                for n_tarefa in pool.imap_unordered(_run_worker_batch, enumerate(tarefas), chunksize=1):
+                    progresso.update(len(tarefas[n_tarefa]), custos_tarefas[n_tarefa])
+                # close + join deixa os workers encerrarem normalmente, fechando as conexões do engine
+                pool.close()
+                pool.join()
+            except BaseException:
+                pool.terminate()
+                raise
+        finally:
+            # Um None por escritor: cada um grava o que tiver pendente e encerra
+            stop_writers(queue, writers)
+            self.writer_pids = []
+            if store is not None:
+                store.close()
+
+        # Junta as métricas dos workers (Parquet e textfile do Prometheus, se configurados)
+        metricas = self.metrics.consolidate()
+        if len(metricas):
+            self.logger.info(f"Métricas de {len(metricas)} grids em {self.metrics.metrics_dir}, p90 do tempo por grid {metricas['elapsed'].quantile(0.9):.2f} segundos")
+
+
+# Estado de cada processo do Pool. É preenchido uma vez pelo initializer e reaproveitado por todos os grids do processo
+_worker = {}
+
+
+def _init_worker(splitter, grid_ids, grid_wkb, queue=None, shared_spec=None):
+    """
+    Initializer do Pool. Guarda o Splitter, reconstrói o grid a partir do WKB e abre um único engine (pool de 1 conexão)
+    que será usado por todos os grids processados por esse worker. Com shared_spec o worker se conecta ao input em memória
+    compartilhada (ver shared_input.py).
+
+    Um erro aqui não pode escapar: o Pool recriaria o worker indefinidamente e o run_parallel nunca terminaria. O erro fica
+    guardado em _worker e é levantado pela primeira tarefa do worker (_run_worker_batch).
+    """
+    try:
+        _worker["splitter"] = splitter
+        _worker["grid_gdf"] = gpd.GeoDataFrame(data={"id": grid_ids}, geometry=shp.from_wkb(grid_wkb), crs="EPSG:4674")
+        engine = splitter.create_db_engine(pool_size=1, max_overflow=0, pool_pre_ping=True)
+        _worker["engine"] = engine
+        # Fecha as conexões quando o worker encerrar
+        Finalize(None, engine.dispose, exitpriority=10)
+        _worker["queue"] = queue
+        _worker["source"] = SharedInputStore.attach(shared_spec) if shared_spec is not None else None
+        if _worker["source"] is not None:
+            Finalize(None, _worker["source"].close, exitpriority=10)
+    except Exception as e:
+        _worker["erro"] = f"{type(e).__name__}: {e}"
+
+
+def _run_worker(n_grid):
+    # Processa um grid com o estado do worker
+    return _worker["splitter"].run(n_grid, grid_gdf=_worker["grid_gdf"], engine=_worker["engine"],
+                                   queue=_worker["queue"], source=_worker["source"])
+
+
+def _run_worker_batch(tarefa):
+    # Tarefa do Pool: (número da tarefa, lista de grids). Retorna o número da tarefa para o controle de progresso
+    n_tarefa, grids = tarefa
+    if "erro" in _worker:
+        raise RuntimeError(f"Falha na inicialização do worker {os.getpid()}: {_worker['erro']}")
+    for n_grid in grids:
+        _run_worker(n_grid)
+    return n_tarefa
 
 
 
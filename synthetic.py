@@ -0,0 +1,100 @@
+import geopandas as gpd
+import numpy as np
+import shapely as shp
+
+
+# Gerador de inputs sintéticos parecidos com o CAR, para o benchmark.py. O mosaico de imóveis é um diagrama de Voronoi
+# (imóveis vizinhos compartilham a divisa), com as divisas onduladas por uma função da posição (os vértices compartilhados
+# se movem juntos, então o mosaico continua sem buracos). Sobre o mosaico são adicionados os casos que pesam no split:
+#   - sobreposição: parte dos imóveis é expandida por cima dos vizinhos
+#   - divisas quase coincidentes: cópias de imóveis deslocadas por uma fração de metro (geram lascas)
+#   - multipolígonos enormes: feicoes com muitas partes e muitos vértices, muito maiores que o grid
+# Dois municípios dividem o grid ao meio, como no input real (ver format_gdf_broken_glass).
+
+CD_MUN = [1500107, 1500206]
+PRECISAO = 1e-9
+
+
+def _ondular(geoms, amplitude, frequencia):
+    # Desloca cada vértice por uma função suave da posição. Vértices iguais recebem o mesmo deslocamento
+    def deslocar(coords):
+        x, y = coords[:, 0], coords[:, 1]
+        dx = amplitude * np.sin(frequencia * y + 1.7 * np.cos(frequencia * x))
+        dy = amplitude * np.cos(frequencia * x + 1.3 * np.sin(frequencia * y))
+        return np.column_stack([x + dx, y + dy])
+    return shp.transform(geoms, deslocar)
+
+
+def generate_mosaic(cell=(-50.0, -10.0, -49.0, -9.0), n_parcels=500, overlap_rate=0.1, n_vertices=40,
+                    near_coincident_rate=0.05, n_huge=0, huge_parts=50, huge_vertices=2000, seed=0):
+    """
+    Gera um input sintético para um grid.
+
+    Args:
+        cell - bounds do grid (minx, miny, maxx, maxy) em graus
+        n_parcels - número de imóveis do mosaico (o mosaico cobre o grid com uma margem de 10%)
+        overlap_rate - fração dos imóveis expandidos por cima dos vizinhos
+        n_vertices - número aproximado de vértices por imóvel
+        near_coincident_rate - fração dos imóveis duplicados com um deslocamento de ~1 cm
+        n_huge - número de multipolígonos enormes
+        huge_parts, huge_vertices - partes e vértices por parte de cada multipolígono enorme
+        seed - semente do gerador aleatório
+
+    Returns:
+        GeoDataFrame com id, id_layer e geom em EPSG:4674
+    """
+    rng = np.random.default_rng(seed)
+    x0, y0, x1, y1 = cell
+    largura, altura = x1 - x0, y1 - y0
+    envelope = shp.box(x0 - 0.1 * largura, y0 - 0.1 * altura, x1 + 0.1 * largura, y1 + 0.1 * altura)
+
+    # Mosaico de Voronoi recortado pelo envelope
+    pontos = np.column_stack([rng.uniform(x0 - 0.1 * largura, x1 + 0.1 * largura, n_parcels),
+                              rng.uniform(y0 - 0.1 * altura, y1 + 0.1 * altura, n_parcels)])
+    imoveis = shp.get_parts(shp.voronoi_polygons(shp.multipoints(pontos), extend_to=envelope))
+    imoveis = shp.intersection(imoveis, envelope)
+
+    # Densifica até ~n_vertices por imóvel e ondula as divisas. O comprimento máximo do segmento é o mesmo para todos os
+    # imóveis, para que a divisa compartilhada receba os mesmos vértices dos dois lados
+    tamanho_medio = np.sqrt(largura * altura / max(n_parcels, 1))
+    imoveis = shp.segmentize(imoveis, 4 * tamanho_medio / max(n_vertices, 4))
+    imoveis = _ondular(imoveis, amplitude=0.05 * tamanho_medio, frequencia=20 / tamanho_medio)
+    # buffer(0) corrige eventuais autointerseções da ondulação mantendo apenas a parte poligonal
+    imoveis = shp.buffer(imoveis, 0)
+
+    # Sobreposição com os vizinhos
+    sobrepostos = rng.random(len(imoveis)) < overlap_rate
+    imoveis[sobrepostos] = shp.buffer(imoveis[sobrepostos], 0.2 * tamanho_medio * rng.uniform(0.3, 1, sobrepostos.sum()),
+                                      quad_segs=4)
+
+    # Divisas quase coincidentes: cópias deslocadas ~1e-7 grau (~1 cm)
+    copias = imoveis[rng.random(len(imoveis)) < near_coincident_rate]
+    deslocamento = rng.normal(0, 1e-7, (len(copias), 2))
+    copias = np.array([shp.transform(g, lambda c, d=d: c + d) for g, d in zip(copias, deslocamento)], dtype=object)
+
+    # Multipolígonos enormes, espalhados por uma área 20 vezes maior que o grid
+    enormes = []
+    for _ in range(n_huge):
+        centros = np.column_stack([rng.uniform(x0 - 10 * largura, x1 + 10 * largura, huge_parts),
+                                   rng.uniform(y0 - 10 * altura, y1 + 10 * altura, huge_parts)])
+        # Garante pelo menos uma parte cortando o grid
+        centros[0] = [rng.uniform(x0, x1), rng.uniform(y0, y1)]
+        raios = rng.uniform(0.2, 1.0, huge_parts) * max(largura, altura)
+        partes = shp.buffer(shp.points(centros), raios, quad_segs=max(huge_vertices // 4, 1))
+        enormes.append(shp.union_all(partes))
+
+    # Coordenadas com precisão finita (1e-9 grau), como no dado gravado no banco. Sem isso as divisas compartilhadas
+    # diferem na última casa decimal e o node do GEOS não converge
+    geoms = np.concatenate([imoveis, copias, np.array(enormes, dtype=object)])
+    geoms = shp.set_precision(geoms, PRECISAO)
+    geoms = geoms[~shp.is_empty(geoms)]
+    ids = np.arange(1, len(geoms) + 1)
+
+    # Municípios dividindo o grid ao meio
+    xm = (x0 + x1) / 2
+    municipios = [shp.box(x0 - largura, y0 - altura, xm, y1 + altura), shp.box(xm, y0 - altura, x1 + largura, y1 + altura)]
+
+    return gpd.GeoDataFrame(data={'id': np.concatenate([ids, CD_MUN]),
+                                  'id_layer': ['CAR'] * len(geoms) + ['MUN'] * len(municipios),
+                                  'geom': np.concatenate([geoms, np.array(municipios, dtype=object)])},
+                            geometry='geom', crs='EPSG:4674')
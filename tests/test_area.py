@@ -0,0 +1,62 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely as shp
+from pyproj import Geod
+from area import UTM_EPSG_BRAZIL, area_ha, utm_zone
+
+
+# Área dos cacos (area.py) com a zona UTM de cada caco, contra a reprojeção do grid inteiro para uma única zona (a versão
+# anterior) e contra a área geodésica.
+
+GRID = (-50.5, -10.0, -45.5, -9.0)  # Cruza a divisa das zonas 22 e 23 (-48°)
+
+
+def _cacos():
+    # Um caco perto do meridiano central de cada zona (-51° e -45°) e um na divisa
+    return np.array([shp.box(-50.45, -9.6, -50.35, -9.5), shp.box(-45.65, -9.6, -45.55, -9.5),
+                     shp.box(-48.05, -9.6, -47.95, -9.5)], dtype=object)
+
+
+def _area_geodesica(geoms):
+    geod = Geod(ellps='GRS80')
+    return np.array([abs(geod.geometry_area_perimeter(g)[0]) / 10000 for g in geoms])
+
+
+def _area_zona_unica(geoms, epsg):
+    return gpd.GeoSeries(geoms, crs='EPSG:4674').to_crs(epsg=epsg).area.to_numpy() / 10000
+
+
+def test_utm_zone():
+    assert utm_zone([-51.0, -48.01, -47.99, -45.0]).tolist() == [22, 22, 23, 23]
+    # Fora do Brasil fica na zona mais próxima
+    assert utm_zone([-120.0, 10.0]).tolist() == [min(UTM_EPSG_BRAZIL), max(UTM_EPSG_BRAZIL)]
+
+
+def test_cada_caco_na_sua_zona():
+    cacos = _cacos()
+    area = area_ha(cacos)
+    assert area[0] == pytest.approx(_area_zona_unica(cacos[:1], 32722)[0], rel=1e-9)
+    assert area[1] == pytest.approx(_area_zona_unica(cacos[1:2], 32723)[0], rel=1e-9)
+
+
+def test_mais_proxima_da_geodesica_que_a_zona_unica():
+    cacos = _cacos()
+    geodesica = _area_geodesica(cacos)
+    # Versão anterior: o grid inteiro na zona da longitude média (-48°, zona 23)
+    zona_unica = _area_zona_unica(cacos, UTM_EPSG_BRAZIL[int(utm_zone((GRID[0] + GRID[2]) / 2))])
+    por_zona = area_ha(cacos)
+
+    erro_por_zona = np.abs(por_zona / geodesica - 1)
+    erro_zona_unica = np.abs(zona_unica / geodesica - 1)
+    # O caco do lado oeste fica a 5,5° do meridiano central da zona única: erro de quase 1%. Com a zona de cada caco o erro
+    # fica no do UTM dentro da zona (0,07% no meridiano central, menos de 0,2% na divisa)
+    assert erro_zona_unica[0] > 0.005
+    assert (erro_por_zona < 0.002).all()
+    assert erro_por_zona[0] < erro_zona_unica[0] / 10
+    # Os cacos que já estavam na zona 23 não mudam
+    assert por_zona[1:] == pytest.approx(zona_unica[1:], rel=1e-9)
+
+
+def test_sem_cacos():
+    assert area_ha([]).tolist() == []
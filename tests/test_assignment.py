@@ -0,0 +1,84 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely as shp
+from assignment import ARQUIVO_DUPLICACAO, build_assignment
+from grid import square_grid
+from input_source import AssignmentInputSource, MemoryInputSource
+from synthetic import generate_mosaic
+
+
+# Atribuição em uma passada (assignment.py): partições por célula e contagens do fator de duplicação.
+
+CELULA = (-50.0, -10.0, -49.0, -9.0)
+
+
+def _dados(tmp_path):
+    gdf = generate_mosaic(cell=CELULA, n_parcels=120, n_vertices=12, n_huge=1, huge_parts=4, huge_vertices=40)
+    # Uma feicao longe do grid, sem célula (além das do mosaico que ficam na margem, fora do grid)
+    fora = gpd.GeoDataFrame(data={'id': [777], 'id_layer': ['CAR']}, geometry=gpd.GeoSeries([shp.box(10, 10, 11, 11)]),
+                            crs='EPSG:4674').rename_geometry('geom')
+    gdf = gpd.GeoDataFrame(data={'id': np.r_[gdf['id'].values, 777], 'id_layer': list(gdf['id_layer']) + ['CAR'],
+                                 'geom': np.r_[gdf.geom.values, fora.geom.values]}, geometry='geom', crs='EPSG:4674')
+    caminho = str(tmp_path / 'input.parquet')
+    gdf.to_parquet(caminho)
+    return gdf, caminho, square_grid(0.25, extent=CELULA)
+
+
+def test_particoes_iguais_a_consulta_por_bbox(tmp_path):
+    gdf, caminho, grid = _dados(tmp_path)
+    saida = str(tmp_path / 'assignment')
+    build_assignment(grid, caminho, saida, batch_rows=33)
+
+    por_celula = AssignmentInputSource(saida, caminho)
+    por_bbox = MemoryInputSource(gdf)
+    for n_grid, celula in zip(grid['id'], grid.geometry.values):
+        a = por_celula.query(n_grid, celula.bounds)
+        b = por_bbox.query(n_grid, celula.bounds)
+        # Mesmas feicoes, na ordem do input_file
+        assert a['id'].tolist() == b['id'].tolist()
+        assert a['id_layer'].tolist() == b['id_layer'].tolist()
+        assert shp.equals_exact(a.geom.values, b.geom.values, tolerance=0).all()
+
+
+def test_contagens_de_duplicacao(tmp_path):
+    gdf, caminho, grid = _dados(tmp_path)
+    saida = str(tmp_path / 'assignment')
+    resumo = build_assignment(grid, caminho, saida, batch_rows=33)
+
+    # Contagem direta: em quantas células (bbox) o bbox de cada feicao toca
+    caixas = shp.box(*shp.bounds(gdf.geom.values).T)
+    celulas = shp.box(*shp.bounds(grid.geometry.values).T)
+    contagens = shp.intersects(caixas[:, None], celulas[None, :]).sum(axis=1)
+    atribuidas = contagens[contagens > 0]
+
+    assert resumo['n_features'] == len(gdf)
+    assert resumo['n_features_sem_celula'] == (contagens == 0).sum() > 0
+    assert resumo['n_pares'] == contagens.sum()
+    assert resumo['fator_max'] == contagens.max()
+    assert resumo['features_em_mais_de_uma_celula'] == (atribuidas > 1).sum()
+    assert resumo['fator_medio'] == round(float(atribuidas.mean()), 3)
+    # Empates na contagem podem sair em qualquer ordem
+    assert resumo['mais_duplicadas'][0]['n_celulas'] == contagens.max()
+    assert resumo['mais_duplicadas'][0]['id'] in gdf['id'].values[contagens == contagens.max()]
+    # As multipartes enormes caem em todas as células
+    assert resumo['n_celulas_com_feicoes'] == len(grid)
+    # O mesmo resumo fica no dataset, e o total de linhas das partições é o número de pares
+    with open(os.path.join(saida, ARQUIVO_DUPLICACAO), encoding='utf-8') as f:
+        assert {k: v for k, v in json.load(f).items() if k != 'segundos'} == \
+               {k: v for k, v in json.loads(json.dumps(resumo, default=str)).items() if k != 'segundos'}
+    assert sum(len(AssignmentInputSource(saida, caminho).query(n, None)) for n in grid['id']) == resumo['n_pares']
+
+
+def test_celula_sem_feicoes(tmp_path):
+    _, caminho, grid = _dados(tmp_path)
+    longe = square_grid(0.25, extent=(0.0, 0.0, 0.5, 0.25))
+    saida = str(tmp_path / 'assignment')
+    resumo = build_assignment(gpd.GeoDataFrame(data={'id': np.r_[grid['id'].values, longe['id'].values]},
+                                               geometry=np.r_[grid.geometry.values, longe.geometry.values],
+                                               crs='EPSG:4674'), caminho, saida)
+    assert resumo['n_celulas_com_feicoes'] == len(grid)
+    for n_grid, celula in zip(longe['id'], longe.geometry.values):
+        assert len(AssignmentInputSource(saida, caminho).query(n_grid, celula.bounds)) == 0
@@ -0,0 +1,158 @@
+import os
+import re
+import uuid
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely as shp
+from bulk_copy import copy_buffer, format_copy_rows
+
+
+# Valores difíceis para o formato texto do COPY e para o literal de array do PostgreSQL. Cada linha gerada pelo
+# format_copy_rows é decodificada de volta (como o PostgreSQL faria) e comparada com o GeoDataFrame original. Com a variável
+# SPLIT_TEST_DATABASE_URL o mesmo conteúdo também passa por um COPY real (copy_buffer).
+
+TEXTOS = ['tab\taqui', 'linha\nnova', 'barra\\invertida', 'retorno\r', 'NULL', '', None]
+ARRAYS = [['a,b', 'chave{x}', 'aspas"dentro', 'barra\\', 'tab\t', 'espaço aqui'],
+          ['', 'NULL', 'null'],
+          None,
+          [],
+          np.array(['CAR', 'MUN']),
+          ['linha\nnova'],
+          ['x']]
+NUMEROS = [np.array([1, 2]), np.array([], dtype=np.int64), None, np.array([-5]), np.array([0, 10 ** 12]), np.array([3]), None]
+BOOLEANOS = pd.array([True, False, None, True, False, None, True], dtype='boolean')
+
+
+def _gdf():
+    geoms = [shp.box(0, 0, 1, 1), shp.Point(-48.5, -10.25), None, shp.box(-1, -1, 0, 0), shp.Polygon(),
+             shp.box(2, 2, 3, 3), shp.box(4, 4, 5, 5)]
+    return gpd.GeoDataFrame({'texto': TEXTOS, 'id_layer': ARRAYS, 'id_feature': NUMEROS, 'is_car': BOOLEANOS},
+                            geometry=geoms, crs='EPSG:4674').rename_geometry('geom')
+
+
+def _campos(linha):
+    # Divide a linha pelos \t reais (os \t dos valores estão escapados)
+    return linha.split('\t')
+
+
+def _unescape(campo):
+    # Inverso do escape do formato texto do COPY
+    if campo == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda m: {'t': '\t', 'n': '\n', 'r': '\r'}.get(m.group(1), m.group(1)), campo)
+
+
+def _parse_array(literal):
+    # Literal de array unidimensional do PostgreSQL -> lista de strings (NULL sem aspas vira None)
+    assert literal[0] == '{' and literal[-1] == '}'
+    corpo = literal[1:-1]
+    if corpo == '':
+        return []
+    valores, i = [], 0
+    while i <= len(corpo):
+        if i < len(corpo) and corpo[i] == '"':
+            i += 1
+            atual = []
+            while corpo[i] != '"':
+                if corpo[i] == '\\':
+                    i += 1
+                atual.append(corpo[i])
+                i += 1
+            valores.append(''.join(atual))
+            i += 1
+        else:
+            fim = corpo.find(',', i)
+            fim = len(corpo) if fim < 0 else fim
+            elemento = corpo[i:fim]
+            assert not any(c in elemento for c in '{}"\\'), elemento
+            valores.append(None if elemento.upper() == 'NULL' else elemento)
+            i = fim
+        assert i == len(corpo) or corpo[i] == ','
+        i += 1
+    return valores
+
+
+def _decodificar(colunas, buffer):
+    texto = buffer.getvalue()
+    assert texto.endswith('\n')
+    linhas = [_campos(linha) for linha in texto[:-1].split('\n')]
+    assert all(len(campos) == len(colunas) for campos in linhas)
+    return [{c: _unescape(v) for c, v in zip(colunas, campos)} for campos in linhas]
+
+
+def test_round_trip_formato_texto():
+    gdf = _gdf()
+    colunas, buffer = format_copy_rows(gdf)
+    assert colunas == ['texto', 'id_layer', 'id_feature', 'is_car', 'geom']
+    linhas = _decodificar(colunas, buffer)
+    assert len(linhas) == len(gdf)
+
+    for i, linha in enumerate(linhas):
+        assert linha['texto'] == TEXTOS[i]
+
+        # NULL e array vazio são diferentes
+        if ARRAYS[i] is None:
+            assert linha['id_layer'] is None
+        else:
+            assert _parse_array(linha['id_layer']) == [str(x) for x in ARRAYS[i]]
+        if NUMEROS[i] is None:
+            assert linha['id_feature'] is None
+        else:
+            assert [int(x) for x in _parse_array(linha['id_feature'])] == NUMEROS[i].tolist()
+
+        assert linha['is_car'] == {True: 't', False: 'f'}.get(BOOLEANOS[i] if BOOLEANOS[i] is not pd.NA else None)
+
+        # Geometria em EWKB hex com o SRID
+        geom = gdf.geometry.iloc[i]
+        if geom is None:
+            assert linha['geom'] is None
+        else:
+            decodificada = shp.from_wkb(bytes.fromhex(linha['geom']))
+            assert shp.get_srid(decodificada) == 4674
+            assert shp.equals_exact(decodificada, geom, tolerance=0) or (geom.is_empty and decodificada.is_empty)
+
+
+def test_array_vazio_e_nulo():
+    gdf = gpd.GeoDataFrame({'id_layer': [[], None, ['']]}, geometry=[shp.Point(0, 0)] * 3, crs='EPSG:4674')
+    _, buffer = format_copy_rows(gdf)
+    assert [linha.split('\t')[0] for linha in buffer.getvalue().splitlines()] == ['{}', '\\N', '{""}']
+
+
+def test_gdf_vazio():
+    colunas, buffer = format_copy_rows(_gdf().iloc[:0])
+    assert buffer.getvalue() == ''
+    assert colunas == ['texto', 'id_layer', 'id_feature', 'is_car', 'geom']
+
+
+@pytest.mark.skipif(not os.getenv('SPLIT_TEST_DATABASE_URL'), reason='SPLIT_TEST_DATABASE_URL não configurada')
+def test_round_trip_copy():
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(os.environ['SPLIT_TEST_DATABASE_URL'])
+    schema = f"teste_{uuid.uuid4().hex[:8]}"
+    # A geometria vai em uma coluna text: o teste não depende do PostGIS e compara o EWKB hex recebido
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema};"
+                          f"CREATE TABLE {schema}.saida (texto text, id_layer text[], id_feature bigint[], is_car boolean, geom text)"))
+    try:
+        gdf = _gdf()
+        colunas, buffer = format_copy_rows(gdf)
+        copy_buffer(engine, buffer, colunas, table_name='saida', schema=schema)
+        with engine.connect() as conn:
+            linhas = conn.execute(text(f"SELECT texto, id_layer, id_feature, is_car, geom FROM {schema}.saida")).fetchall()
+        assert len(linhas) == len(gdf)
+        for i, (texto, id_layer, id_feature, is_car, geom) in enumerate(linhas):
+            assert texto == TEXTOS[i]
+            assert id_layer == (None if ARRAYS[i] is None else [str(x) for x in ARRAYS[i]])
+            assert id_feature == (None if NUMEROS[i] is None else NUMEROS[i].tolist())
+            assert is_car == (None if BOOLEANOS[i] is pd.NA else bool(BOOLEANOS[i]))
+            if gdf.geometry.iloc[i] is None:
+                assert geom is None
+            else:
+                assert shp.get_srid(shp.from_wkb(bytes.fromhex(geom))) == 4674
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
@@ -0,0 +1,63 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely as shp
+from grid import cell_ids, cell_rowcol, occupied_cells, read_mask, square_grid
+from synthetic import generate_mosaic
+
+
+# Grid local (grid.py): a máscara lida em blocos (occupied_cells) contra a máscara carregada inteira, e os ids das células.
+
+
+def _input(tmp_path):
+    gdf = generate_mosaic(cell=(-50.0, -10.0, -49.0, -9.0), n_parcels=150, n_huge=2, huge_parts=5, huge_vertices=50)
+    geoms = list(gdf.geometry.values)
+    # Longe do mosaico: feicoes com bordas e cantos exatamente sobre as bordas das células (as células vizinhas só tocam a
+    # feicao), ponto, linha, vazia e nula
+    geoms += [shp.box(-30.5, 5.5, -30.0, 6.0), shp.Point(-29.0, 7.0), shp.LineString([(-32.0, 4.0), (-31.5, 4.0)]),
+              shp.Polygon(), None]
+    caminho = str(tmp_path / 'input.parquet')
+    gpd.GeoDataFrame({'id': np.arange(len(geoms))}, geometry=geoms, crs='EPSG:4674').rename_geometry('geom').to_parquet(caminho)
+    return caminho
+
+
+@pytest.mark.parametrize('spacing', [0.25, 0.1, 0.05, 1.0])
+def test_mascara_em_blocos_igual_a_carga_completa(tmp_path, spacing):
+    caminho = _input(tmp_path)
+    completo = square_grid(spacing, mask=read_mask(caminho))
+    ids = occupied_cells(caminho, spacing, batch_rows=37)
+    assert ids.tolist() == completo['id'].tolist()
+
+    grid = square_grid(spacing, ids=ids)
+    assert grid['id'].tolist() == completo['id'].tolist()
+    assert shp.equals_exact(grid.geometry.values, completo.geometry.values, tolerance=0).all()
+
+
+def test_ids_com_extensao(tmp_path):
+    caminho = _input(tmp_path)
+    extent = (-49.6, -9.6, -49.3, -9.2)
+    esperado = square_grid(0.1, extent=extent, mask=read_mask(caminho))
+    assert square_grid(0.1, extent=extent, ids=occupied_cells(caminho, 0.1))['id'].tolist() == esperado['id'].tolist()
+
+
+@pytest.mark.parametrize('spacing', [0.25, 0.1, 0.05, 0.3, 7.0])
+def test_cell_ids_ida_e_volta(spacing):
+    linhas, colunas = np.meshgrid(np.arange(-90 / spacing, 90 / spacing, dtype=np.int64)[::7],
+                                  np.arange(-180 / spacing, 180 / spacing, dtype=np.int64)[::11])
+    ids = cell_ids(linhas.ravel(), colunas.ravel(), spacing)
+    assert (ids >= 1).all()
+    assert len(np.unique(ids)) == ids.size
+    l, c = cell_rowcol(ids, spacing)
+    assert (l == linhas.ravel()).all() and (c == colunas.ravel()).all()
+
+
+def test_ids_independem_da_extensao():
+    a = square_grid(0.25, extent=(-50, -10, -49, -9))
+    b = square_grid(0.25, extent=(-50.5, -10.5, -48.8, -8.8))
+    assert set(a['id']) <= set(b['id'])
+    # Mesma célula, mesmo id
+    comum = b[b['id'].isin(a['id'])].sort_values('id')
+    assert shp.equals_exact(a.sort_values('id').geometry.values, comum.geometry.values, tolerance=0).all()
+    # A célula do id começa em coluna * spacing, linha * spacing
+    l, c = cell_rowcol(a['id'], 0.25)
+    assert np.allclose(shp.bounds(a.geometry.values)[:, :2], np.column_stack([c * 0.25, l * 0.25]))
@@ -0,0 +1,145 @@
+import json
+
+import pytest
+from manifest import Manifest
+from split import Splitter
+
+
+# Retomada pelo manifesto (Manifest e Splitter.prepare_run), sem banco: o engine registra os SQLs e devolve as linhas de
+# uma tabela em memória.
+
+
+class _Resultado(list):
+    pass
+
+
+class _Conexao:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def begin(self):
+        return self
+
+    def execute(self, query, params=None):
+        sql = str(query)
+        self.engine.executados.append((sql, params))
+        # SELECT do pending: filtra a tabela em memória pelos status pedidos
+        if sql.startswith('SELECT n_grid FROM'):
+            return _Resultado((g,) for g, s in sorted(self.engine.status.items()) if s in params['status'])
+        return _Resultado()
+
+
+class _Engine:
+    def __init__(self, status=None):
+        self.status = status or {}
+        self.executados = []
+
+    def connect(self):
+        return _Conexao(self)
+
+
+@pytest.mark.parametrize('retry_failed, esperado', [(True, [1, 3, 4]), (False, [1, 4])])
+def test_pending(retry_failed, esperado):
+    engine = _Engine({1: 'pending', 2: 'done', 3: 'failed', 4: 'pending'})
+    assert Manifest('split', 'saida').pending(engine, retry_failed=retry_failed) == esperado
+
+
+def test_create_reset_apaga_o_manifesto():
+    for reset in (True, False):
+        engine = _Engine()
+        Manifest('split', 'saida').create(engine, [3, 1, 2], reset=reset)
+        sqls = [sql for sql, _ in engine.executados]
+        assert any('TRUNCATE split.saida_manifest' in sql for sql in sqls) == reset
+        # Grids novos entram como pending sem alterar os existentes
+        sql, params = engine.executados[-1]
+        assert 'ON CONFLICT DO NOTHING' in sql and params == {'grids': [3, 1, 2]}
+
+
+def test_statements_do_copy():
+    manifest = Manifest('split', 'saida')
+    sql, params = manifest.delete_statement([5, 7])
+    assert sql.startswith('DELETE FROM split.saida WHERE id_feature[1] = ANY(%s)') and params == [[5, 7]]
+
+    done = manifest.done_statements([{'n_grid': 5, 'n_rows': 10, 'elapsed': 1.5, 'tempos': {'split': 1.0}},
+                                     {'n_grid': 7, 'n_rows': 0, 'elapsed': 0.1, 'tempos': {}}])
+    assert [p for _, p in done] == [[10, 1.5, json.dumps({'split': 1.0}), 5], [0, 0.1, '{}', 7]]
+    assert all("status = 'done'" in sql and 'tentativas = tentativas + 1' in sql for sql, _ in done)
+
+
+class _Manifesto:
+    # Manifesto falso: registra as chamadas do prepare_run
+    def __init__(self, status):
+        self.status = status
+        self.chamadas = []
+
+    def elapsed(self, engine):
+        return {g: 2.0 for g, s in self.status.items() if s == 'done'}
+
+    def create(self, engine, grids, reset=True):
+        self.chamadas.append(('create', reset))
+        if reset:
+            self.status = {}
+        for g in grids:
+            self.status.setdefault(g, 'pending')
+
+    def pending(self, engine, retry_failed=True):
+        return sorted(g for g, s in self.status.items() if s in ('pending', 'failed'))
+
+    def attempts(self, engine):
+        return {g: 1 for g, s in self.status.items() if s == 'failed'}
+
+    def summary(self, engine):
+        return {}
+
+
+class _Metricas:
+    def __init__(self):
+        self.resetado = False
+
+    def reset(self):
+        self.resetado = True
+
+
+def _splitter(tmp_path, resume, status):
+    config = {'grid_file': '', 'input_file': '', 'output_path': '', 'schema': 'split', 'num_processes': 1,
+              'arquivos_final': 'saida', 'split_table_name': 'inputs', 'resume': resume}
+    caminho = tmp_path / 'config.json'
+    caminho.write_text(json.dumps(config))
+    splitter = Splitter(config_path=str(caminho), log_file=None)
+    splitter.manifest = _Manifesto(status)
+    splitter.metrics = _Metricas()
+    splitter.tabela = []
+    splitter.create_table_postgresql = lambda engine, drop=True: splitter.tabela.append(drop)
+    return splitter
+
+
+def test_prepare_run_retomada_processa_apenas_pendentes_e_falhos(tmp_path):
+    splitter = _splitter(tmp_path, resume=True, status={1: 'done', 2: 'failed', 3: 'pending'})
+    grids = splitter.prepare_run(engine=None, grids=[1, 2, 3, 4])
+
+    # O grid 4 é novo e entra como pending. A tabela de saída e as métricas são mantidas
+    assert grids == [2, 3, 4]
+    assert splitter.manifest.chamadas == [('create', False)]
+    assert splitter.tabela == [False]
+    assert not splitter.metrics.resetado
+    assert splitter.tentativas_anteriores == {2: 1}
+    assert splitter.tempos_anteriores == {1: 2.0}
+
+
+def test_prepare_run_execucao_nova_processa_todos(tmp_path):
+    splitter = _splitter(tmp_path, resume=False, status={1: 'done', 2: 'failed'})
+    grids = splitter.prepare_run(engine=None, grids=[1, 2, 3])
+
+    assert grids == [1, 2, 3]
+    assert splitter.manifest.chamadas == [('create', True)]
+    assert splitter.tabela == [True]
+    assert splitter.metrics.resetado
+    # Os tempos são lidos antes do reset, para o escalonamento da execução nova
+    assert splitter.tempos_anteriores == {1: 2.0}
+    assert splitter.manifest.status == {1: 'pending', 2: 'pending', 3: 'pending'}
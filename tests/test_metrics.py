@@ -0,0 +1,36 @@
+import json
+import os
+from metrics import MetricsSink, read_metrics, summary, write_prometheus
+
+
+def _registro(n_grid, inicio, pid, elapsed, rss_peak, worker_peak, status='ok'):
+    return {'n_grid': n_grid, 'pid': pid, 'inicio': inicio, 'status': status, 'retries': 0, 'elapsed': elapsed,
+            'tempos': {'intersection_time': elapsed / 2}, 'rss_mb': rss_peak - 1, 'rss_peak_mb': rss_peak,
+            'worker_rss_peak_mb': worker_peak}
+
+
+def test_retomada_fica_com_o_registro_mais_recente(tmp_path):
+    # Na retomada os arquivos não são apagados: o grid 2 falhou na primeira execução e foi refeito por outro processo
+    with open(tmp_path / 'metrics_10.jsonl', 'w') as f:
+        for r in [_registro(1, 100.0, 10, 1.0, 200, 200), _registro(2, 101.0, 10, 9.0, 900, 900, status='erro')]:
+            f.write(json.dumps(r) + '\n')
+    with open(tmp_path / 'metrics_20.jsonl', 'w') as f:
+        f.write(json.dumps(_registro(2, 500.0, 20, 3.0, 300, 300)) + '\n')
+
+    df = read_metrics(str(tmp_path))
+    assert sorted(df['n_grid']) == [1, 2]
+    refeito = df[df['n_grid'] == 2].iloc[0]
+    assert refeito['status'] == 'ok' and refeito['pid'] == 20 and refeito['elapsed'] == 3.0
+    assert '2 grids' in summary(df)
+
+
+def test_pico_por_grid_e_pico_do_worker(tmp_path):
+    sink = MetricsSink(metrics_dir=str(tmp_path), prometheus_file=str(tmp_path / 'split.prom'))
+    # O worker passou por um grid pesado (1000 MB) e depois por grids leves
+    for n, (inicio, pico) in enumerate([(1.0, 1000), (2.0, 150), (3.0, 120)]):
+        sink.write(_registro(n, inicio, os.getpid(), 1.0, pico, 1000))
+    df = sink.consolidate()
+    assert df.sort_values('n_grid')['rss_peak_mb'].tolist() == [1000, 150, 120]
+    texto = open(tmp_path / 'split.prom').read()
+    assert 'split_worker_rss_peak_mb 1000' in texto
+    assert 'split_cell_rss_peak_mb_max 1000' in texto
@@ -0,0 +1,93 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely as shp
+from grid import square_grid
+from planner import FATOR_ID, MAX_DEPTH, GridPlanner, _base_ids
+from synthetic import generate_mosaic
+
+
+# Quadtree do planner: ids das sub-células, limite de profundidade e a medição de carga.
+
+CELULA = (-50.0, -10.0, -49.0, -9.0)
+
+
+def _planner(tmp_path, **kwargs):
+    caminho = str(tmp_path / 'input.parquet')
+    generate_mosaic(cell=CELULA, n_parcels=400, n_vertices=20, n_huge=1, huge_parts=5, huge_vertices=100).to_parquet(caminho)
+    planner = GridPlanner(**kwargs)
+    planner.load_input(caminho, batch_rows=97)
+    return planner, gpd.read_parquet(caminho)
+
+
+def _caminho(id_celula, id_raiz, base):
+    # Dígitos do caminho no quadtree de uma sub-célula ('' para células não divididas)
+    if id_celula == id_raiz:
+        return ''
+    assert id_celula // FATOR_ID == base + id_raiz
+    return str(id_celula % FATOR_ID)
+
+
+def test_base_ids():
+    assert _base_ids(999999) == 0
+    assert _base_ids(1000000) == 10000000
+    assert _base_ids(4312345) == 10000000
+    with pytest.raises(ValueError):
+        _base_ids(10 ** 12)
+
+
+def test_max_depth_maior_que_o_limite():
+    with pytest.raises(ValueError):
+        GridPlanner(max_depth=MAX_DEPTH + 1)
+
+
+@pytest.mark.parametrize('ids', ['pequenos', 'grandes'])
+def test_plano_ids_e_cobertura(tmp_path, ids):
+    planner, _ = _planner(tmp_path, max_features=12, max_vertices=10 ** 9, max_depth=3)
+    grid = square_grid(0.5, extent=CELULA)
+    if ids == 'pequenos':
+        grid['id'] = [11, 12, 21, 22]
+    plano = planner.plan(grid)
+    base = _base_ids(int(grid['id'].max()))
+
+    assert plano['id'].is_unique
+    assert not set(plano['id']) & (set(grid['id']) - set(plano['id_raiz']))
+    # Níveis diferentes no mesmo plano, e células que continuam acima do orçamento param no limite de profundidade
+    assert plano['depth'].nunique() > 1 and plano['depth'].max() == 3
+    assert (plano['n_features'] > 12).any()
+    for linha in plano.itertuples():
+        caminho = _caminho(linha.id, linha.id_raiz, base)
+        # Um dígito de 1 a 4 por nível
+        assert len(caminho) == linha.depth and set(caminho) <= set('1234')
+        # Só ficam acima do orçamento as células no limite de profundidade
+        assert linha.n_features <= 12 or linha.depth == 3
+
+    # As sub-células de cada célula cobrem a célula original sem sobreposição
+    for id_raiz, celula in zip(grid['id'], grid.geometry.values):
+        partes = plano.geometry[plano['id_raiz'] == id_raiz].values
+        assert shp.area(partes).sum() == pytest.approx(celula.area)
+        assert shp.union_all(partes).symmetric_difference(celula).area == pytest.approx(0, abs=1e-12)
+
+
+def test_plano_ids_estaveis(tmp_path):
+    planner, _ = _planner(tmp_path, max_features=60, max_depth=2)
+    grid = square_grid(0.5, extent=CELULA)
+    assert planner.plan(grid)['id'].tolist() == planner.plan(grid)['id'].tolist()
+
+
+def test_carga_igual_a_contagem_direta(tmp_path):
+    planner, gdf = _planner(tmp_path)
+    celulas = square_grid(0.25, extent=CELULA).geometry.values
+    n_features, n_vertices = planner.carga(celulas)
+
+    geoms = gdf.geometry.values
+    caixas = shp.box(*shp.bounds(geoms).T)
+    for i, celula in enumerate(celulas):
+        envelope = shp.envelope(celula)
+        tocam = shp.intersects(caixas, envelope)
+        assert n_features[i] == tocam.sum()
+        # Vértices das feicoes que estão dentro do bbox da célula (incluindo a borda)
+        coords = shp.get_coordinates(geoms[tocam])
+        xmin, ymin, xmax, ymax = envelope.bounds
+        dentro = (coords[:, 0] >= xmin) & (coords[:, 0] <= xmax) & (coords[:, 1] >= ymin) & (coords[:, 1] <= ymax)
+        assert n_vertices[i] == dentro.sum()
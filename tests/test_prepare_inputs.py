@@ -0,0 +1,200 @@
+import json
+import os
+import re
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import shapely as shp
+import prepare_inputs
+from prepare_inputs import DataProcessor, export_query
+
+
+# Exportação paralela (partições por id ou por faixas de longitude) contra a exportação de um único arquivo, sem banco. O
+# banco é substituído por um engine em memória que executa as condições SQL geradas pelo _partitions sobre as linhas
+# (id, id_layer, geom em EWKB hex, como o psycopg2 devolve a geometria). Algumas feicoes têm o ST_XMin exatamente em um
+# limite de faixa, e uma delas no limite superior da última faixa.
+
+CLAUSE = "SELECT id, id_layer, geom FROM entrada"
+N_PARTICOES = 4
+
+
+def _linhas():
+    rng = np.random.default_rng(0)
+    geoms = []
+    # Extensão de 0 a 10: com 4 partições os limites das faixas são 0, 2.5, 5 e 7.5
+    for x in [0.0, 2.5, 5.0, 7.5, 2.5, 5.0]:
+        geoms.append(shp.box(x, 0, x + 1, 1))
+    geoms.append(shp.Point(10.0, 0.5))
+    for x0, y0 in rng.uniform(0, 9, size=(193, 2)):
+        geoms.append(shp.box(x0, y0, x0 + rng.uniform(0.01, 1), y0 + rng.uniform(0.01, 1)))
+    hexa = shp.to_wkb(shp.set_srid(np.array(geoms), 4674), hex=True, include_srid=True)
+    # Ids com lacunas, para que os limites das faixas de id não caiam sempre em ids existentes
+    ids = np.sort(rng.choice(np.arange(1, 1000), size=len(geoms), replace=False))
+    return [(int(i), ['CAR'] if k % 2 else ['MUN', 'CAR'], h) for k, (i, h) in enumerate(zip(ids, hexa))]
+
+
+LINHAS = _linhas()
+
+
+class _Resultado:
+    def __init__(self, linha):
+        self.linha = linha
+
+    def fetchone(self):
+        return self.linha
+
+
+class _Conexao:
+    # engine.connect(): apenas as consultas de limites do _partitions
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query):
+        sql = str(query)
+        if 'ST_Extent' in sql:
+            bounds = shp.bounds(shp.from_wkb([g for _, _, g in LINHAS]))
+            return _Resultado((bounds[:, 0].min(), bounds[:, 2].max()))
+        if 'min(q.id)' in sql:
+            return _Resultado((min(i for i, _, _ in LINHAS), max(i for i, _, _ in LINHAS)))
+        raise AssertionError(f'Consulta inesperada: {sql}')
+
+
+class _Cursor:
+    def __init__(self):
+        # (nome, oid do tipo), como no cursor do psycopg2
+        self.description = [('id', 23), ('id_layer', 1009), ('geom', 0)]
+        self.linhas = []
+        self.itersize = None
+
+    def execute(self, query):
+        condicao = None
+        if query != CLAUSE:
+            m = re.fullmatch(r"SELECT \* FROM \((.*)\) q WHERE (.*)", query)
+            assert m and m.group(1) == CLAUSE, query
+            # Traduz a condição SQL para Python, com a mesma semântica de >=, < e <=
+            condicao = m.group(2).replace('ST_XMin(q.geom)', 'xmin').replace('q.id', 'id').replace(' AND ', ' and ')
+        self.linhas = [linha for linha in LINHAS if condicao is None or
+                       eval(condicao, {'xmin': shp.bounds(shp.from_wkb(linha[2]))[0], 'id': linha[0]})]
+
+    def fetchmany(self, n):
+        bloco, self.linhas = self.linhas[:n], self.linhas[n:]
+        return bloco
+
+    def close(self):
+        pass
+
+
+class _ConexaoRaw:
+    def cursor(self, name=None):
+        return _Cursor()
+
+    def close(self):
+        pass
+
+
+class _Url:
+    def render_as_string(self, hide_password=True):
+        return 'postgresql://teste'
+
+
+class _Engine:
+    url = _Url()
+
+    def connect(self):
+        return _Conexao()
+
+    def raw_connection(self):
+        return _ConexaoRaw()
+
+    def dispose(self):
+        pass
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    # Os workers do Pool (fork) herdam o create_engine substituído
+    monkeypatch.setattr(prepare_inputs, 'create_engine', lambda *args, **kwargs: _Engine())
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('logs')
+    config = {'skip_input_gen': False, 'input_from_clause': CLAUSE + ';', 'grid_spacing': 0.5,
+              'input_file': str(tmp_path / 'input.parquet'), 'grid_file': str(tmp_path / 'grid.parquet'),
+              'export_gpkg': False, 'export_chunk_rows': 37, 'export_workers': 2, 'export_partitions': N_PARTICOES}
+    with open('config.json', 'w') as f:
+        json.dump(config, f)
+    return DataProcessor(config_path='config.json')
+
+
+def _ler(caminho):
+    tabela = pq.read_table(caminho).sort_by('id')
+    return tabela.column('id').to_pylist(), tabela.column('id_layer').to_pylist(), tabela.column('geom').to_pylist()
+
+
+@pytest.mark.parametrize('partition_by', ['id', 'x'])
+def test_exportacao_paralela_igual_a_unica(processor, tmp_path, partition_by):
+    processor.export_partition_by = partition_by
+
+    unico = str(tmp_path / 'unico.parquet')
+    assert export_query(_Engine(), CLAUSE, unico, chunk_rows=37) == len(LINHAS)
+    assert processor.parallel_export_municipio_data() == len(LINHAS)
+    assert os.path.isdir(processor.output_parquet)
+
+    ids, layers, geoms = _ler(processor.output_parquet)
+    # Sem duplicadas nem lacunas nas bordas das faixas
+    assert len(ids) == len(set(ids)) == len(LINHAS)
+    assert (ids, layers, geoms) == _ler(unico)
+
+
+def test_feicoes_na_borda_caem_em_uma_unica_faixa(processor):
+    processor.export_partition_by = 'x'
+    condicoes = processor._partitions()
+    assert len(condicoes) == N_PARTICOES
+    for xmin in [0.0, 2.5, 5.0, 7.5, 10.0]:
+        faixas = [c for c in condicoes if eval(c.replace('ST_XMin(q.geom)', 'xmin').replace(' AND ', ' and '), {'xmin': xmin})]
+        assert len(faixas) == 1, (xmin, faixas)
+
+
+class _CursorNulos(_Cursor):
+    # Colunas todas nulas no primeiro bloco e preenchidas depois. Guarda a query recebida
+    queries = []
+
+    def __init__(self):
+        super().__init__()
+        self.description = [('id', 23), ('cd_mun', 20), ('tags', 1009), ('obs', 25), ('geom', 0)]
+
+    def execute(self, query):
+        _CursorNulos.queries.append(query)
+        self.linhas = [(i, None if i < 10 else 1500107 + i, None if i < 10 else ['a', 'b'], None, g)
+                       for i, (_, _, g) in enumerate(LINHAS[:25])]
+
+
+class _EngineNulos(_Engine):
+    def raw_connection(self):
+        conexao = _ConexaoRaw()
+        conexao.cursor = lambda name=None: _CursorNulos()
+        return conexao
+
+
+def test_colunas_nulas_no_primeiro_bloco(tmp_path):
+    caminho = str(tmp_path / 'nulos.parquet')
+    assert export_query(_EngineNulos(), CLAUSE, caminho, chunk_rows=10) == 25
+    tabela = pq.read_table(caminho)
+    assert tabela.schema.field('cd_mun').type == 'int64'
+    assert tabela.schema.field('tags').type.value_type == 'string'
+    assert tabela.schema.field('obs').type == 'string'
+    assert tabela.column('cd_mun').to_pylist()[:11] == [None] * 10 + [1500117]
+    assert tabela.column('tags').to_pylist()[24] == ['a', 'b']
+
+
+def test_exportacao_espacial_ordenada_no_banco(tmp_path):
+    _CursorNulos.queries.clear()
+    caminho = str(tmp_path / 'espacial.parquet')
+    export_query(_EngineNulos(), CLAUSE + ';', caminho, spatial_export=True, chunk_rows=10)
+    query = _CursorNulos.queries[0]
+    assert query.startswith(f'SELECT * FROM ({CLAUSE}) s ORDER BY ST_GeoHash(')
+    # A ordem do arquivo é a do banco: os blocos não são reordenados
+    assert pq.read_table(caminho).column('id').to_pylist() == list(range(25))
+    geo = json.loads(pq.read_schema(caminho).metadata[b'geo'])
+    assert 'covering' in geo['columns']['geom']
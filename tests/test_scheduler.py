@@ -0,0 +1,63 @@
+import geopandas as gpd
+import numpy as np
+import shapely as shp
+from scheduler import build_tasks, estimate_costs
+
+
+def _grid(ids, **colunas):
+    return gpd.GeoDataFrame({'id': ids, **colunas}, geometry=[shp.box(i, 0, i + 1, 1) for i in range(len(ids))],
+                            crs='EPSG:4674')
+
+
+def test_tempo_anterior_tem_prioridade():
+    grid = _grid([1, 2, 3], n_vertices=[100, 200, 300])
+    custos = estimate_costs([1, 2, 3], grid, {1: 5.0, 2: 1.0, 3: 2.0})
+    assert custos.tolist() == [5.0, 1.0, 2.0]
+
+
+def test_carga_convertida_pelos_grids_com_as_duas_informacoes():
+    grid = _grid([1, 2, 3], n_vertices=[100, 200, 1000])
+    # 0.01 segundo por vértice nos grids 1 e 2
+    custos = estimate_costs([1, 2, 3], grid, {1: 1.0, 2: 2.0})
+    assert np.allclose(custos, [1.0, 2.0, 10.0])
+
+
+def test_sem_grid_com_as_duas_informacoes_usa_apenas_a_carga():
+    # Retomada com um plano novo: os ids com tempo (os antigos) não estão no plano, e o grid 7 falhou antes e não tem carga
+    grid = _grid([10, 11, 12], n_vertices=[50000, 10, 20000])
+    custos = estimate_costs([7, 10, 11, 12], grid, {7: 300.0, 99: 1.0})
+    assert custos.tolist() == [20000.0, 50000.0, 10.0, 20000.0]
+    # A ordem é a da carga: o grid 7 (sem carga) recebe a mediana, não os 300 segundos
+    assert np.argsort(-custos, kind='stable').tolist() == [1, 0, 3, 2]
+
+
+def test_sem_informacao_custo_uniforme():
+    assert estimate_costs([1, 2], _grid([1, 2])).tolist() == [1.0, 1.0]
+
+
+def test_build_tasks_cada_grid_uma_vez_e_pesados_sozinhos():
+    grids = list(range(1, 41))
+    custos = np.r_[[50.0, 30.0], np.linspace(0.5, 2.0, 38)]
+    tarefas, custos_tarefas = build_tasks(grids, custos, num_processes=2, lotes_por_processo=5)
+    orcamento = custos.sum() / 10
+
+    assert sorted(g for t in tarefas for g in t) == grids
+    # Grids acima do orçamento vão sozinhos e na frente (ordem decrescente de custo)
+    assert tarefas[:2] == [[1], [2]]
+    custo = dict(zip(grids, custos))
+    for tarefa, custo_tarefa in zip(tarefas, custos_tarefas):
+        assert custo_tarefa == sum(custo[g] for g in tarefa)
+    # Os lotes fecham ao atingir o orçamento, apenas o último pode ficar abaixo
+    lotes = [c for t, c in zip(tarefas, custos_tarefas) if len(t) > 1]
+    assert all(c >= orcamento for c in lotes[:-1])
+    assert all(c < 2 * orcamento for c in lotes)
+
+
+def test_build_tasks_custo_uniforme_agrupa_em_lotes_iguais():
+    tarefas, custos_tarefas = build_tasks(list(range(100)), np.ones(100), num_processes=4, lotes_por_processo=5)
+    assert [len(t) for t in tarefas] == [5] * 20
+    assert custos_tarefas == [5.0] * 20
+
+
+def test_build_tasks_vazio():
+    assert build_tasks([], np.array([]), num_processes=4) == ([], [])
@@ -0,0 +1,124 @@
+import json
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely as shp
+from shapely.geometry import LinearRing, MultiLineString, MultiPolygon, Polygon
+from shapely.ops import polygonize
+from shapely.strtree import STRtree
+from input_source import MemoryInputSource
+from split import Splitter
+from synthetic import generate_mosaic
+
+
+# Etapas vetorizadas do split (prepare_split_line, perform_split e process_overlapping) contra a versão anterior, linha a
+# linha, em um mosaico sintético com multipolígonos com buracos.
+
+CELULA = (-50.0, -10.0, -49.5, -9.5)
+N_GRID = 7
+
+
+def _input():
+    gdf = generate_mosaic(cell=CELULA, n_parcels=60, n_vertices=16, overlap_rate=0.2, near_coincident_rate=0, n_huge=1,
+                          huge_parts=4, huge_vertices=64, seed=3)
+    # Multipolígonos com buracos: duas partes com buracos, e um buraco com outra feicao (9003) dentro
+    furado = MultiPolygon([Polygon(shp.box(-49.95, -9.95, -49.85, -9.85).exterior.coords,
+                                   [shp.box(-49.93, -9.93, -49.87, -9.87).exterior.coords]),
+                           Polygon(shp.box(-49.75, -9.75, -49.6, -9.6).exterior.coords,
+                                   [shp.box(-49.72, -9.72, -49.68, -9.68).exterior.coords,
+                                    shp.box(-49.66, -9.66, -49.63, -9.63).exterior.coords])])
+    furado_aninhado = MultiPolygon([Polygon(shp.box(-49.8, -9.9, -49.55, -9.8).exterior.coords,
+                                            [shp.box(-49.75, -9.88, -49.6, -9.82).exterior.coords]),
+                                    shp.box(-49.58, -9.98, -49.52, -9.92)])
+    extras = gpd.GeoDataFrame(data={'id': [9001, 9002, 9003], 'id_layer': ['UC', 'TI', 'UC']},
+                              geometry=gpd.GeoSeries([furado, furado_aninhado, shp.box(-49.7, -9.87, -49.65, -9.83)]),
+                              crs='EPSG:4674').rename_geometry('geom')
+    return gpd.GeoDataFrame(data={'id': np.concatenate([gdf['id'].values, extras['id'].values]),
+                                  'id_layer': list(gdf['id_layer']) + list(extras['id_layer']),
+                                  'geom': np.concatenate([gdf.geom.values, extras.geom.values])},
+                            geometry='geom', crs='EPSG:4674')
+
+
+def _splitter(tmp_path, **config):
+    base = {'grid_file': '', 'input_file': '', 'output_path': '', 'schema': 'public', 'num_processes': 1,
+            'arquivos_final': 'saida', 'split_table_name': 'inputs', 'metrics_dir': str(tmp_path / 'metrics')}
+    base.update(config)
+    caminho = tmp_path / 'config.json'
+    caminho.write_text(json.dumps(base))
+    return Splitter(config_path=str(caminho), log_file=None)
+
+
+def _referencia(gdf, celula, n_grid):
+    # Versão anterior, linha a linha: aneis de cada parte (exterior e buracos), node, polygonize, filtro pelo
+    # representative_point e, para cada caco, query_nearest seguido do intersects com cada feicao candidata
+    linhas = []
+    for geom in gdf.geom:
+        for parte in getattr(geom, 'geoms', [geom]):
+            for anel in [parte.exterior, *parte.interiors]:
+                if anel.is_valid:
+                    linhas.append(LinearRing(anel))
+    linhas.append(LinearRing(celula.exterior))
+    cacos = [p for p in polygonize(shp.node(MultiLineString(linhas)).geoms)
+             if p.representative_point().intersects(celula)]
+    tree = STRtree(gdf.geom.values)
+    atribuicoes = []
+    for caco in cacos:
+        ponto = caco.representative_point()
+        vizinhos = gdf.iloc[tree.query_nearest(ponto)]
+        vizinhos = vizinhos[vizinhos.geom.intersects(ponto)]
+        atribuicoes.append(sorted(zip(vizinhos['id_layer'], vizinhos['id'])))
+    return cacos, atribuicoes
+
+
+@pytest.mark.parametrize('clip_to_cell', [True, False])
+def test_split_vetorizado_igual_a_versao_anterior(tmp_path, clip_to_cell):
+    gdf = _input()
+    celula = shp.box(*CELULA)
+    grid_gdf = gpd.GeoDataFrame(data={'id': [N_GRID]}, geometry=[celula], crs='EPSG:4674')
+
+    splitter = _splitter(tmp_path, clip_to_cell=clip_to_cell)
+    splitter._intersection(N_GRID, grid_gdf, MemoryInputSource(gdf))
+    splitter.prepare_split_line()
+    splitter.perform_split()
+    splitter.process_overlapping()
+    cacos = splitter.gdf_broken_glass
+
+    ref_cacos, ref_atribuicoes = _referencia(splitter.gdf_input_intersection, celula, N_GRID)
+    assert len(cacos) == len(ref_cacos)
+    assert shp.area(cacos.geometry.values).sum() == pytest.approx(celula.area, rel=1e-9)
+
+    # Cada caco da referência corresponde ao caco vetorizado que contém o seu representative_point, com a mesma área e as
+    # mesmas feicoes
+    pontos = shp.point_on_surface(np.array(ref_cacos, dtype=object))
+    idx_ref, idx_caco = STRtree(cacos.geometry.values).query(pontos, predicate='intersects')
+    assert np.array_equal(np.sort(idx_ref), np.arange(len(ref_cacos)))
+    assert len(np.unique(idx_caco)) == len(cacos)
+    for i, j in zip(idx_ref, idx_caco):
+        assert cacos.geometry.values[j].area == pytest.approx(ref_cacos[i].area, rel=1e-6, abs=1e-15)
+        assert cacos['id_layer'].iloc[j][0] == 'GRID' and cacos['id_feature'].iloc[j][0] == N_GRID
+        assert sorted(zip(cacos['id_layer'].iloc[j][1:], cacos['id_feature'].iloc[j][1:])) == ref_atribuicoes[i]
+
+
+def test_buracos_nao_herdam_a_feicao(tmp_path):
+    gdf = _input()
+    celula = shp.box(*CELULA)
+    grid_gdf = gpd.GeoDataFrame(data={'id': [N_GRID]}, geometry=[celula], crs='EPSG:4674')
+
+    splitter = _splitter(tmp_path)
+    splitter._intersection(N_GRID, grid_gdf, MemoryInputSource(gdf))
+    splitter.prepare_split_line()
+    splitter.perform_split()
+    splitter.process_overlapping()
+    cacos = splitter.gdf_broken_glass
+
+    # Os buracos viram cacos próprios (a versão original usava apenas o exterior da primeira parte) e não recebem a
+    # feicao furada. Os cacos da 9003, dentro do buraco da 9002, recebem a 9003 mas não a 9002
+    for buraco, id_furado in [((-49.93, -9.93, -49.87, -9.87), 9001), ((-49.72, -9.72, -49.68, -9.68), 9001),
+                              ((-49.66, -9.66, -49.63, -9.63), 9001), ((-49.75, -9.88, -49.6, -9.82), 9002)]:
+        dentro = cacos[cacos.representative_point().within(shp.box(*buraco))]
+        assert len(dentro) > 0
+        assert all(id_furado not in ids for ids in dentro['id_feature'])
+    aninhado = cacos[cacos.representative_point().within(shp.box(-49.7, -9.87, -49.65, -9.83))]
+    assert len(aninhado) > 0 and all(9003 in ids and 9002 not in ids for ids in aninhado['id_feature'])
+    assert shp.area(cacos.geometry.values).sum() == pytest.approx(celula.area, rel=1e-9)
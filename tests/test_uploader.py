@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from uploader import _identificacao, _pendentes
+
+
+# Escolha dos arquivos a enviar pelo upload_full_folder a partir da tabela de controle, sem banco.
+
+
+def _arquivos(tmp_path, nomes):
+    caminhos = []
+    for nome in nomes:
+        caminho = tmp_path / nome
+        caminho.write_bytes(b'parquet')
+        caminhos.append(str(caminho))
+    return caminhos
+
+
+def test_envia_apenas_os_que_faltam(tmp_path):
+    a, b, c = _arquivos(tmp_path, ['a.parquet', 'b.parquet', 'c.parquet'])
+    carregados = {arquivo: (tamanho, mtime) for arquivo, tamanho, mtime in map(_identificacao, [a, c])}
+    assert _pendentes([a, b, c], carregados) == [b]
+    assert _pendentes([a, b, c], {}) == [a, b, c]
+
+
+def test_mesmo_nome_em_outra_pasta_e_outro_arquivo(tmp_path):
+    (tmp_path / 'x').mkdir()
+    (tmp_path / 'y').mkdir()
+    a, = _arquivos(tmp_path / 'x', ['a.parquet'])
+    b, = _arquivos(tmp_path / 'y', ['a.parquet'])
+    arquivo, tamanho, mtime = _identificacao(a)
+    assert _pendentes([a, b], {arquivo: (tamanho, mtime)}) == [b]
+
+
+@pytest.mark.parametrize('mudanca', ['tamanho', 'mtime'])
+def test_arquivo_alterado_interrompe_o_upload(tmp_path, mudanca):
+    a, b = _arquivos(tmp_path, ['a.parquet', 'b.parquet'])
+    carregados = {arquivo: (tamanho, mtime) for arquivo, tamanho, mtime in map(_identificacao, [a])}
+    if mudanca == 'tamanho':
+        with open(a, 'ab') as f:
+            f.write(b'mais linhas')
+    else:
+        info = os.stat(a)
+        os.utime(a, (info.st_atime, info.st_mtime + 60))
+    with pytest.raises(ValueError, match='a.parquet'):
+        _pendentes([a, b], carregados)
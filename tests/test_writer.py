@@ -0,0 +1,103 @@
+import os
+import queue
+import subprocess
+import sys
+
+import pytest
+import writer
+from manifest import Manifest
+from writer import WriterError, run_writer, send_to_writers
+
+
+# Processo escritor (writer.py) sem banco: o COPY é substituído por uma função que registra os lotes.
+
+
+class _Engine:
+    def __init__(self):
+        self.fechado = False
+
+    def dispose(self):
+        self.fechado = True
+
+
+class _Manifesto(Manifest):
+    # Manifesto real para os SQLs do COPY, mas o mark_failed_many apenas registra os grids
+    def __init__(self):
+        super().__init__('split', 'saida')
+        self.falhos = []
+
+    def mark_failed_many(self, engine, grids, erro):
+        self.falhos.append((grids, str(erro)))
+
+
+def _item(n_grid, linhas, colunas=('id_layer', 'id_feature', 'geom')):
+    texto = ''.join(f'{n_grid}\t{i}\n' for i in range(linhas))
+    return n_grid, list(colunas), texto, linhas, {'n_grid': n_grid, 'n_rows': linhas, 'elapsed': 0.1, 'tempos': {}}
+
+
+def _executar(monkeypatch, tmp_path, itens, falhar=(), **limites):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('logs', exist_ok=True)
+    copias = []
+
+    def copy_buffer(engine, buffer, colunas, table_name, schema, before, after):
+        grids = before[0][1][0]
+        if set(grids) & set(falhar):
+            raise RuntimeError('COPY falhou')
+        copias.append({'grids': grids, 'texto': buffer.getvalue(), 'colunas': colunas,
+                       'done': [p[-1] for _, p in after]})
+
+    monkeypatch.setattr(writer, 'copy_buffer', copy_buffer)
+    fila = queue.Queue()
+    for item in itens + [None]:
+        fila.put(item)
+    engine, manifesto = _Engine(), _Manifesto()
+    run_writer(fila, lambda: engine, 'saida', 'split', manifest=manifesto,
+               max_rows=limites.get('max_rows', 10 ** 9), max_bytes=limites.get('max_bytes', 10 ** 9))
+    assert engine.fechado
+    return copias, manifesto
+
+
+def test_lotes_por_numero_de_linhas(monkeypatch, tmp_path):
+    copias, _ = _executar(monkeypatch, tmp_path, [_item(g, 4) for g in range(1, 8)], max_rows=10)
+    # 3 grids de 4 linhas passam de 10 linhas. O resto vai no flush final
+    assert [c['grids'] for c in copias] == [[1, 2, 3], [4, 5, 6], [7]]
+    assert all(c['done'] == c['grids'] for c in copias)
+    assert copias[0]['texto'] == ''.join(_item(g, 4)[2] for g in (1, 2, 3))
+
+
+def test_lotes_por_bytes(monkeypatch, tmp_path):
+    tamanho = len(_item(1, 4)[2])
+    copias, _ = _executar(monkeypatch, tmp_path, [_item(g, 4) for g in range(1, 5)], max_bytes=2 * tamanho)
+    assert [c['grids'] for c in copias] == [[1, 2], [3, 4]]
+
+
+def test_colunas_diferentes_em_copys_separados(monkeypatch, tmp_path):
+    itens = [_item(1, 2), _item(2, 2, colunas=('id_layer', 'id_feature', 'CAR', 'geom')), _item(3, 2)]
+    copias, _ = _executar(monkeypatch, tmp_path, itens)
+    assert sorted((tuple(c['colunas']), tuple(c['grids'])) for c in copias) == \
+        [(('id_layer', 'id_feature', 'CAR', 'geom'), (2,)), (('id_layer', 'id_feature', 'geom'), (1, 3))]
+
+
+def test_falha_do_lote_marca_os_grids_e_segue(monkeypatch, tmp_path):
+    copias, manifesto = _executar(monkeypatch, tmp_path, [_item(g, 5) for g in range(1, 7)], falhar=(3,), max_rows=10)
+    # O lote [3, 4] falha inteiro (uma transação). Os outros lotes são gravados
+    assert [c['grids'] for c in copias] == [[1, 2], [5, 6]]
+    assert manifesto.falhos == [([3, 4], 'COPY falhou')]
+    with open(tmp_path / 'logs' / 'error_grids.txt') as f:
+        assert f.read() == '3\n4\n'
+
+
+def test_send_to_writers_com_escritor_morto():
+    processo = subprocess.Popen([sys.executable, '-c', 'pass'])
+    processo.wait()
+    fila = queue.Queue(maxsize=1)
+    fila.put('cheia')
+    with pytest.raises(WriterError):
+        send_to_writers(fila, 'item', [processo.pid], timeout=0.01)
+
+
+def test_send_to_writers_com_escritor_vivo():
+    fila = queue.Queue(maxsize=1)
+    send_to_writers(fila, 'item', [os.getpid()], timeout=0.01)
+    assert fila.get_nowait() == 'item'
@@ -1,32 +1,200 @@
 import geopandas as gpd
 import os
+import logging
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 from sqlalchemy import create_engine, text
 import pandas as pd
 import numpy as np
-from utils import format_array
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bulk_copy import copy_to_postgis
+from input_source import read_geo_metadata
 import time
 
 
+# Upload da pasta de saída (outputs/) do split por arquivo. Cada arquivo vai em um único COPY, em uma transação que também
+# registra o arquivo (caminho completo, tamanho e data de modificação) na tabela de controle {schema}.{table_name}_uploads.
+# Assim um arquivo nunca fica carregado pela metade e, se o upload for interrompido ou algum arquivo falhar, a próxima
+# chamada envia apenas os arquivos que faltam. Um arquivo já carregado que foi alterado depois interrompe o upload (ver
+# _pendentes). Se a tabela de destino não existir ela é criada a partir do schema do primeiro arquivo.
+# Os arquivos são enviados em paralelo por um Pool de processos, cada um com um engine de uma única conexão.
 
-def upload_parquet(engine, gdf, table_name):
+
+COLUNAS = ['id_layer', 'id_feature']  # Colunas enviadas, além da geometria
+
+
+def upload_parquet(engine, gdf, table_name, schema='split', after=None):
     start_time = time.time()
-    gdf.drop(columns='id', inplace=True)
-    gdf=gdf[['id_layer', 'id_feature', 'geometry']]
-    # Aplicando a função
-    gdf['id_layer'] = format_array(gdf['id_layer'])
-    gdf['id_feature'] = format_array(gdf['id_feature'])
-    gdf.to_postgis(
-        name=table_name,
-        con=engine,
-        schema='split',
-        if_exists="append",
-        index=False
-    )
+    # Seleciona as colunas sem alterar o gdf recebido
+    gdf = gdf[COLUNAS + [gdf.geometry.name]]
+    # Os arrays (np.ndarray) viram arrays do PostgreSQL direto no stream do COPY
+    copy_to_postgis(gdf, engine=engine, table_name=table_name, schema=schema, after=after)
     return time.time() - start_time
 
-def upload_full_folder(engine, folder, table_name):
-    arquivos=os.listdir(folder)
-    for file_path in arquivos:
-        print(f"Uploading {file_path}")
-        gdf=gpd.read_parquet(os.path.join(folder, file_path))
-        upload_parquet(engine=engine, gdf=gdf, table_name=table_name)
\ No newline at end of file
+
+def _tabela_controle(table_name, schema):
+    return f"{schema}.{table_name}_uploads"
+
+
+def _tipo_postgres(tipo):
+    # Tipo da coluna no PostgreSQL a partir do tipo do Arrow (listas viram arrays)
+    if pa.types.is_list(tipo) or pa.types.is_large_list(tipo):
+        return _tipo_postgres(tipo.value_type) + '[]'
+    if pa.types.is_integer(tipo):
+        return 'bigint'
+    if pa.types.is_floating(tipo):
+        return 'double precision'
+    if pa.types.is_boolean(tipo):
+        return 'boolean'
+    return 'text'
+
+
+def _criar_tabela(engine, caminho, table_name, schema, srid=4674):
+    """
+    Cria (se não existir) a tabela de destino com as colunas enviadas pelo upload_parquet, com os tipos do arquivo
+    """
+    geom_col = read_geo_metadata(caminho)['primary_column']
+    campos = pq.read_schema(caminho)
+    colunas = [f'"{c}" {_tipo_postgres(campos.field(c).type)}' for c in COLUNAS]
+    colunas.append(f'"{geom_col}" geometry(Geometry, {srid})')
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema};"))
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {schema}.{table_name} ({', '.join(colunas)});"))
+
+
+def _identificacao(caminho):
+    # Caminho completo, tamanho e data de modificação do arquivo. Arquivos com o mesmo nome em pastas diferentes são distintos
+    info = os.stat(caminho)
+    return os.path.abspath(caminho), info.st_size, info.st_mtime
+
+
+def _arquivos_carregados(engine, table_name, schema):
+    """
+    Cria (se não existir) a tabela de controle e retorna {caminho: (tamanho em bytes, mtime)} dos arquivos já carregados
+    """
+    controle = _tabela_controle(table_name, schema)
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text(f"""CREATE TABLE IF NOT EXISTS {controle} (
+                                    arquivo TEXT PRIMARY KEY,
+                                    tamanho BIGINT,
+                                    mtime DOUBLE PRECISION,
+                                    n_rows INTEGER,
+                                    loaded_at TIMESTAMPTZ DEFAULT now());"""))
+        result = conn.execute(text(f"SELECT arquivo, tamanho, mtime FROM {controle};"))
+        return {r[0]: (r[1], r[2]) for r in result}
+
+
+def _pendentes(arquivos, carregados):
+    """
+    Arquivos que ainda não foram carregados. Um arquivo já carregado que mudou de tamanho ou data de modificação interrompe
+    o upload: as linhas da versão anterior já estão na tabela de destino e não há como separá-las das dos outros arquivos,
+    então reenviar duplicaria o resultado e pular deixaria a tabela com a versão antiga
+
+    Args:
+        arquivos - caminhos dos arquivos .parquet da pasta
+        carregados - {caminho: (tamanho, mtime)} da tabela de controle (ver _arquivos_carregados)
+
+    Returns:
+        Lista dos caminhos a enviar
+    """
+    pendentes, alterados = [], []
+    for caminho in arquivos:
+        arquivo, tamanho, mtime = _identificacao(caminho)
+        if arquivo not in carregados:
+            pendentes.append(caminho)
+        elif tuple(carregados[arquivo]) != (tamanho, mtime):
+            alterados.append(arquivo)
+    if alterados:
+        raise ValueError(f"{len(alterados)} arquivos já carregados mudaram de tamanho ou data de modificação "
+                         f"({', '.join(alterados)}). Apague as linhas deles da tabela de destino e o registro na tabela de "
+                         f"controle antes de reenviar")
+    return pendentes
+
+
+# Estado de cada processo do Pool de upload
+_upload_worker = {}
+
+
+def _init_upload_worker(url):
+    engine = create_engine(url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+    _upload_worker["engine"] = engine
+    # Fecha a conexão quando o worker encerrar
+    Finalize(None, engine.dispose, exitpriority=10)
+
+
+def _upload_file(tarefa):
+    """
+    Envia um arquivo, com até retries tentativas. Retorna (arquivo, linhas, bytes, segundos, tentativas, erro)
+    """
+    caminho, table_name, schema, retries = tarefa
+    arquivo, tamanho, mtime = _identificacao(caminho)
+    controle = _tabela_controle(table_name, schema)
+    start_time = time.time()
+    erro = None
+    for tentativa in range(1, retries + 1):
+        try:
+            gdf = gpd.read_parquet(caminho)
+            # O registro do arquivo na tabela de controle vai na mesma transação do COPY
+            registro = (f"INSERT INTO {controle} (arquivo, tamanho, mtime, n_rows) VALUES (%s, %s, %s, %s);",
+                        [arquivo, tamanho, mtime, len(gdf)])
+            upload_parquet(_upload_worker["engine"], gdf, table_name=table_name, schema=schema, after=[registro])
+            return arquivo, len(gdf), tamanho, time.time() - start_time, tentativa, None
+        except Exception as e:
+            erro = str(e)
+            logging.warning(f"Upload de {arquivo} falhou na tentativa {tentativa}/{retries} ({e})")
+            if tentativa < retries:
+                time.sleep(min(2 ** tentativa, 30))
+    return arquivo, 0, tamanho, time.time() - start_time, retries, erro
+
+
+def upload_full_folder(engine, folder, table_name, schema='split', concurrency=4, retries=3):
+    """
+    Envia todos os arquivos .parquet da pasta para schema.table_name, em paralelo.
+
+    Args:
+        engine - engine do banco, usado para a tabela de controle. Cada worker abre a sua própria conexão com a mesma URL
+        folder - pasta com os arquivos (output_path)
+        table_name, schema - tabela de destino. Se não existir é criada a partir do primeiro arquivo (ver _criar_tabela)
+        concurrency - número de arquivos enviados ao mesmo tempo (processos e conexões)
+        retries - tentativas por arquivo
+
+    Returns:
+        Lista dos arquivos que falharam
+
+    Raises:
+        ValueError - se algum arquivo já carregado mudou desde o upload (ver _pendentes). Nada é enviado
+    """
+    start_time = time.time()
+    arquivos = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith('.parquet')]
+    if arquivos:
+        _criar_tabela(engine, arquivos[0], table_name, schema)
+    carregados = _arquivos_carregados(engine, table_name, schema)
+
+    caminhos = _pendentes(arquivos, carregados)
+    logging.info(f"Upload de {len(caminhos)} arquivos de {folder} ({len(carregados)} já carregados) com {concurrency} workers")
+
+    if not caminhos:
+        return []
+
+    tarefas = [(caminho, table_name, schema, retries) for caminho in caminhos]
+    url = engine.url.render_as_string(hide_password=False)
+    falhas = []
+    linhas_total = bytes_total = 0
+    with Pool(processes=max(1, min(concurrency, len(tarefas))), initializer=_init_upload_worker, initargs=(url,)) as pool:
+        for n, (arquivo, linhas, tamanho, segundos, tentativas, erro) in enumerate(pool.imap_unordered(_upload_file, tarefas), 1):
+            if erro is not None:
+                falhas.append(arquivo)
+                logging.error(f"[{n}/{len(tarefas)}] {arquivo} não foi carregado após {tentativas} tentativas ({erro})")
+                continue
+            linhas_total += linhas
+            bytes_total += tamanho
+            decorrido = time.time() - start_time
+            logging.info(f"[{n}/{len(tarefas)}] {arquivo}: {linhas} linhas em {segundos:.2f} segundos "
+                         f"({linhas / max(segundos, 1e-9):.0f} linhas/s, tentativa {tentativas}) - "
+                         f"total {linhas_total / max(decorrido, 1e-9):.0f} linhas/s, {bytes_total / 1024 ** 2 / max(decorrido, 1e-9):.1f} MB/s")
+
+    logging.info(f"Upload concluído em {time.time() - start_time:.2f} segundos: {linhas_total} linhas, {len(falhas)} arquivos com falha")
+    return falhas
@@ -4,8 +4,11 @@ import os
 import pandas as pd
 import logging
 from split import Splitter
-import subprocess
 import numpy as np
+import json
+import shapely as shp
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 # Função para instanciar e executar o Splitter para um grid específico
@@ -13,27 +16,97 @@ def run_splitter(grid_id, data, config):
     splitter = Splitter(config)
     splitter.run(grid_id, data)
 
-def merge_parquet_files(folder_path, output_file="merged_output"):
+def _merge_geo_metadata(schemas):
+    """
+    Junta os metadados GeoParquet ('geo') de vários arquivos: bbox de todos e união dos tipos de geometria.
+    """
+    geo = json.loads(schemas[0].metadata[b'geo'])
+    for schema in schemas[1:]:
+        outro = json.loads(schema.metadata[b'geo'])
+        for nome, coluna in geo['columns'].items():
+            coluna_outro = outro['columns'].get(nome, {})
+            coluna['geometry_types'] = sorted(set(coluna.get('geometry_types', [])) | set(coluna_outro.get('geometry_types', [])))
+            if 'bbox' in coluna and 'bbox' in coluna_outro:
+                a, b = coluna['bbox'], coluna_outro['bbox']
+                coluna['bbox'] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+            else:
+                coluna.pop('bbox', None)
+    return geo
+
+
+def _to_gpkg(parquet_file, gpkg_file, chunk_rows):
+    """
+    Segunda passada opcional: grava o parquet consolidado em GPKG em blocos de chunk_rows linhas.
+    Listas (id_layer, id_feature) viram texto no formato de array do PostgreSQL, pois o GPKG não tem arrays.
+    """
+    arquivo = pq.ParquetFile(parquet_file)
+    geo = json.loads(arquivo.schema_arrow.metadata[b'geo'])
+    geom_col = geo['primary_column']
+    crs = geo['columns'][geom_col].get('crs')
+    if os.path.exists(gpkg_file):
+        os.remove(gpkg_file)
+    for i, batch in enumerate(arquivo.iter_batches(batch_size=chunk_rows)):
+        df = batch.to_pandas()
+        for coluna in df.columns:
+            if coluna != geom_col and df[coluna].dtype == object and len(df) and isinstance(df[coluna].iloc[0], np.ndarray):
+                df[coluna] = format_array(df[coluna])
+        gdf = gpd.GeoDataFrame(df.drop(columns=geom_col), geometry=shp.from_wkb(df[geom_col].to_numpy()), crs=crs)
+        gdf.to_file(gpkg_file, driver="GPKG", mode='w' if i == 0 else 'a')
+
+
+def merge_parquet_files(folder_path, output_file="merged_output", output_folder='./finais', export_gpkg=False,
+                        gpkg_chunk_rows=100000, remove_inputs=True):
+    """
+    Junta os arquivos Parquet de folder_path em um único GeoParquet, em streaming: cada row group de cada arquivo é lido
+    e gravado em seguida por um único ParquetWriter, então a memória fica limitada a um row group e não ao resultado inteiro.
+
+    Args:
+        folder_path - pasta com os arquivos .parquet (saída do split por arquivo)
+        output_file - nome do arquivo final (sem extensão), gravado em output_folder
+        export_gpkg - grava também um .gpkg, em uma segunda passada em blocos de gpkg_chunk_rows linhas
+        remove_inputs - apaga os arquivos de folder_path depois que o merge termina sem erro
+    """
     start_merge = time.time()
     # Lista todos os arquivos Parquet na pasta especificada
-    parquet_files = [f for f in os.listdir(folder_path) if f.endswith(".parquet")]
+    parquet_files = sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".parquet"))
+    if not parquet_files:
+        logging.info(f"Nenhum arquivo Parquet em {folder_path}")
+        return None
+
+    # Primeira passada apenas nos metadados: schema comum e metadados GeoParquet do resultado
+    schemas = [pq.read_schema(f) for f in parquet_files]
+    schema = pa.unify_schemas([s.remove_metadata() for s in schemas], promote_options='permissive')
+    schema = schema.with_metadata({b'geo': json.dumps(_merge_geo_metadata(schemas)).encode()})
 
-    # Lê e armazena todos os GeoDataFrames em uma lista
-    gdfs = [gpd.read_parquet(os.path.join(folder_path, file)) for file in parquet_files]
+    os.makedirs(output_folder, exist_ok=True)
+    saida = os.path.join(output_folder, f'{output_file}.parquet')
+    temporario = saida + '.tmp'
+    n_linhas = 0
+    with pq.ParquetWriter(temporario, schema) as writer:
+        for arquivo in parquet_files:
+            pf = pq.ParquetFile(arquivo)
+            for i in range(pf.num_row_groups):
+                tabela = pf.read_row_group(i)
+                # Colunas ausentes nesse arquivo entram como nulas
+                colunas = [tabela.column(c) if c in tabela.column_names else pa.nulls(len(tabela), schema.field(c).type)
+                           for c in schema.names]
+                writer.write_table(pa.Table.from_arrays(colunas, schema=schema.remove_metadata()).cast(schema))
+                n_linhas += len(tabela)
+    # O arquivo final só aparece completo
+    os.replace(temporario, saida)
+    logging.info(f"Arquivo concatenado salvo como {saida} ({n_linhas} linhas de {len(parquet_files)} arquivos)")
 
-    # Concatena todos os GeoDataFrames em um só, como um empilhamento direto (rbind)
-    merged_gdf = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=gdfs[0].crs)
-    
-    #Export    
-    merged_gdf.to_file(os.path.join('./finais', f'{output_file}.gpkg'), driver="gpkg")
-    merged_gdf.to_parquet(os.path.join('./finais', f'{output_file}.parquet'))
-    logging.info(f"Arquivo concatenado salvo como {output_file}")
+    if export_gpkg:
+        _to_gpkg(saida, os.path.join(output_folder, f'{output_file}.gpkg'), gpkg_chunk_rows)
 
-    # Usa subprocess para excluir arquivos na pasta .outputs
-    subprocess.run("rm ./outputs/*", shell=True, check=True)
+    # Apaga apenas os arquivos que entraram no merge
+    if remove_inputs:
+        for arquivo in parquet_files:
+            os.remove(arquivo)
 
     elapsed_merge = time.time() - start_merge
     logging.info(f"Tempo para merge dos arquivos Parquet: {elapsed_merge:.2f} segundos")
+    return saida
 
 
 def format_array(column):
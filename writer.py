@@ -0,0 +1,126 @@
+import io
+import logging
+import time
+import os
+from queue import Full
+import psutil
+from bulk_copy import copy_buffer
+
+
+# Processo escritor. Os workers do split não fazem mais o upload de cada grid: eles colocam o lote já formatado para o COPY
+# (ver bulk_copy.format_copy_rows) em uma fila e seguem para o próximo grid. Um ou mais processos escritores esvaziam a fila,
+# juntam os lotes de vários grids até writer_batch_rows linhas ou writer_batch_bytes bytes e fazem um único COPY por lote.
+# A fila tem tamanho máximo, então se os escritores atrasarem o put() dos workers bloqueia (backpressure). O put é feito com
+# timeout (send_to_writers): se um escritor morrer a fila deixa de andar e o worker levanta WriterError em vez de esperar
+# para sempre.
+
+PUT_TIMEOUT = 30  # Segundos entre as verificações dos escritores enquanto a fila está cheia
+
+
+class WriterError(RuntimeError):
+    """
+    Um processo escritor morreu. Não é um erro do grid: interrompe a execução (ver Splitter.run)
+    """
+
+
+def _escritor_vivo(pid):
+    # O escritor é filho do processo principal, não do worker, então Process.is_alive() não funciona aqui. Um escritor
+    # morto ainda não recolhido pelo join fica como zumbi
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def send_to_writers(queue, item, writer_pids, timeout=PUT_TIMEOUT):
+    """
+    Coloca o item na fila dos escritores. Enquanto a fila estiver cheia confere a cada timeout segundos se os escritores
+    estão vivos.
+
+    Raises:
+        WriterError - algum escritor morreu
+    """
+    while True:
+        mortos = [pid for pid in writer_pids if not _escritor_vivo(pid)]
+        if mortos:
+            raise WriterError(f"Processos escritores {mortos} encerraram, o lote do grid não pode ser gravado")
+        try:
+            queue.put(item, timeout=timeout)
+            return
+        except Full:
+            logging.warning(f"Fila dos escritores cheia há {timeout} segundos (worker {os.getpid()})")
+
+
+def stop_writers(queue, writers, timeout=PUT_TIMEOUT):
+    """
+    Envia um None por escritor (cada um grava o que tiver pendente e encerra) e espera os processos. Se os escritores
+    morreram a fila pode estar cheia, então o None só é enviado enquanto houver escritor vivo.
+    """
+    for _ in writers:
+        while any(w.is_alive() for w in writers):
+            try:
+                queue.put(None, timeout=timeout)
+                break
+            except Full:
+                continue
+    for w in writers:
+        w.join()
+        if w.exitcode != 0:
+            logging.error(f"Processo escritor {w.pid} encerrou com código {w.exitcode}")
+
+
+def run_writer(queue, create_engine_fn, table_name, schema, max_rows, max_bytes, manifest):
+    """
+    Loop do processo escritor. Termina ao receber None da fila, depois de gravar o que estiver pendente.
+
+    Args:
+        queue - fila com tuplas (n_grid, colunas, texto do COPY, número de linhas, registro do manifesto)
+        create_engine_fn - função que cria o engine do banco (Splitter.create_db_engine)
+        table_name, schema - tabela de destino
+        max_rows, max_bytes - limites para gravar o lote acumulado
+        manifest - Manifest do split. Os grids do lote são marcados como done na mesma transação do COPY
+    """
+    engine = create_engine_fn()
+    pendentes = {}  # colunas -> lista de lotes. Lotes com colunas diferentes não podem ir no mesmo COPY
+    n_linhas = 0
+    n_bytes = 0
+
+    def flush():
+        nonlocal n_linhas, n_bytes
+        for colunas, lotes in pendentes.items():
+            grids = [n_grid for n_grid, _, _, _ in lotes]
+            linhas = sum(n for _, _, n, _ in lotes)
+            start_time = time.time()
+            try:
+                copy_buffer(engine, io.StringIO(''.join(texto for _, texto, _, _ in lotes)), list(colunas),
+                            table_name=table_name, schema=schema,
+                            before=[manifest.delete_statement(grids)],
+                            after=manifest.done_statements([info for _, _, _, info in lotes]))
+                logging.info(f'Writer {os.getpid()} gravou {linhas} linhas de {len(grids)} grids em {time.time() - start_time:.2f} segundos')
+            except Exception as e:
+                # O lote inteiro falha junto (uma transação), todos os grids dele vão para o arquivo de erro
+                logging.error(f'Writer {os.getpid()} falhou ao gravar os grids {grids} ({e})')
+                with open("logs/error_grids.txt", "a") as error_file:
+                    error_file.write(''.join(f"{n_grid}\n" for n_grid in grids))
+                try:
+                    manifest.mark_failed_many(engine, grids, e)
+                except Exception as e_manifest:
+                    logging.error(f'Writer {os.getpid()} não conseguiu marcar os grids {grids} como failed ({e_manifest})')
+        pendentes.clear()
+        n_linhas = 0
+        n_bytes = 0
+
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            n_grid, colunas, texto, linhas, info = item
+            pendentes.setdefault(tuple(colunas), []).append((n_grid, texto, linhas, info))
+            n_linhas += linhas
+            n_bytes += len(texto)
+            if n_linhas >= max_rows or n_bytes >= max_bytes:
+                flush()
+        flush()
+    finally:
+        engine.dispose()